@@ -15,6 +15,12 @@ BEGIN
       'indicador_esq', 'polegar_esq', 'medio_esq', 'anelar_esq', 'minimo_esq'
     );
   END IF;
+  IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'acao_sensor_enum') THEN
+    CREATE TYPE sistema_biometrico.acao_sensor_enum AS ENUM ('enroll', 'delete', 'delete_all', 'slots');
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'status_comando_enum') THEN
+    CREATE TYPE sistema_biometrico.status_comando_enum AS ENUM ('pendente', 'enviado', 'concluido', 'falhou');
+  END IF;
 END$$;
 
 -- Tabela de usuários
@@ -53,31 +59,243 @@ CREATE TABLE IF NOT EXISTS sistema_biometrico.digitais (
     usuario_id INTEGER NOT NULL REFERENCES sistema_biometrico.usuarios(id)
         ON DELETE CASCADE ON UPDATE CASCADE,
     
-    -- ID (slot) onde o sensor armazenou este template
+    -- Portão (gate do bridge): cada portão tem o seu sensor e os seus slots
+    portao VARCHAR(30) NOT NULL DEFAULT 'principal',
+
+    -- ID (slot) onde o sensor do portão armazenou este template
     -- DY-50: suporta IDs de 1 a 200 (200 templates máximo)
-    sensor_id INTEGER NOT NULL UNIQUE, 
+    sensor_id INTEGER, 
 
 
     dedo sistema_biometrico.tipo_dedo_enum,
     ativo BOOLEAN NOT NULL DEFAULT true,
     criado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
 
-    -- Garante que um usuário não cadastre o mesmo dedo duas vezes
-    UNIQUE (usuario_id, dedo)
+    -- Garante que um usuário não cadastre o mesmo dedo duas vezes no mesmo portão
+    UNIQUE (usuario_id, dedo, portao)
+);
+
+-- Bancos criados antes dos portões: sensor_id era NOT NULL e único no banco
+-- todo, e o dedo era único por usuário. Agora os dois são por portão.
+ALTER TABLE sistema_biometrico.digitais ADD COLUMN IF NOT EXISTS portao VARCHAR(30) NOT NULL DEFAULT 'principal';
+ALTER TABLE sistema_biometrico.digitais ALTER COLUMN sensor_id DROP NOT NULL;
+ALTER TABLE sistema_biometrico.digitais DROP CONSTRAINT IF EXISTS digitais_sensor_id_key;
+DROP INDEX IF EXISTS sistema_biometrico.idx_digitais_sensor_id;
+ALTER TABLE sistema_biometrico.digitais DROP CONSTRAINT IF EXISTS digitais_usuario_id_dedo_key;
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM pg_constraint
+    WHERE conrelid = 'sistema_biometrico.digitais'::regclass
+      AND conname = 'digitais_usuario_id_dedo_portao_key'
+  ) THEN
+    ALTER TABLE sistema_biometrico.digitais
+      ADD CONSTRAINT digitais_usuario_id_dedo_portao_key UNIQUE (usuario_id, dedo, portao);
+  END IF;
+END$$;
+
+-- Índice para busca rápida pelo ID do sensor (único dentro do portão)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_digitais_portao_sensor_id ON sistema_biometrico.digitais (portao, sensor_id);
+
+-- Fila de comandos para o sensor de cada portão (ENROLL/DELETE/DELETE_ALL/SLOTS).
+-- Vão ao bridge um de cada vez por portão e são concluídos pelas linhas de
+-- status do Arduino (ver sensor_jobs.py).
+CREATE TABLE IF NOT EXISTS sistema_biometrico.comandos_sensor (
+    id SERIAL PRIMARY KEY,
+    acao sistema_biometrico.acao_sensor_enum NOT NULL,
+    portao VARCHAR(30) NOT NULL DEFAULT 'principal',
+    sensor_id INTEGER,
+    digital_id INTEGER REFERENCES sistema_biometrico.digitais(id) ON DELETE SET NULL ON UPDATE CASCADE,
+    -- Agrupa os comandos de uma mesma ação do admin (tela de progresso)
+    lote UUID NOT NULL,
+    status sistema_biometrico.status_comando_enum NOT NULL DEFAULT 'pendente',
+    -- Última linha de status recebida (ex: enroll_prompt_1)
+    etapa VARCHAR(30) NOT NULL DEFAULT '',
+    mensagem TEXT NOT NULL DEFAULT '',
+    tentativas SMALLINT NOT NULL DEFAULT 0 CHECK (tentativas >= 0),
+    criado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+    enviado_em TIMESTAMPTZ,
+    concluido_em TIMESTAMPTZ
 );
+CREATE INDEX IF NOT EXISTS idx_comandos_sensor_status ON sistema_biometrico.comandos_sensor (status, id);
+CREATE INDEX IF NOT EXISTS idx_comandos_sensor_lote ON sistema_biometrico.comandos_sensor (lote);
 
--- Índice para busca rápida pelo ID do sensor 
-CREATE UNIQUE INDEX IF NOT EXISTS idx_digitais_sensor_id ON sistema_biometrico.digitais (sensor_id);
+-- Bitmap dos slots ocupados (bit i-1 = sensor_id i, 25 bytes), um par por portão:
+-- 'sensor' é o mapa de alocação (travado com SELECT ... FOR UPDATE para
+-- alocar/liberar slots) e 'leitura' é o último SLOTS lido do próprio DY-50.
+CREATE TABLE IF NOT EXISTS sistema_biometrico.mapa_slots (
+    id SERIAL PRIMARY KEY,
+    nome VARCHAR(50) NOT NULL,
+    portao VARCHAR(30) NOT NULL DEFAULT 'principal',
+    bitmap BYTEA NOT NULL DEFAULT ''::bytea,
+    atualizado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+    UNIQUE (nome, portao)
+);
 -- ============================================================
 
--- Histórico de acessos 
+-- Histórico de acessos
+-- Particionado por mês (RANGE em data_hora). A chave primária e as
+-- restrições UNIQUE precisam incluir data_hora em tabelas particionadas.
+-- Novas partições: `python manage.py historico_partitions roll --table sistema_biometrico.historico_acessos`
+-- (ou a função criar_particao_historico abaixo); partições antigas vão para
+-- arquivo frio com `historico_partitions archive --table sistema_biometrico.historico_acessos`.
+-- Só este schema é particionado: a tabela do Django (biometria_historicoacesso)
+-- continua comum, porque AcessoPendente e Presenca têm FK só para o id dela.
+-- Lá o `archive` exporta e apaga em lotes, e `roll` não tem o que fazer.
 CREATE TABLE IF NOT EXISTS sistema_biometrico.historico_acessos (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     usuario_id INTEGER REFERENCES sistema_biometrico.usuarios(id) ON DELETE SET NULL ON UPDATE CASCADE,
     sala_id INTEGER REFERENCES sistema_biometrico.salas(id) ON DELETE SET NULL ON UPDATE CASCADE,
     data_hora TIMESTAMPTZ NOT NULL DEFAULT now(),
     tipo_acesso sistema_biometrico.tipo_acesso_enum NOT NULL,
     motivo TEXT,
-    metadata JSONB
+    metadata JSONB,
+    -- event_id enviado pelo bridge (evita duplicar eventos reenviados)
+    chave_idempotencia VARCHAR(64),
+    -- Portão onde a digital foi lida
+    portao VARCHAR(30) NOT NULL DEFAULT 'principal',
+    PRIMARY KEY (id, data_hora)
+) PARTITION BY RANGE (data_hora);
+-- Bancos criados antes do particionamento (tabela comum) também recebem a coluna
+ALTER TABLE sistema_biometrico.historico_acessos ADD COLUMN IF NOT EXISTS chave_idempotencia VARCHAR(64);
+ALTER TABLE sistema_biometrico.historico_acessos ADD COLUMN IF NOT EXISTS portao VARCHAR(30) NOT NULL DEFAULT 'principal';
+-- Um índice UNIQUE em tabela particionada precisa incluir data_hora, e aí o mesmo
+-- event_id com outro data_hora passaria. A unicidade fica numa tabela à parte.
+DROP INDEX IF EXISTS sistema_biometrico.idx_historico_chave;
+CREATE INDEX IF NOT EXISTS idx_historico_datahora ON sistema_biometrico.historico_acessos (data_hora);
+
+-- Cria (se não existir) a partição do mês que contém `mes`
+CREATE OR REPLACE FUNCTION sistema_biometrico.criar_particao_historico(mes DATE) RETURNS void AS $$
+DECLARE
+  inicio DATE := date_trunc('month', mes)::date;
+  fim DATE := (date_trunc('month', mes) + interval '1 month')::date;
+BEGIN
+  EXECUTE format(
+    'CREATE TABLE IF NOT EXISTS sistema_biometrico.%I PARTITION OF sistema_biometrico.historico_acessos FOR VALUES FROM (%L) TO (%L)',
+    'historico_acessos_p' || to_char(inicio, 'YYYYMM'), inicio, fim
+  );
+END$$ LANGUAGE plpgsql;
+
+-- Partição DEFAULT (segura linhas fora das partições mensais) + mês atual e os 3 seguintes
+DO $$
+BEGIN
+  IF EXISTS (
+    SELECT 1 FROM pg_partitioned_table
+    WHERE partrelid = 'sistema_biometrico.historico_acessos'::regclass
+  ) THEN
+    CREATE TABLE IF NOT EXISTS sistema_biometrico.historico_acessos_default
+      PARTITION OF sistema_biometrico.historico_acessos DEFAULT;
+    PERFORM sistema_biometrico.criar_particao_historico((date_trunc('month', now()) + make_interval(months => m))::date)
+      FROM generate_series(0, 3) AS m;
+  END IF;
+END$$;
+
+
+-- Chaves de idempotência (event_id do bridge) já usadas: uma por evento, em
+-- qualquer partição. Preenchida pelo trigger abaixo; um INSERT repetido no
+-- histórico falha com unique_violation, como no Django. As chaves ficam
+-- mesmo depois que a partição do evento é arquivada.
+CREATE TABLE IF NOT EXISTS sistema_biometrico.historico_chaves (
+    chave_idempotencia VARCHAR(64) PRIMARY KEY,
+    historico_id BIGINT NOT NULL,
+    data_hora TIMESTAMPTZ NOT NULL
+);
+INSERT INTO sistema_biometrico.historico_chaves (chave_idempotencia, historico_id, data_hora)
+  SELECT chave_idempotencia, id, data_hora FROM sistema_biometrico.historico_acessos
+  WHERE chave_idempotencia IS NOT NULL
+  ON CONFLICT (chave_idempotencia) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION sistema_biometrico.registrar_chave_historico() RETURNS trigger AS $$
+BEGIN
+  IF NEW.chave_idempotencia IS NOT NULL THEN
+    INSERT INTO sistema_biometrico.historico_chaves (chave_idempotencia, historico_id, data_hora)
+      VALUES (NEW.chave_idempotencia, NEW.id, NEW.data_hora);
+  END IF;
+  RETURN NULL;
+END$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_historico_chave ON sistema_biometrico.historico_acessos;
+CREATE TRIGGER trg_historico_chave
+  AFTER INSERT ON sistema_biometrico.historico_acessos
+  FOR EACH ROW EXECUTE FUNCTION sistema_biometrico.registrar_chave_historico();
+
+-- Bancos criados antes do particionamento têm historico_acessos comum, com a
+-- PK só em id: a FK de acessos_pendentes precisa de uma UNIQUE em (id, data_hora).
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM pg_partitioned_table
+    WHERE partrelid = 'sistema_biometrico.historico_acessos'::regclass
+  ) AND NOT EXISTS (
+    SELECT 1 FROM pg_constraint
+    WHERE conrelid = 'sistema_biometrico.historico_acessos'::regclass
+      AND conname = 'historico_acessos_id_data_hora_key'
+  ) THEN
+    ALTER TABLE sistema_biometrico.historico_acessos
+      ADD CONSTRAINT historico_acessos_id_data_hora_key UNIQUE (id, data_hora);
+  END IF;
+END$$;
+
+-- Acessos validados aguardando confirmação de sala (expiram em 30 s).
+-- Tabela pequena: a linha é apagada na confirmação ou após expira_em.
+CREATE TABLE IF NOT EXISTS sistema_biometrico.acessos_pendentes (
+    historico_id BIGINT NOT NULL,
+    historico_data_hora TIMESTAMPTZ NOT NULL,
+    usuario_id INTEGER NOT NULL REFERENCES sistema_biometrico.usuarios(id) ON DELETE CASCADE ON UPDATE CASCADE,
+    portao VARCHAR(30) NOT NULL DEFAULT 'principal',
+    criado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+    expira_em TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (historico_id),
+    FOREIGN KEY (historico_id, historico_data_hora)
+        REFERENCES sistema_biometrico.historico_acessos (id, data_hora) ON DELETE CASCADE
+);
+ALTER TABLE sistema_biometrico.acessos_pendentes ADD COLUMN IF NOT EXISTS portao VARCHAR(30) NOT NULL DEFAULT 'principal';
+CREATE INDEX IF NOT EXISTS idx_acessos_pendentes_expira ON sistema_biometrico.acessos_pendentes (expira_em);
+
+-- Ocupação atual das salas: uma linha por pessoa dentro de cada sala.
+-- Mantida a cada entrada/saída confirmada (ver `rebuild_ocupacao`).
+CREATE TABLE IF NOT EXISTS sistema_biometrico.presencas (
+    id SERIAL PRIMARY KEY,
+    sala_id INTEGER NOT NULL REFERENCES sistema_biometrico.salas(id) ON DELETE CASCADE ON UPDATE CASCADE,
+    usuario_id INTEGER NOT NULL REFERENCES sistema_biometrico.usuarios(id) ON DELETE CASCADE ON UPDATE CASCADE,
+    desde TIMESTAMPTZ NOT NULL DEFAULT now(),
+    historico_id BIGINT,
+    UNIQUE (sala_id, usuario_id)
+);
+
+-- Rollups para relatórios: totais por hora/dia, sala, tipo de acesso e tipo de usuário.
+-- Atualizados de forma incremental pelo comando `refresh_rollups` (marca d'água em rollup_estado).
+CREATE TABLE IF NOT EXISTS sistema_biometrico.rollup_acessos_hora (
+    id BIGSERIAL PRIMARY KEY,
+    inicio TIMESTAMPTZ NOT NULL,
+    sala_id INTEGER REFERENCES sistema_biometrico.salas(id) ON DELETE SET NULL ON UPDATE CASCADE,
+    tipo_acesso sistema_biometrico.tipo_acesso_enum NOT NULL,
+    tipo_usuario sistema_biometrico.tipo_usuario_enum,
+    total INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_rollup_hora_inicio_sala ON sistema_biometrico.rollup_acessos_hora (inicio, sala_id);
+
+CREATE TABLE IF NOT EXISTS sistema_biometrico.rollup_acessos_dia (
+    id BIGSERIAL PRIMARY KEY,
+    dia DATE NOT NULL,
+    sala_id INTEGER REFERENCES sistema_biometrico.salas(id) ON DELETE SET NULL ON UPDATE CASCADE,
+    tipo_acesso sistema_biometrico.tipo_acesso_enum NOT NULL,
+    tipo_usuario sistema_biometrico.tipo_usuario_enum,
+    total INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_rollup_dia_dia_sala ON sistema_biometrico.rollup_acessos_dia (dia, sala_id);
+
+CREATE TABLE IF NOT EXISTS sistema_biometrico.rollup_estado (
+    id SERIAL PRIMARY KEY,
+    nome VARCHAR(50) NOT NULL UNIQUE,
+    ultimo_id BIGINT NOT NULL DEFAULT 0,
+    -- Faixa somada na última execução (recalculada na próxima) e o maior id
+    -- visto, que só vira limite depois de ROLLUP_LAG segundos
+    anterior_id BIGINT NOT NULL DEFAULT 0,
+    visto_id BIGINT NOT NULL DEFAULT 0,
+    visto_em TIMESTAMPTZ,
+    atualizado_em TIMESTAMPTZ NOT NULL DEFAULT now()
 );
-CREATE INDEX IF NOT EXISTS idx_historico_datahora ON sistema_biometrico.historico_acessos (data_hora);
\ No newline at end of file
+ALTER TABLE sistema_biometrico.rollup_estado ADD COLUMN IF NOT EXISTS anterior_id BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE sistema_biometrico.rollup_estado ADD COLUMN IF NOT EXISTS visto_id BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE sistema_biometrico.rollup_estado ADD COLUMN IF NOT EXISTS visto_em TIMESTAMPTZ;
@@ -20,6 +20,86 @@ const unsigned long statusInterval = 5000; // 5 segundos
 String incomingSerialData;
 bool commandInProgress = false; // Trava para não tentar verificar durante um cadastro
 
+// ========== Protocolo binário (ver bridge/framing.py) ==========
+// Quadro: 0xA5 | LEN | OP | PAYLOAD | CRC8 (LEN = OP + PAYLOAD; CRC sobre LEN..PAYLOAD)
+// Ativado pelo comando texto "PROTO:BIN:1" do bridge; até lá tudo sai em JSON.
+const uint8_t FRAME_SOF = 0xA5;
+const uint8_t PROTO_VERSION = 1;
+// Arduino -> bridge
+const uint8_t EV_HELLO = 0x01, EV_HEARTBEAT = 0x02, EV_TEXT = 0x03;
+const uint8_t EV_MATCH = 0x10, EV_NO_MATCH = 0x11, EV_STATUS = 0x20, EV_SLOTS = 0x21;
+// Bridge -> Arduino
+const uint8_t CMD_ENROLL = 0x80, CMD_DELETE = 0x81, CMD_DELETE_ALL = 0x82, CMD_SLOTS = 0x83;
+// Códigos do EV_STATUS (mesma ordem do STATUS_CODES do bridge)
+enum StatusCode : uint8_t {
+  ST_ENROLL_STARTING = 1, ST_ENROLL_PROMPT_1, ST_ENROLL_PROMPT_2, ST_ENROLL_SUCCESS, ST_ENROLL_FAILED,
+  ST_DELETE_SUCCESS, ST_DELETE_FAILED, ST_DELETE_ALL_SUCCESS, ST_DELETE_ALL_FAILED, ST_SLOTS_FAILED, ST_ERROR
+};
+
+bool binaryMode = false;
+uint8_t rxFrame[8];   // comandos têm no máximo LEN + OP + 2 bytes + CRC
+int rxFramePos = -1;  // -1 = fora de um quadro
+
+// ========== Saída (JSON ou quadro) ==========
+
+uint8_t crc8(const uint8_t* data, uint8_t len, uint8_t crc = 0) {
+  while (len--) {
+    crc ^= *data++;
+    for (uint8_t i = 0; i < 8; i++) crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+  }
+  return crc;
+}
+
+void sendFrame(uint8_t op, const uint8_t* payload, uint8_t len) {
+  uint8_t header[2] = { (uint8_t)(len + 1), op };
+  uint8_t crc = crc8(payload, len, crc8(header, 2));
+  Serial.write(FRAME_SOF);
+  Serial.write(header, 2);
+  if (len) Serial.write(payload, len);
+  Serial.write(crc);
+}
+
+/**
+ * @brief Status de comando: {"status":"<name>", "id":N, "msg":"..."} ou EV_STATUS.
+ * id = 0 e msg = NULL são omitidos.
+ */
+void emitStatus(uint8_t code, const char* name, int id = 0, const char* msg = NULL) {
+  if (binaryMode) {
+    uint8_t payload[24] = { code, (uint8_t)(id & 0xFF), (uint8_t)(id >> 8) };
+    uint8_t len = 3;
+    while (msg && *msg && len < sizeof(payload)) payload[len++] = *msg++;
+    sendFrame(EV_STATUS, payload, len);
+    return;
+  }
+  Serial.print("{\"status\":\""); Serial.print(name); Serial.print("\"");
+  if (id) { Serial.print(", \"id\":"); Serial.print(id); }
+  if (msg) { Serial.print(", \"msg\":\""); Serial.print(msg); Serial.print("\""); }
+  Serial.println("}");
+}
+
+void emitMatch(uint16_t id, uint16_t confidence) {
+  if (binaryMode) {
+    uint8_t payload[4] = { (uint8_t)(id & 0xFF), (uint8_t)(id >> 8), (uint8_t)(confidence & 0xFF), (uint8_t)(confidence >> 8) };
+    sendFrame(EV_MATCH, payload, 4);
+    return;
+  }
+  Serial.print("{\"event\":\"match_found\", \"sensor_id\":");
+  Serial.print(id);
+  Serial.print(", \"confidence\":");
+  Serial.print(confidence);
+  Serial.println("}");
+}
+
+void emitNoMatch() {
+  if (binaryMode) sendFrame(EV_NO_MATCH, NULL, 0);
+  else Serial.println("{\"event\":\"match_failed\"}");
+}
+
+void emitHeartbeat() {
+  if (binaryMode) sendFrame(EV_HEARTBEAT, NULL, 0);
+  else Serial.println("[STATUS] Ativo...");
+}
+
 // ========== Funções do LCD ==========
 
 /**
@@ -45,13 +125,13 @@ uint8_t getFingerprintImage() {
       delay(50);
       return p;
     } else if (p == FINGERPRINT_PACKETRECIEVEERR) {
-      Serial.println("{\"status\":\"error\", \"msg\":\"Erro comunicacao\"}");
+      emitStatus(ST_ERROR, "error", 0, "Erro comunicacao");
       return p;
     } else if (p == FINGERPRINT_IMAGEFAIL) {
-      Serial.println("{\"status\":\"error\", \"msg\":\"Erro imagem\"}");
+      emitStatus(ST_ERROR, "error", 0, "Erro imagem");
       return p;
     } else {
-      Serial.println("{\"status\":\"error\", \"msg\":\"Erro desconhecido\"}");
+      emitStatus(ST_ERROR, "error", 0, "Erro desconhecido");
       return p;
     }
     p = finger.getImage();
@@ -66,18 +146,18 @@ void enrollFingerprint(int id) {
   commandInProgress = true;
   // CORREÇÃO: Adicionado .c_str() para converter a String
   lcdMsg("Modo Cadastro", ("ID: " + String(id)).c_str());
-  Serial.println("{\"status\":\"enroll_starting\", \"id\":" + String(id) + "}");
+  emitStatus(ST_ENROLL_STARTING, "enroll_starting", id);
   delay(1000);
 
   // --- Primeira Leitura ---
   lcdMsg("Coloque o dedo", "Aguardando...");
-  Serial.println("{\"status\":\"enroll_prompt_1\"}");
+  emitStatus(ST_ENROLL_PROMPT_1, "enroll_prompt_1");
   
   while (getFingerprintImage() != FINGERPRINT_OK);
   uint8_t p = finger.image2Tz(1); // Salva no buffer 1
   if (p != FINGERPRINT_OK) {
     lcdMsg("Erro Leitura 1", "");
-    Serial.println("{\"status\":\"enroll_failed\", \"msg\":\"Erro Img1\"}");
+    emitStatus(ST_ENROLL_FAILED, "enroll_failed", 0, "Erro Img1");
     commandInProgress = false;
     return;
   }
@@ -87,13 +167,13 @@ void enrollFingerprint(int id) {
 
   // --- Segunda Leitura ---
   lcdMsg("Coloque de novo", "Mesmo dedo...");
-  Serial.println("{\"status\":\"enroll_prompt_2\"}");
+  emitStatus(ST_ENROLL_PROMPT_2, "enroll_prompt_2");
 
   while (getFingerprintImage() != FINGERPRINT_OK);
   p = finger.image2Tz(2); // Salva no buffer 2
   if (p != FINGERPRINT_OK) {
     lcdMsg("Erro Leitura 2", "");
-    Serial.println("{\"status\":\"enroll_failed\", \"msg\":\"Erro Img2\"}");
+    emitStatus(ST_ENROLL_FAILED, "enroll_failed", 0, "Erro Img2");
     commandInProgress = false;
     return;
   }
@@ -103,7 +183,7 @@ void enrollFingerprint(int id) {
   p = finger.createModel();
   if (p != FINGERPRINT_OK) {
     lcdMsg("Erro Combinar", "Tente de novo");
-    Serial.println("{\"status\":\"enroll_failed\", \"msg\":\"Erro Combinar\"}");
+    emitStatus(ST_ENROLL_FAILED, "enroll_failed", 0, "Erro Combinar");
     commandInProgress = false;
     return;
   }
@@ -111,14 +191,14 @@ void enrollFingerprint(int id) {
   p = finger.storeModel(id);
   if (p != FINGERPRINT_OK) {
     lcdMsg("Erro Salvar", "ID ja existe?");
-    Serial.println("{\"status\":\"enroll_failed\", \"msg\":\"Erro Salvar\"}");
+    emitStatus(ST_ENROLL_FAILED, "enroll_failed", 0, "Erro Salvar");
     commandInProgress = false;
     return;
   }
 
   // CORREÇÃO: Adicionado .c_str() para converter a String
   lcdMsg("Cadastro OK!", ("ID: " + String(id)).c_str());
-  Serial.println("{\"status\":\"enroll_success\", \"id\":" + String(id) + "}");
+  emitStatus(ST_ENROLL_SUCCESS, "enroll_success", id);
   delay(2000);
   commandInProgress = false;
 }
@@ -136,10 +216,10 @@ void deleteFingerprint(int id) {
   if (p == FINGERPRINT_OK) {
     // CORREÇÃO: Adicionado .c_str() para converter a String
     lcdMsg("Deletado OK!", ("ID: " + String(id)).c_str());
-    Serial.println("{\"status\":\"delete_success\", \"id\":" + String(id) + "}");
+    emitStatus(ST_DELETE_SUCCESS, "delete_success", id);
   } else {
     lcdMsg("Erro ao Deletar", "ID nao existe?");
-    Serial.println("{\"status\":\"delete_failed\", \"id\":" + String(id) + "}");
+    emitStatus(ST_DELETE_FAILED, "delete_failed", id);
   }
   delay(2000);
   commandInProgress = false;
@@ -158,15 +238,55 @@ void deleteAllFingerprints() {
   
   if (p == FINGERPRINT_OK) {
     lcdMsg("Memoria Limpa!", "");
-    Serial.println("{\"status\":\"delete_all_success\"}");
+    emitStatus(ST_DELETE_ALL_SUCCESS, "delete_all_success");
   } else {
     lcdMsg("Erro ao Limpar", "");
-    Serial.println("{\"status\":\"delete_all_failed\"}");
+    emitStatus(ST_DELETE_ALL_FAILED, "delete_all_failed");
   }
   delay(2000);
   commandInProgress = false;
 }
 
+/**
+ * @brief Envia o mapa de slots ocupados numa única linha.
+ * Usa o ReadIndexTable (0x1F) do sensor, página 0 (IDs 0-255): 32 bytes,
+ * byte k / bit b = template k*8+b. Formato:
+ * {"status":"slots", "count":N, "bitmap":"<64 hex>"}
+ */
+void dumpSlots() {
+  commandInProgress = true;
+  uint8_t cmd[] = {0x1F, 0x00};
+  Adafruit_Fingerprint_Packet packet(FINGERPRINT_COMMANDPACKET, sizeof(cmd), cmd);
+  finger.writeStructuredPacket(packet);
+
+  if (finger.getStructuredPacket(&packet) != FINGERPRINT_OK
+      || packet.type != FINGERPRINT_ACKPACKET
+      || packet.data[0] != FINGERPRINT_OK) {
+    emitStatus(ST_SLOTS_FAILED, "slots_failed", 0, "ReadIndexTable");
+    commandInProgress = false;
+    return;
+  }
+
+  finger.getTemplateCount();
+  if (binaryMode) {
+    // count u16 + os 32 bytes do índice, já no formato do quadro
+    uint8_t payload[34] = { (uint8_t)(finger.templateCount & 0xFF), (uint8_t)(finger.templateCount >> 8) };
+    memcpy(payload + 2, packet.data + 1, 32);
+    sendFrame(EV_SLOTS, payload, sizeof(payload));
+    commandInProgress = false;
+    return;
+  }
+  Serial.print("{\"status\":\"slots\", \"count\":");
+  Serial.print(finger.templateCount);
+  Serial.print(", \"bitmap\":\"");
+  for (int i = 1; i <= 32; i++) {
+    if (packet.data[i] < 0x10) Serial.print('0');
+    Serial.print(packet.data[i], HEX);
+  }
+  Serial.println("\"}");
+  commandInProgress = false;
+}
+
 
 /**
  * @brief Função principal de verificação 1:N.
@@ -191,18 +311,14 @@ void runVerificationScan() {
     // --- MATCH ENCONTRADO ---
     // CORREÇÃO: Adicionado .c_str() para converter a String
     lcdMsg("Acesso Liberado", ("ID: " + String(finger.fingerID)).c_str());
-    // Envia o JSON de sucesso para o bridge
-    Serial.print("{\"event\":\"match_found\", \"sensor_id\":");
-    Serial.print(finger.fingerID);
-    Serial.print(", \"confidence\":");
-    Serial.print(finger.confidence);
-    Serial.println("}");
+    // Envia o match para o bridge (JSON ou quadro EV_MATCH)
+    emitMatch(finger.fingerID, finger.confidence);
     delay(2000); // Aguarda 2s antes de ler de novo
   } 
   else if (p == FINGERPRINT_NOTFOUND) {
     // --- SEM MATCH ---
     lcdMsg("Acesso Negado", "Tente de novo");
-    Serial.println("{\"event\":\"match_failed\"}");
+    emitNoMatch();
     delay(1000);
   } 
   else {
@@ -212,13 +328,55 @@ void runVerificationScan() {
   }
 }
 
+/**
+ * @brief Executa um comando recebido em quadro binário.
+ */
+void handleCommandFrame(uint8_t op, const uint8_t* payload, uint8_t len) {
+  int id = len >= 2 ? payload[0] | (payload[1] << 8) : 0;
+  if (op == CMD_ENROLL && id > 0) enrollFingerprint(id);
+  else if (op == CMD_DELETE && id > 0) deleteFingerprint(id);
+  else if (op == CMD_DELETE_ALL) deleteAllFingerprints();
+  else if (op == CMD_SLOTS) dumpSlots();
+}
+
+/**
+ * @brief Confirma o protocolo binário com EV_HELLO (versão + templateCount).
+ */
+void enableBinaryMode() {
+  binaryMode = true;
+  finger.getTemplateCount();
+  uint8_t payload[3] = { PROTO_VERSION, (uint8_t)(finger.templateCount & 0xFF), (uint8_t)(finger.templateCount >> 8) };
+  sendFrame(EV_HELLO, payload, 3);
+}
+
 /**
  * @brief Verifica se há comandos chegando do Python (Bridge).
- * Protocolo simples: "COMANDO:VALOR\n"
+ * Protocolo simples: "COMANDO:VALOR\n", ou quadros binários (0xA5 ...)
+ * depois da negociação.
  */
 void checkSerialCommands() {
   while (Serial.available() > 0) {
-    char c = Serial.read();
+    uint8_t b = Serial.read();
+
+    if (rxFramePos >= 0) {
+      // Dentro de um quadro: rxFrame = LEN, OP, PAYLOAD..., CRC
+      rxFrame[rxFramePos++] = b;
+      if (rxFramePos == 1 && (b == 0 || b > sizeof(rxFrame) - 2)) {
+        rxFramePos = -1; // LEN inválido: descarta
+      } else if (rxFramePos > 1 && rxFramePos == rxFrame[0] + 2) {
+        if (crc8(rxFrame, rxFrame[0] + 1) == rxFrame[rxFrame[0] + 1]) {
+          handleCommandFrame(rxFrame[1], rxFrame + 2, rxFrame[0] - 1);
+        }
+        rxFramePos = -1;
+      }
+      continue;
+    }
+    if (b == FRAME_SOF && incomingSerialData.length() == 0) {
+      rxFramePos = 0;
+      continue;
+    }
+
+    char c = (char)b;
     if (c == '\n') {
       // Comando recebido, vamos processar
       incomingSerialData.trim();
@@ -238,6 +396,14 @@ void checkSerialCommands() {
       else if (incomingSerialData.startsWith("DELETE_ALL")) {
         deleteAllFingerprints();
       }
+      else if (incomingSerialData.startsWith("SLOTS")) {
+        dumpSlots();
+      }
+      else if (incomingSerialData.startsWith("PROTO:BIN:")) {
+        if (incomingSerialData.substring(10).toInt() >= 1) {
+          enableBinaryMode();
+        }
+      }
       
       incomingSerialData = ""; // Limpa o buffer de comando
     } else {
@@ -256,7 +422,9 @@ void setup() {
   lcd.init();
   lcd.backlight();
   lcdMsg("Iniciando...", "DY-50");
-  Serial.println("[BOOT] UFCGuard DY50 inicializando...");
+  // proto=binN: o bridge pode pedir o protocolo binário com PROTO:BIN:N
+  Serial.print("[BOOT] UFCGuard DY50 inicializando... proto=bin");
+  Serial.println(PROTO_VERSION);
 
   mySerial.begin(57600); // Comunicação com o sensor
   delay(200);
@@ -293,7 +461,7 @@ void loop() {
   
   // 4. Envia status "Ativo" para o Serial a cada 5s se nada acontecer
   if (millis() - lastStatusTime > statusInterval) {
-    Serial.println("[STATUS] Ativo...");
+    emitHeartbeat();
     lcdMsg("Aguardando", "Coloque dedo");
     lastStatusTime = millis();
   }
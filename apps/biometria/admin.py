@@ -2,9 +2,17 @@ import requests
 import os
 from django.contrib import admin, messages
 from django.conf import settings
-from .models import Usuario, Sala, Digital, UsuarioSala, HistoricoAcesso
-from django.urls import path
+from django.contrib.admin.views.main import ORDER_VAR, PAGE_VAR, ChangeList
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Count, Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from .models import Usuario, Sala, Digital, UsuarioSala, HistoricoAcesso, ComandoSensor, AcaoSensor, PORTAO_PADRAO
+from . import sensor_jobs, sensor_slots
+from django.urls import path, reverse
 from django.shortcuts import redirect
+from django.template.response import TemplateResponse
 
 # Helper para chamar nossa própria API interna
 def send_admin_command(command_type: str, sensor_id: int):
@@ -48,8 +56,8 @@ class DigitalInline(admin.TabularInline):
     O cadastro em si é feito no ModelAdmin 'Digital'
     """
     model = Digital
-    fields = ['sensor_id', 'dedo', 'ativo']
-    readonly_fields = ['sensor_id', 'dedo', 'ativo']
+    fields = ['portao', 'sensor_id', 'dedo', 'ativo']
+    readonly_fields = ['portao', 'sensor_id', 'dedo', 'ativo']
     extra = 0
     can_delete = False
     
@@ -102,18 +110,27 @@ class UsuarioAdmin(admin.ModelAdmin):
     )
     
     readonly_fields = ['criado_em']
+
+    def get_queryset(self, request):
+        # Contagens numa única consulta (evita 2 COUNTs por linha da listagem)
+        return super().get_queryset(request).annotate(
+            _total_salas=Count('usuariosala', distinct=True),
+            _total_digitais=Count('digitais', filter=Q(digitais__ativo=True), distinct=True),
+        )
     
     def total_salas(self, obj):
         """Mostra quantas salas o usuário tem acesso"""
-        count = UsuarioSala.objects.filter(usuario=obj).count()
+        count = obj._total_salas
         return f"{count} salas" if count > 0 else "Nenhuma"
     total_salas.short_description = 'Salas Autorizadas'
+    total_salas.admin_order_field = '_total_salas'
     
     def total_digitais(self, obj):
         """Mostra quantas digitais o usuário tem cadastradas"""
-        count = Digital.objects.filter(usuario=obj, ativo=True).count()
+        count = obj._total_digitais
         return f"{count} digitais" if count > 0 else "Nenhuma"
     total_digitais.short_description = 'Digitais Ativas'
+    total_digitais.admin_order_field = '_total_digitais'
 
 
 @admin.register(Sala)
@@ -133,12 +150,16 @@ class SalaAdmin(admin.ModelAdmin):
     )
     
     readonly_fields = ['criado_em']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_total_usuarios=Count('usuariosala'))
     
     def total_usuarios(self, obj):
         """Mostra quantos usuários têm acesso a esta sala"""
-        count = UsuarioSala.objects.filter(sala=obj).count()
+        count = obj._total_usuarios
         return f"{count} usuários" if count > 0 else "Nenhum"
     total_usuarios.short_description = 'Usuários Autorizados'
+    total_usuarios.admin_order_field = '_total_usuarios'
 
 
 @admin.register(UsuarioSala)
@@ -178,9 +199,9 @@ class DigitalAdmin(admin.ModelAdmin):
     """
     Gerenciamento de digitais com comando global de limpeza.
     """
-    list_display = ('sensor_id', 'usuario', 'get_dedo_display', 'ativo')
+    list_display = ('sensor_id', 'portao', 'usuario', 'get_dedo_display', 'ativo')
     search_fields = ('usuario__nome', 'usuario__codigo', 'sensor_id')
-    list_filter = ('ativo', 'dedo')
+    list_filter = ('portao', 'ativo', 'dedo')
     autocomplete_fields = ('usuario',)
     actions = ['send_enroll_command', 'send_delete_command']
 
@@ -196,59 +217,194 @@ class DigitalAdmin(admin.ModelAdmin):
         urls = super().get_urls()
         my_urls = [
             path('wipe_sensor/', self.admin_site.admin_view(self.wipe_sensor_view), name='digital_wipe_sensor'),
+            path('reconcile_sensor/', self.admin_site.admin_view(self.reconcile_sensor_view), name='digital_reconcile_sensor'),
+            path('comandos/<uuid:lote>/', self.admin_site.admin_view(self.comandos_view), name='digital_comandos'),
         ]
         return my_urls + urls
 
+    def changelist_view(self, request, extra_context=None):
+        # Um par de botões (reconciliar/limpar) por portão
+        extra_context = dict(extra_context or {}, portoes=sensor_slots.portoes())
+        return super().changelist_view(request, extra_context)
+
     def wipe_sensor_view(self, request):
         """
-        Função executada ao clicar no botão 'LIMPAR MEMÓRIA DO SENSOR'.
+        Função executada ao clicar no botão 'LIMPAR MEMÓRIA DO SENSOR' (?portao=).
         """
-        from .views import send_bridge_command # Reutiliza nosso helper
-        
-        # Envia comando DELETE_ALL para o bridge
-        ok, response = send_bridge_command("DELETE_ALL")
-        
-        if ok:
-            self.message_user(request, "Comando DELETE_ALL enviado! O sensor está sendo limpo.", messages.WARNING)
-        else:
-            self.message_user(request, f"Falha ao enviar comando: {response}", messages.ERROR)
-            
-        # Redireciona de volta para a lista
-        return redirect('..')
+        portao = request.GET.get('portao') or PORTAO_PADRAO
+        # DELETE_ALL entra na fila do sensor como qualquer outro comando
+        lote = sensor_jobs.enqueue(AcaoSensor.DELETE_ALL, portao=portao)
+        sensor_jobs.advance_in_background()
+        self.message_user(request, f"Comando DELETE_ALL na fila! O sensor do portão {portao} será limpo.",
+                          messages.WARNING)
+        return redirect('admin:digital_comandos', lote=lote)
+
+    def reconcile_sensor_view(self, request):
+        """Lê os slots do sensor do portão; os DELETE/ENROLL que faltam entram no mesmo lote."""
+        portao = request.GET.get('portao') or PORTAO_PADRAO
+        lote = sensor_jobs.start_reconcile(portao)
+        sensor_jobs.advance_in_background()
+        self.message_user(request, f"Lendo os slots do sensor do portão {portao} para reconciliar com as digitais.",
+                          messages.INFO)
+        return redirect('admin:digital_comandos', lote=lote)
+
+    def comandos_view(self, request, lote):
+        """Progresso de um lote de comandos (recarrega sozinha até terminar)."""
+        # Garante que a fila ande mesmo se alguma linha de status do sensor se perdeu
+        sensor_jobs.advance_queue()
+        context = dict(
+            self.admin_site.each_context(request),
+            title="Comandos do sensor",
+            opts=self.model._meta,
+            lote=lote,
+            **sensor_jobs.lote_progress(lote),
+        )
+        return TemplateResponse(request, "admin/biometria/digital/comandos.html", context)
 
     # --- Ações Existentes ---
 
+    def _enqueue(self, request, queryset, acao):
+        # Não espera o sensor: grava a fila e mostra a tela de progresso
+        lote = sensor_jobs.enqueue(acao, digitais=queryset.order_by('sensor_id'))
+        # Digitais sem sensor_id ficam de fora da fila
+        enfileirados = ComandoSensor.objects.filter(lote=lote).count()
+        if not enfileirados:
+            self.message_user(request, "Nenhuma das digitais selecionadas tem ID no sensor: nada foi enviado.",
+                              messages.WARNING)
+            return None
+        sensor_jobs.advance_in_background()
+        self.message_user(request, f"{enfileirados} comando(s) {acao.upper()} na fila do sensor.", messages.SUCCESS)
+        return redirect(reverse('admin:digital_comandos', kwargs={'lote': lote}))
+
     @admin.action(description='1. [Cadastrar] Enviar comando de cadastro ao sensor')
     def send_enroll_command(self, request, queryset):
-        for digital in queryset:
-            from .views import send_bridge_command
-            ok, response = send_bridge_command(f"ENROLL:{digital.sensor_id}")
-            if ok:
-                self.message_user(request, f"Comando ENROLL para ID {digital.sensor_id} enviado.", messages.SUCCESS)
-            else:
-                self.message_user(request, f"Erro no ID {digital.sensor_id}: {response}", messages.ERROR)
+        return self._enqueue(request, queryset, AcaoSensor.ENROLL)
 
     @admin.action(description='2. [Deletar] Enviar comando de deleção ao sensor')
     def send_delete_command(self, request, queryset):
-        for digital in queryset:
-            from .views import send_bridge_command 
-            ok, response = send_bridge_command(f"DELETE:{digital.sensor_id}")
-            if ok:
-                self.message_user(request, f"Comando DELETE para ID {digital.sensor_id} enviado.", messages.SUCCESS)
-            else:
-                self.message_user(request, f"Erro no ID {digital.sensor_id}: {response}", messages.ERROR)
+        return self._enqueue(request, queryset, AcaoSensor.DELETE)
+
+
+@admin.register(ComandoSensor)
+class ComandoSensorAdmin(admin.ModelAdmin):
+    """Histórico da fila de comandos do sensor (só leitura)."""
+    list_display = ('id', 'comando', 'portao', 'digital', 'status', 'etapa', 'tentativas', 'criado_em', 'concluido_em', 'mensagem')
+    list_filter = ('status', 'acao', 'portao')
+    list_select_related = ('digital__usuario',)
+    readonly_fields = [f.name for f in ComandoSensor._meta.fields]
+    ordering = ('-id',)
+
+    def has_add_permission(self, request):
+        return False
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator para tabelas muito grandes (histórico).
+
+    - Sem filtros, no PostgreSQL: usa a estimativa do planner (pg_class.reltuples)
+      em vez de SELECT COUNT(*) na tabela inteira.
+    - Com filtros (ou em outros bancos): conta no máximo `count_limit` linhas;
+      páginas além disso não são listadas.
+
+    Isso resolve só o COUNT; para ir fundo no histórico sem OFFSET use o link
+    "Próximos" (keyset, ver KeysetChangeList).
+    """
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if connection.vendor == 'postgresql' and not query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)",
+                    [query.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] > self.count_limit:
+                return int(row[0])
+        return self.object_list[:self.count_limit].count()
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Navegação por keyset no histórico: `?apos=<data_hora>_<id>` lista os
+    registros logo depois (mais antigos que) desse, pelo índice de
+    (data_hora, id), sem OFFSET. O link "Próximos" leva o cursor da última
+    linha da página; as páginas numeradas continuam existindo (OFFSET), boas
+    para as primeiras páginas. Com outra ordenação (`?o=`) o cursor é ignorado.
+    """
+    cursor_var = 'apos'
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(self.cursor_var, None)
+        return lookup_params
+
+    def parse_cursor(self, value):
+        data_hora, _, pk = (value or '').rpartition('_')
+        data_hora = parse_datetime(data_hora) if data_hora else None
+        if data_hora is None or not pk.isdigit():
+            return None
+        return data_hora, int(pk)
+
+    def get_queryset(self, request, exclude_parameters=None):
+        qs = super().get_queryset(request, exclude_parameters)
+        cursor = self.parse_cursor(request.GET.get(self.cursor_var))
+        if cursor and ORDER_VAR not in self.params:
+            data_hora, pk = cursor
+            qs = qs.filter(Q(data_hora__lt=data_hora) | Q(data_hora=data_hora, id__lt=pk))
+        return qs
+
+    def get_results(self, request):
+        super().get_results(request)
+        self.next_page_url = None
+        if ORDER_VAR in self.params or self.show_all:
+            return
+        # Avalia a página aqui (o template reaproveita o resultado)
+        rows = list(self.result_list)
+        if len(rows) == self.list_per_page:
+            last = rows[-1]
+            self.next_page_url = self.get_query_string(
+                {self.cursor_var: f"{last.data_hora.isoformat()}_{last.pk}"}, [PAGE_VAR],
+            )
 
 
 @admin.register(HistoricoAcesso)
 class HistoricoAcessoAdmin(admin.ModelAdmin):
-    list_display = ('data_hora', 'usuario', 'sala', 'tipo_acesso', 'motivo', 'metadata')
-    list_filter = ('tipo_acesso', 'sala', 'data_hora')
+    list_display = ('data_hora', 'portao', 'usuario', 'sala', 'tipo_acesso', 'motivo', 'resumo_metadata')
+    list_filter = ('portao', 'tipo_acesso', 'sala', 'data_hora')
     search_fields = ('usuario__nome', 'usuario__codigo', 'sala__nome', 'motivo')
     readonly_fields = [f.name for f in HistoricoAcesso._meta.fields]
+    # Tabela só cresce: joins na mesma consulta, sem COUNT(*) total e ordem pelo índice
+    list_select_related = ('usuario', 'sala')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-data_hora', '-id')
+
+    def get_changelist(self, request, **kwargs):
+        # Páginas profundas: "Próximos" por keyset em vez de OFFSET
+        return KeysetChangeList
+
+    def resumo_metadata(self, obj):
+        """Resumo curto do metadata (sensor, confiança, status) no lugar do JSON inteiro."""
+        meta = obj.metadata or {}
+        partes = []
+        if meta.get('sensor_id') is not None:
+            partes.append(f"ID {meta['sensor_id']}")
+        if meta.get('confidence') is not None:
+            partes.append(f"conf. {meta['confidence']}")
+        if meta.get('status'):
+            partes.append(meta['status'])
+        return " · ".join(partes) or "-"
+    resumo_metadata.short_description = 'Metadata'
 
     def has_add_permission(self, request):
         return False
     def has_change_permission(self, request, obj=None):
         return False
     def has_delete_permission(self, request, obj=None):
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,233 @@
+"""
+Benchmark do fluxo de match: log_access -> check_pending -> confirm_room.
+
+- `seed()` cria usuários, salas, permissões e digitais (bulk_create).
+- `measure_queries()` faz uma passada sequencial com o test client e conta as
+  consultas de cada endpoint (número determinístico, bom para comparar).
+- `run_load()` dispara `clients` threads, cada uma repetindo o fluxo
+  `iterations` vezes, pelo test client (in-process) ou contra um live server
+  (HTTP de verdade), e mede a latência de cada requisição.
+- `compare()` aponta regressões em relação a um baseline salvo.
+
+Usado pelo comando `benchmark_api`, que cuida do banco de teste.
+"""
+import random
+import threading
+import time
+import uuid
+
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from .models import Dedo, Digital, Sala, TipoAcesso, Usuario, UsuarioSala
+from .sensor_cache import MAX_SENSOR_ID, sensor_cache
+
+ENDPOINTS = [
+    ('log_access', '/api/log_access/'),
+    ('check_pending', '/api/check_pending/'),
+    ('confirm_room', '/api/confirm_room/'),
+]
+
+PERCENTILES = (50, 95, 99)
+
+
+def seed(usuarios=200, salas=20, salas_por_usuario=2):
+    """Popula o banco. Só os primeiros 200 usuários recebem digital (limite do sensor)."""
+    sala_objs = Sala.objects.bulk_create([Sala(nome=f"Sala {i}") for i in range(salas)])
+    usuario_objs = Usuario.objects.bulk_create([
+        Usuario(nome=f"Usuário {i}", codigo=f"B{i:06d}") for i in range(usuarios)
+    ])
+    UsuarioSala.objects.bulk_create([
+        UsuarioSala(usuario=usuario, sala=sala_objs[(i + j) % salas])
+        for i, usuario in enumerate(usuario_objs)
+        for j in range(min(salas_por_usuario, salas))
+    ])
+    Digital.objects.bulk_create([
+        Digital(usuario=usuario, sensor_id=i + 1, dedo=Dedo.INDICADOR_DIR)
+        for i, usuario in enumerate(usuario_objs[:MAX_SENSOR_ID])
+    ])
+    # bulk_create não dispara os signals que limpam o cache
+    sensor_cache.invalidate()
+    return {
+        'usuarios': len(usuario_objs),
+        'salas': len(sala_objs),
+        'sensor_ids': list(range(1, min(usuarios, MAX_SENSOR_ID) + 1)),
+        'sala_ids': [sala.id for sala in sala_objs],
+    }
+
+
+def percentile(sorted_values, p):
+    """Percentil pelo método nearest-rank (lista já ordenada)."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class TestClientTransport:
+    """
+    Requisições in-process pelo django.test.Client (um por thread). Com
+    `query_counts` (dict), guarda o máximo de consultas por path.
+    """
+
+    def __init__(self, query_counts=None):
+        self.client = Client()
+        self.query_counts = query_counts
+
+    def _request(self, method, path, **kwargs):
+        if self.query_counts is None:
+            response = getattr(self.client, method)(path, **kwargs)
+        else:
+            with CaptureQueriesContext(connection) as ctx:
+                response = getattr(self.client, method)(path, **kwargs)
+            self.query_counts[path] = max(self.query_counts.get(path, 0), len(ctx.captured_queries))
+        return response.status_code, response.json()
+
+    def get(self, path):
+        return self._request('get', path)
+
+    def post(self, path, data):
+        return self._request('post', path, data=data, content_type='application/json')
+
+
+class HttpTransport:
+    """
+    Requisições HTTP reais contra um live server. Uma conexão por requisição:
+    com keep-alive o servidor de desenvolvimento do Django esbarra no delayed
+    ACK do TCP e soma ~40 ms a cada resposta, o que mascararia a medição.
+    """
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url
+        self.requests = requests
+
+    def get(self, path):
+        response = self.requests.get(self.base_url + path, timeout=30)
+        return response.status_code, response.json()
+
+    def post(self, path, data):
+        response = self.requests.post(self.base_url + path, json=data, timeout=30)
+        return response.status_code, response.json()
+
+
+def match_flow(transport, sensor_id, sala_ids, record):
+    """Um match completo, como o bridge e o dashboard fazem. `record(nome, segundos, ok)`."""
+    payload = {'sensor_id': sensor_id, 'confidence': 90, 'received_at': time.time(),
+               'event_id': uuid.uuid4().hex}
+
+    start = time.perf_counter()
+    status_code, _ = transport.post('/api/log_access/', payload)
+    record('log_access', time.perf_counter() - start, status_code == 200)
+
+    start = time.perf_counter()
+    status_code, data = transport.get('/api/check_pending/')
+    record('check_pending', time.perf_counter() - start, status_code == 200)
+
+    # Com vários clientes o pendente mais recente pode ser de outro; confirma o que vier
+    if not data.get('pending'):
+        return
+    salas = [sala['id'] for sala in data.get('salas_permitidas', [])] or sala_ids
+    start = time.perf_counter()
+    status_code, _ = transport.post('/api/confirm_room/', {
+        'access_id': data['access_id'], 'sala_id': random.choice(salas),
+        'tipo_acesso': random.choice([TipoAcesso.ENTRADA, TipoAcesso.SAIDA]),
+    })
+    # 409: outro cliente confirmou o mesmo pendente antes (resultado esperado na corrida)
+    record('confirm_room', time.perf_counter() - start, status_code in (200, 409))
+
+
+def measure_queries(seeded, iterations=5):
+    """Máximo de consultas por endpoint numa passada sequencial com o test client."""
+    def record(name, elapsed, ok):
+        pass
+
+    # A primeira passada carrega o cache de sensores; não entra na contagem
+    match_flow(TestClientTransport(), seeded['sensor_ids'][0], seeded['sala_ids'], record)
+    by_path = {}
+    transport = TestClientTransport(query_counts=by_path)
+    for i in range(iterations):
+        sensor_id = seeded['sensor_ids'][i % len(seeded['sensor_ids'])]
+        match_flow(transport, sensor_id, seeded['sala_ids'], record)
+    return {name: by_path.get(path) for name, path in ENDPOINTS}
+
+
+def run_load(seeded, clients=8, iterations=50, base_url=None):
+    """
+    Roda o fluxo em `clients` threads. Sem `base_url` usa o test client
+    (in-process); com `base_url` faz HTTP contra o live server.
+    """
+    latencies = {name: [] for name, _ in ENDPOINTS}
+    errors = {name: 0 for name, _ in ENDPOINTS}
+    failures = []
+    lock = threading.Lock()
+
+    def record(name, elapsed, ok):
+        with lock:
+            latencies[name].append(elapsed)
+            if not ok:
+                errors[name] += 1
+
+    def worker(seed_value):
+        rnd = random.Random(seed_value)
+        transport = HttpTransport(base_url) if base_url else TestClientTransport()
+        try:
+            for _ in range(iterations):
+                try:
+                    match_flow(transport, rnd.choice(seeded['sensor_ids']), seeded['sala_ids'], record)
+                except Exception as e:
+                    # Timeout, resposta que não é JSON etc.: conta à parte, sem latência
+                    with lock:
+                        failures.append(repr(e))
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker, args=(i,), name=f'bench-{i}') for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    endpoints = {}
+    for name, values in latencies.items():
+        values.sort()
+        endpoints[name] = {
+            'count': len(values),
+            'errors': errors[name],
+            'mean_ms': round(sum(values) / len(values) * 1000, 3) if values else None,
+        }
+        for p in PERCENTILES:
+            value = percentile(values, p)
+            endpoints[name][f'p{p}_ms'] = round(value * 1000, 3) if value is not None else None
+    return {
+        'elapsed_s': round(elapsed, 3),
+        'matches_per_s': round(len(latencies['log_access']) / elapsed, 1) if elapsed else None,
+        'failures': len(failures),
+        'first_failure': failures[0] if failures else None,
+        'endpoints': endpoints,
+    }
+
+
+def compare(result, baseline, tolerance=0.25):
+    """
+    Lista de regressões: consultas acima do baseline (comparação exata) ou
+    p95/p99 acima de baseline * (1 + tolerance).
+    """
+    problems = []
+    for name, current in result['endpoints'].items():
+        base = baseline.get('endpoints', {}).get(name)
+        if not base:
+            continue
+        if base.get('queries') is not None and current.get('queries', 0) > base['queries']:
+            problems.append(f"{name}: {current['queries']} consultas (baseline {base['queries']})")
+        for key in ('p95_ms', 'p99_ms'):
+            if base.get(key) and current.get(key) and current[key] > base[key] * (1 + tolerance):
+                problems.append(f"{name}: {key} {current[key]:.1f} ms (baseline {base[key]:.1f} ms)")
+        if current.get('errors'):
+            problems.append(f"{name}: {current['errors']} erro(s)")
+    if result.get('failures'):
+        problems.append(f"{result['failures']} fluxo(s) interrompidos: {result['first_failure']}")
+    return problems
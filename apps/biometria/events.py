@@ -0,0 +1,64 @@
+"""
+Canal de push dos acessos pendentes para os dashboards.
+
+`log_access` e `log_access_batch` publicam aqui assim que gravam um match;
+servidos via ASGI, os dashboards ficam esperando (SSE em `pending_stream`,
+ou long-poll em `wait_pending`) sem prender uma thread.
+
+O compose sobe o Django no uvicorn (biometria_server/asgi.py); com
+`manage.py runserver`, que é WSGI, não há push.
+
+O broadcaster é em memória, por processo: só acorda os dashboards atendidos
+pelo mesmo processo que recebeu o POST do bridge. Por isso o dashboard
+também consulta `check_pending` (o banco) a cada 10 s, o que cobre os
+matches recebidos por outro worker; no WSGI, onde SSE e long-poll respondem
+501, essa consulta passa a ser a cada 2 s, como antes do push.
+"""
+import asyncio
+import threading
+
+
+class PendingBroadcaster:
+    """
+    Guarda o último evento publicado e uma versão que cresce a cada publish.
+    Quem espera informa a última versão que viu e acorda quando ela muda.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = set()  # (loop, asyncio.Event)
+        self.version = 0
+        self.last_event = None
+
+    def publish(self, event):
+        """Pode ser chamado de qualquer thread (ex: on_commit de uma view síncrona)."""
+        with self._lock:
+            self.version += 1
+            self.last_event = event
+            waiters = list(self._waiters)
+        for loop, flag in waiters:
+            try:
+                loop.call_soon_threadsafe(flag.set)
+            except RuntimeError:
+                # Loop já encerrado (cliente desconectou)
+                pass
+
+    async def wait(self, since, timeout):
+        """Espera a versão mudar (ou `timeout` s). Retorna (versão, último evento)."""
+        flag = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), flag)
+        with self._lock:
+            if self.version != since:
+                return self.version, self.last_event
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(flag.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+        return self.version, self.last_event
+
+
+pending_broadcaster = PendingBroadcaster()
@@ -0,0 +1,100 @@
+"""
+Exportação em streaming do histórico de acessos (CSV ou NDJSON).
+
+As linhas são lidas com `.iterator(chunk_size=...)` (cursor do lado do
+servidor no PostgreSQL) e geradas uma a uma, então a memória não cresce com
+o número de registros. Usado pela view `export_history` e pelo comando
+`export_historico`.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import HistoricoAcesso
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_COLUMNS = [
+    ('id', 'id'),
+    ('data_hora', 'data_hora'),
+    ('tipo_acesso', 'tipo_acesso'),
+    ('usuario_id', 'usuario_id'),
+    ('usuario_nome', 'usuario__nome'),
+    ('usuario_codigo', 'usuario__codigo'),
+    ('sala_id', 'sala_id'),
+    ('sala_nome', 'sala__nome'),
+    ('motivo', 'motivo'),
+    ('metadata', 'metadata'),
+]
+
+
+def parse_bound(value, end=False):
+    """
+    Aceita data (AAAA-MM-DD) ou data/hora ISO. Uma data como limite final
+    inclui o dia inteiro. Retorna datetime aware ou None; ValueError se inválido.
+    """
+    if not value:
+        return None
+    dt = parse_datetime(value)
+    if dt is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Data inválida: {value}")
+        if end:
+            day += timedelta(days=1)
+        dt = datetime.combine(day, time.min)
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    return dt
+
+
+def export_queryset(inicio=None, fim=None, sala=None, usuario=None):
+    """Queryset filtrado e ordenado por id, já no formato de tuplas das colunas exportadas."""
+    qs = HistoricoAcesso.objects.all()
+    if inicio:
+        qs = qs.filter(data_hora__gte=parse_bound(inicio))
+    if fim:
+        end = parse_bound(fim, end=True)
+        # Data simples vira o início do dia seguinte (exclusivo); data/hora é inclusiva
+        qs = qs.filter(data_hora__lte=end) if parse_datetime(fim) else qs.filter(data_hora__lt=end)
+    if sala:
+        qs = qs.filter(sala_id=sala)
+    if usuario:
+        qs = qs.filter(usuario_id=usuario)
+    return qs.order_by('id').values_list(*[lookup for _, lookup in EXPORT_COLUMNS])
+
+
+class _Echo:
+    """Pseudo-arquivo: o csv.writer devolve a linha em vez de gravá-la."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([name for name, _ in EXPORT_COLUMNS])
+    for row in queryset.iterator(chunk_size=chunk_size):
+        row = list(row)
+        row[1] = row[1].isoformat()
+        row[-1] = json.dumps(row[-1], cls=DjangoJSONEncoder) if row[-1] is not None else ''
+        yield writer.writerow(row)
+
+
+def iter_ndjson(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    names = [name for name, _ in EXPORT_COLUMNS]
+    for row in queryset.iterator(chunk_size=chunk_size):
+        record = dict(zip(names, row))
+        record['data_hora'] = record['data_hora'].isoformat()
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+
+def iter_export(queryset, formato, chunk_size=EXPORT_CHUNK_SIZE):
+    if formato == 'csv':
+        return iter_csv(queryset, chunk_size)
+    return iter_ndjson(queryset, chunk_size)
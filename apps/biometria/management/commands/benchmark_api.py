@@ -0,0 +1,137 @@
+"""
+Benchmark do fluxo de match (log_access -> check_pending -> confirm_room).
+
+    python manage.py benchmark_api [--clients 8] [--iterations 50] [--usuarios 200] [--live]
+    python manage.py benchmark_api --save-baseline
+    python manage.py benchmark_api --compare [--tolerance 0.25]
+
+Roda num banco de teste descartável criado a partir do DATABASES atual
+(SQLite por padrão; PostgreSQL se o .env apontar para ele). No SQLite o
+banco de teste é um arquivo temporário, para as threads compartilharem.
+
+Os baselines ficam em `benchmarks/baseline_<banco>_<modo>.json`. Com
+`--compare`, o comando falha se alguma contagem de consultas subir ou se o
+p95/p99 passar do baseline + tolerância.
+"""
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from biometria import benchmark
+
+BASELINE_DIR = settings.BASE_DIR.parent / 'benchmarks'
+
+
+class Command(BaseCommand):
+    help = "Mede latência (p50/p95/p99) e consultas por endpoint do fluxo de match."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=8, help="Threads simultâneas.")
+        parser.add_argument('--iterations', type=int, default=50, help="Fluxos completos por thread.")
+        parser.add_argument('--usuarios', type=int, default=200)
+        parser.add_argument('--salas', type=int, default=20)
+        parser.add_argument('--live', action='store_true',
+                            help="HTTP real contra um live server (padrão: test client in-process).")
+        parser.add_argument('--baseline', help="Arquivo de baseline (padrão: benchmarks/baseline_<banco>_<modo>.json).")
+        parser.add_argument('--save-baseline', action='store_true')
+        parser.add_argument('--compare', action='store_true')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Folga relativa de latência no --compare (0.25 = +25%%).")
+        parser.add_argument('--json', action='store_true', help="Imprime o resultado em JSON.")
+
+    def handle(self, *args, **options):
+        mode = 'live' if options['live'] else 'client'
+        baseline_path = options['baseline'] or BASELINE_DIR / f"baseline_{connection.vendor}_{mode}.json"
+
+        old_name = connection.settings_dict['NAME']
+        tmpdir = None
+        if connection.vendor == 'sqlite':
+            tmpdir = tempfile.mkdtemp(prefix='biometria_bench_')
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tmpdir, 'bench.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            result = self.run_benchmark(options, mode)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if tmpdir:
+                connection.settings_dict['TEST']['NAME'] = None
+                os.rmdir(tmpdir)
+
+        self.report(result, options['json'])
+
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+            with open(baseline_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=2, sort_keys=True)
+                f.write('\n')
+            self.stdout.write(f"Baseline salvo em {baseline_path}.")
+
+        if options['compare']:
+            if not os.path.exists(baseline_path):
+                raise CommandError(f"Baseline não encontrado: {baseline_path}")
+            with open(baseline_path, encoding='utf-8') as f:
+                baseline = json.load(f)
+            for key in ('vendor', 'mode', 'clients', 'iterations', 'usuarios', 'salas'):
+                if baseline.get(key) != result[key]:
+                    self.stdout.write(self.style.WARNING(
+                        f"Atenção: {key}={result[key]} difere do baseline ({baseline.get(key)})."
+                    ))
+            problems = benchmark.compare(result, baseline, options['tolerance'])
+            if problems:
+                raise CommandError("Regressões em relação ao baseline:\n  " + "\n  ".join(problems))
+            self.stdout.write(self.style.SUCCESS("Sem regressões em relação ao baseline."))
+
+    def run_benchmark(self, options, mode):
+        seeded = benchmark.seed(usuarios=options['usuarios'], salas=options['salas'])
+        queries = benchmark.measure_queries(seeded)
+
+        if mode == 'live':
+            from django.test.testcases import LiveServerThread, _StaticFilesHandler
+            server = LiveServerThread('127.0.0.1', _StaticFilesHandler)
+            server.daemon = True
+            server.start()
+            server.is_ready.wait()
+            if server.error:
+                raise CommandError(f"Live server não subiu: {server.error}")
+            try:
+                load = benchmark.run_load(seeded, options['clients'], options['iterations'],
+                                          base_url=f"http://{server.host}:{server.port}")
+            finally:
+                server.terminate()
+        else:
+            load = benchmark.run_load(seeded, options['clients'], options['iterations'])
+
+        for name, stats in load['endpoints'].items():
+            stats['queries'] = queries.get(name)
+        load.update(
+            vendor=connection.vendor,
+            mode=mode,
+            clients=options['clients'],
+            iterations=options['iterations'],
+            usuarios=seeded['usuarios'],
+            salas=seeded['salas'],
+        )
+        return load
+
+    def report(self, result, as_json):
+        if as_json:
+            self.stdout.write(json.dumps(result, indent=2, sort_keys=True))
+            return
+        self.stdout.write(
+            f"{result['vendor']} / {result['mode']}: {result['clients']} cliente(s) x "
+            f"{result['iterations']} fluxo(s) em {result['elapsed_s']:.2f} s "
+            f"({result['matches_per_s']} matches/s)"
+        )
+        self.stdout.write(f"{'endpoint':<15}{'n':>6}{'erros':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'consultas':>11}")
+        for name, stats in result['endpoints'].items():
+            self.stdout.write(
+                f"{name:<15}{stats['count']:>6}{stats['errors']:>7}"
+                f"{stats['p50_ms'] or 0:>10.2f}{stats['p95_ms'] or 0:>10.2f}{stats['p99_ms'] or 0:>10.2f}"
+                f"{stats['queries'] if stats['queries'] is not None else '-':>11}"
+            )
+        if result['failures']:
+            self.stdout.write(self.style.WARNING(f"{result['failures']} fluxo(s) interrompidos: {result['first_failure']}"))
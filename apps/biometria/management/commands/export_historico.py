@@ -0,0 +1,44 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from biometria.export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_queryset, iter_export
+
+
+class Command(BaseCommand):
+    help = "Exporta o histórico de acessos em CSV ou NDJSON (streaming, memória constante)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--formato', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--inicio', help="Data (AAAA-MM-DD) ou data/hora ISO inicial.")
+        parser.add_argument('--fim', help="Data (inclui o dia inteiro) ou data/hora ISO final.")
+        parser.add_argument('--sala', type=int, help="ID da sala.")
+        parser.add_argument('--usuario', type=int, help="ID do usuário.")
+        parser.add_argument('--output', '-o', help="Arquivo de saída (padrão: stdout).")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            queryset = export_queryset(
+                inicio=options['inicio'], fim=options['fim'],
+                sala=options['sala'], usuario=options['usuario'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        out = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else sys.stdout
+        rows = 0
+        start = time.perf_counter()
+        try:
+            for chunk in iter_export(queryset, options['formato'], options['chunk_size']):
+                out.write(chunk)
+                rows += 1
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        elapsed = time.perf_counter() - start
+        if options['formato'] == 'csv':
+            rows -= 1  # cabeçalho
+        rate = rows / elapsed if elapsed > 0 else 0
+        self.stderr.write(f"{rows} registro(s) exportado(s) em {elapsed:.2f} s ({rate:.0f} linhas/s).")
@@ -0,0 +1,198 @@
+"""
+Manutenção do histórico de acessos por mês.
+
+    python manage.py historico_partitions roll [--ahead 3]
+    python manage.py historico_partitions archive --older-than 12 [--dest arquivo_historico]
+
+No PostgreSQL, com a tabela particionada por RANGE (data_hora):
+  - `roll` cria as partições mensais `<tabela>_pAAAAMM` do mês atual até
+    `--ahead` meses à frente;
+  - `archive` faz DETACH das partições que terminam antes do corte, exporta
+    cada uma com COPY para `<dest>/<partição>.csv.gz` e dá DROP na tabela.
+
+Em tabela comum (SQLite, ou PostgreSQL sem particionamento) o `archive`
+exporta as linhas antigas em NDJSON gzip (`<dest>/historico_AAAA_MM.ndjson.gz`)
+e as apaga em lotes; `roll` não tem o que fazer.
+
+A tabela do Django (o padrão de `--table`) é sempre comum: AcessoPendente e
+Presenca têm FK só para o id dela, e uma tabela particionada não aceita UNIQUE
+sem data_hora. Só `sistema_biometrico.historico_acessos`, criada pelo
+SQL/estrutura_banco_biometrico.sql, é particionada.
+"""
+import gzip
+import json
+import os
+from datetime import date, datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from biometria.models import HistoricoAcesso
+
+
+def add_months(day, months):
+    """Primeiro dia do mês `months` meses depois do mês de `day`."""
+    index = day.year * 12 + (day.month - 1) + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def split_table(table):
+    """'schema.tabela' -> ('schema', 'tabela'); sem schema -> (None, 'tabela')."""
+    if '.' in table:
+        schema, name = table.split('.', 1)
+        return schema, name
+    return None, table
+
+
+def quote(schema, name):
+    qn = connection.ops.quote_name
+    return f"{qn(schema)}.{qn(name)}" if schema else qn(name)
+
+
+class Command(BaseCommand):
+    help = "Cria partições mensais do histórico e arquiva (detach + export gzip) as antigas."
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['roll', 'archive'])
+        parser.add_argument(
+            '--table', default=HistoricoAcesso._meta.db_table,
+            help="Tabela alvo (padrão: a do model HistoricoAcesso). Aceita 'schema.tabela'.",
+        )
+        parser.add_argument('--ahead', type=int, default=3, help="Meses à frente a criar no roll.")
+        parser.add_argument(
+            '--older-than', type=int, default=12,
+            help="Arquiva meses inteiros anteriores a N meses atrás.",
+        )
+        parser.add_argument('--dest', default='arquivo_historico', help="Diretório dos arquivos .gz.")
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--keep-detached', action='store_true',
+                            help="Não dá DROP na partição depois de exportar.")
+
+    def handle(self, *args, **options):
+        self.schema, self.table = split_table(options['table'])
+        partitioned = self.is_partitioned()
+        month = timezone.localdate().replace(day=1)
+
+        if options['action'] == 'roll':
+            if not partitioned:
+                self.stdout.write(
+                    f"{options['table']} não é particionada: nada a criar. "
+                    "Só sistema_biometrico.historico_acessos (SQL/) é particionada."
+                )
+                return
+            for i in range(options['ahead'] + 1):
+                self.create_partition(add_months(month, i))
+            return
+
+        cutoff = add_months(month, -options['older_than'])
+        os.makedirs(options['dest'], exist_ok=True)
+        if partitioned:
+            self.archive_partitions(cutoff, options['dest'], options['keep_detached'])
+        elif options['table'] == HistoricoAcesso._meta.db_table:
+            self.archive_rows(cutoff, options['dest'], options['chunk_size'])
+        else:
+            raise CommandError("O arquivamento de tabela comum só é suportado para a tabela do model.")
+
+    # --- PostgreSQL particionado ---
+
+    def is_partitioned(self):
+        if connection.vendor != 'postgresql':
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+                [quote(self.schema, self.table)],
+            )
+            return cursor.fetchone() is not None
+
+    def partition_name(self, month):
+        return f"{self.table}_p{month:%Y%m}"
+
+    def create_partition(self, month):
+        name = self.partition_name(month)
+        sql = (
+            f"CREATE TABLE IF NOT EXISTS {quote(self.schema, name)} "
+            f"PARTITION OF {quote(self.schema, self.table)} "
+            f"FOR VALUES FROM (%s) TO (%s)"
+        )
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, [month.isoformat(), add_months(month, 1).isoformat()])
+        except Exception as e:
+            # Ex: a partição DEFAULT já tem linhas desse mês
+            self.stderr.write(f"Falha ao criar {name}: {e}")
+            return
+        self.stdout.write(f"Partição {name} pronta.")
+
+    def list_partitions(self):
+        """Partições mensais (nome, mês) seguindo a convenção <tabela>_pAAAAMM."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE pg_inherits.inhparent = to_regclass(%s)",
+                [quote(self.schema, self.table)],
+            )
+            names = [row[0] for row in cursor.fetchall()]
+        prefix = f"{self.table}_p"
+        partitions = []
+        for name in names:
+            suffix = name[len(prefix):]
+            if name.startswith(prefix) and len(suffix) == 6 and suffix.isdigit():
+                partitions.append((name, date(int(suffix[:4]), int(suffix[4:]), 1)))
+        return sorted(partitions, key=lambda p: p[1])
+
+    def archive_partitions(self, cutoff, dest, keep_detached):
+        for name, month in self.list_partitions():
+            if add_months(month, 1) > cutoff:
+                continue
+            target = os.path.join(dest, f"{name}.csv.gz")
+            with connection.cursor() as cursor:
+                cursor.execute(f"ALTER TABLE {quote(self.schema, self.table)} DETACH PARTITION {quote(self.schema, name)}")
+            # Se o COPY falhar, a partição fica só desanexada (nada se perde)
+            with gzip.open(target, 'wb') as out, connection.cursor() as cursor:
+                cursor.copy_expert(f"COPY {quote(self.schema, name)} TO STDOUT WITH (FORMAT csv, HEADER)", out)
+            if not keep_detached:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"DROP TABLE {quote(self.schema, name)}")
+            self.stdout.write(f"{name} arquivada em {target}.")
+
+    # --- Tabela comum (fallback) ---
+
+    def archive_rows(self, cutoff, dest, chunk_size):
+        """
+        Exporta em NDJSON gzip (um arquivo por mês) e apaga, em lotes por id,
+        as linhas com data_hora anterior ao corte. Cada lote é gravado no
+        arquivo antes de ser apagado: uma queda no meio pode repetir linhas no
+        arquivo, mas nunca perdê-las.
+        """
+        cutoff_dt = timezone.make_aware(datetime(cutoff.year, cutoff.month, 1))
+        fields = [f.attname for f in HistoricoAcesso._meta.concrete_fields]
+        base = HistoricoAcesso.objects.filter(data_hora__lt=cutoff_dt).order_by('id')
+        last_id = 0
+        total = 0
+        files = {}
+        try:
+            while True:
+                rows = list(base.filter(id__gt=last_id).values(*fields)[:chunk_size])
+                if not rows:
+                    break
+                for row in rows:
+                    month = timezone.localtime(row['data_hora'])
+                    key = f"{month:%Y_%m}"
+                    if key not in files:
+                        files[key] = gzip.open(os.path.join(dest, f"historico_{key}.ndjson.gz"), 'at', encoding='utf-8')
+                    files[key].write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+                for handle in files.values():
+                    handle.flush()
+                ids = [row['id'] for row in rows]
+                with transaction.atomic():
+                    HistoricoAcesso.objects.filter(id__in=ids).delete()
+                last_id = ids[-1]
+                total += len(ids)
+        finally:
+            for handle in files.values():
+                handle.close()
+        self.stdout.write(f"{total} registro(s) anteriores a {cutoff:%m/%Y} arquivados em {dest}.")
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from biometria.occupancy import replay_history
+
+
+class Command(BaseCommand):
+    help = "Reconstrói a ocupação das salas (Presenca) relendo o histórico em streaming."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        processed, present = replay_history(chunk_size=options['chunk_size'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{processed} acesso(s) relido(s) em {elapsed:.2f} s; {present} pessoa(s) presente(s)."
+        )
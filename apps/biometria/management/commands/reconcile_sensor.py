@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from biometria import sensor_jobs, sensor_slots
+from biometria.models import PORTAO_PADRAO, AcaoSensor, ComandoSensor, StatusComando
+
+
+class Command(BaseCommand):
+    help = ("Lê o bitmap de slots do sensor (comando SLOTS) e enfileira só os DELETE/ENROLL "
+            "necessários para ele bater com as digitais ativas.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Só mostra o diff contra a última leitura guardada, sem falar com o sensor.")
+        parser.add_argument('--timeout', type=float, default=30,
+                            help="Segundos esperando a resposta do SLOTS.")
+        parser.add_argument('--portao', default=PORTAO_PADRAO,
+                            help=f"Portão (gate do bridge) cujo sensor será reconciliado (padrão: {PORTAO_PADRAO}).")
+
+    def handle(self, *args, **options):
+        portao = options['portao']
+        if options['dry_run']:
+            bits, lido_em = sensor_slots.last_dump(portao)
+            if bits is None:
+                raise CommandError(f"O sensor do portão {portao} ainda não foi lido. Rode sem --dry-run.")
+            diff = sensor_slots.diff_dump(bits, portao)
+            self.stdout.write(f"Última leitura do sensor ({portao}): {lido_em:%d/%m/%Y %H:%M:%S}")
+            self.stdout.write(f"Em dia: {diff['em_dia']}  remover: {diff['remover'] or '-'}  "
+                              f"cadastrar: {diff['cadastrar'] or '-'}")
+            return
+
+        lote = sensor_jobs.start_reconcile(portao)
+        deadline = time.monotonic() + options['timeout']
+        while True:
+            sensor_jobs.advance_queue(portao)
+            comando = ComandoSensor.objects.get(lote=lote, acao=AcaoSensor.SLOTS)
+            if comando.status in (StatusComando.CONCLUIDO, StatusComando.FALHOU):
+                break
+            if time.monotonic() > deadline:
+                raise CommandError(f"Sem resposta do sensor ao SLOTS (lote {lote}); o comando segue na fila.")
+            time.sleep(0.5)
+
+        if comando.status == StatusComando.FALHOU:
+            raise CommandError(f"SLOTS falhou: {comando.mensagem}")
+        self.stdout.write(f"Lote {lote}: {comando.mensagem}.")
+        for outro in ComandoSensor.objects.filter(lote=lote).exclude(pk=comando.pk):
+            self.stdout.write(f"  {outro.comando}")
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from biometria.rollups import ROLLUP_CHUNK, ROLLUP_LAG, refresh_rollups
+
+
+class Command(BaseCommand):
+    help = "Atualiza os rollups de acessos (hora/dia) a partir da marca d'água. Rode via cron."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=ROLLUP_CHUNK,
+                            help="Quantidade de ids processados por transação.")
+        parser.add_argument('--lag', type=float, default=ROLLUP_LAG,
+                            help="Segundos que um id novo espera antes de ser somado (commits fora de ordem).")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        first, last = refresh_rollups(chunk=options['chunk_size'], lag=options['lag'])
+        elapsed = time.perf_counter() - start
+        if last == first:
+            self.stdout.write("Rollups já estão em dia.")
+            return
+        self.stdout.write(f"Rollups atualizados: ids {first + 1}..{last} em {elapsed:.2f} s.")
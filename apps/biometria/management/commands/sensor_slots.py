@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from biometria import sensor_slots
+from biometria.models import PORTAO_PADRAO
+
+
+class Command(BaseCommand):
+    help = "Mostra a ocupação/fragmentação dos slots do sensor e, com --rebuild, recalcula o bitmap."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Recalcula o bitmap a partir das digitais (após QuerySet.update etc.).")
+        parser.add_argument('--json', action='store_true', help="Saída em JSON.")
+        parser.add_argument('--portao', default=PORTAO_PADRAO,
+                            help=f"Portão (gate do bridge) cujo sensor será mostrado (padrão: {PORTAO_PADRAO}).")
+
+    def handle(self, *args, **options):
+        portao = options['portao']
+        if options['rebuild']:
+            antes, depois = sensor_slots.rebuild(portao)
+            self.stdout.write(f"Bitmap recalculado ({portao}): {antes} -> {depois} slots ocupados.")
+
+        data = sensor_slots.report(portao)
+        if options['json']:
+            self.stdout.write(json.dumps(data, indent=2))
+            return
+
+        self.stdout.write(f"Portão {portao}  ocupados: {data['ocupados']}/{data['capacidade']}  "
+                          f"livres: {data['livres']}  maior ID em uso: {data['maior_usado']}")
+        self.stdout.write(f"Maior bloco livre: {data['maior_bloco_livre']} slots  "
+                          f"fragmentação: {data['fragmentacao']:.1%}")
+        for start in range(0, data['capacidade'], 50):
+            self.stdout.write(f"  {start + 1:>3}  {data['bitmap'][start:start + 50]}")
+
+        if data['buracos']:
+            self.stdout.write(f"Slots livres abaixo do maior ID: {len(data['buracos'])}")
+        if data['plano_compactacao']:
+            self.stdout.write("Para compactar, recadastrar:")
+            for origem, destino in data['plano_compactacao']:
+                self.stdout.write(f"  {origem} -> {destino}")
+        if data['so_no_mapa'] or data['so_no_banco']:
+            self.stdout.write(self.style.WARNING(
+                f"Bitmap divergente das digitais (só no bitmap: {data['so_no_mapa']}, "
+                f"só no banco: {data['so_no_banco']}). Rode com --rebuild."
+            ))
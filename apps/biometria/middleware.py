@@ -0,0 +1,63 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connection
+
+from . import metrics
+
+
+class RequestMetricsMiddleware:
+    """
+    Mede cada requisição por nome de URL: latência, número e tempo das
+    consultas ao banco e tamanho da resposta (ver metrics.py, /api/metrics).
+
+    Em respostas de streaming (SSE, exportação) a latência vai só até os
+    headers e o tamanho não é medido.
+
+    Também roda como middleware assíncrono (ASGI), para que views async
+    (long-poll, SSE) não prendam uma thread enquanto esperam. Nesse caminho
+    as consultas rodam em outras threads (sync_to_async) e não são contadas.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        db = {'queries': 0, 'seconds': 0.0}
+
+        def count_query(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                db['queries'] += 1
+                db['seconds'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, db)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, elapsed, db=None):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        metrics.request_duration.observe(elapsed, view, request.method)
+        metrics.responses_total.inc(view, request.method, str(response.status_code))
+        if db is not None:
+            metrics.db_queries.observe(db['queries'], view)
+            metrics.db_time.observe(db['seconds'], view)
+        if not response.streaming:
+            metrics.response_size.observe(len(response.content), view)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biometria', '0002_alter_digital_sensor_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicoacesso',
+            name='chave_idempotencia',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:25
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biometria', '0003_historicoacesso_chave_idempotencia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AcessoPendente',
+            fields=[
+                ('historico', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='pendente', serialize=False, to='biometria.historicoacesso')),
+                ('criado_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expira_em', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='historicoacesso',
+            index=models.Index(fields=['data_hora'], name='historico_data_hora_idx'),
+        ),
+        migrations.AddField(
+            model_name='acessopendente',
+            name='usuario',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='biometria.usuario'),
+        ),
+    ]
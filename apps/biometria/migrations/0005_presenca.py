@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:28
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biometria', '0004_acessopendente'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Presenca',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('desde', models.DateTimeField(default=django.utils.timezone.now)),
+                ('historico', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='biometria.historicoacesso')),
+                ('sala', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='presencas', to='biometria.sala')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='presencas', to='biometria.usuario')),
+            ],
+            options={
+                'unique_together': {('sala', 'usuario')},
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:29
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biometria', '0005_presenca'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupEstado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=50, unique=True)),
+                ('ultimo_id', models.BigIntegerField(default=0)),
+                ('atualizado_em', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupAcessoDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('tipo_acesso', models.CharField(choices=[('entrada', 'Entrada'), ('saida', 'Saída')], max_length=10)),
+                ('tipo_usuario', models.CharField(blank=True, choices=[('aluno', 'Aluno'), ('professor', 'Professor')], max_length=20, null=True)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('sala', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='biometria.sala')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['dia', 'sala'], name='rollup_dia_dia_sala_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupAcessoHora',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('inicio', models.DateTimeField()),
+                ('tipo_acesso', models.CharField(choices=[('entrada', 'Entrada'), ('saida', 'Saída')], max_length=10)),
+                ('tipo_usuario', models.CharField(blank=True, choices=[('aluno', 'Aluno'), ('professor', 'Professor')], max_length=20, null=True)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('sala', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='biometria.sala')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['inicio', 'sala'], name='rollup_hora_inicio_sala_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biometria', '0006_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComandoSensor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('acao', models.CharField(choices=[('enroll', 'Cadastrar'), ('delete', 'Remover'), ('delete_all', 'Limpar sensor')], max_length=20)),
+                ('sensor_id', models.IntegerField(blank=True, null=True)),
+                ('lote', models.UUIDField(db_index=True)),
+                ('status', models.CharField(choices=[('pendente', 'Na fila'), ('enviado', 'Em execução no sensor'), ('concluido', 'Concluído'), ('falhou', 'Falhou')], default='pendente', max_length=20)),
+                ('etapa', models.CharField(blank=True, max_length=30)),
+                ('mensagem', models.TextField(blank=True)),
+                ('tentativas', models.PositiveSmallIntegerField(default=0)),
+                ('criado_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('enviado_em', models.DateTimeField(blank=True, null=True)),
+                ('concluido_em', models.DateTimeField(blank=True, null=True)),
+                ('digital', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='comandos', to='biometria.digital')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'id'], name='comando_sensor_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:43
+
+import django.core.validators
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biometria', '0007_comandosensor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MapaSlots',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=50, unique=True)),
+                ('bitmap', models.BinaryField(default=bytes)),
+                ('atualizado_em', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='digital',
+            name='sensor_id',
+            field=models.IntegerField(blank=True, help_text='ID (1-200) no qual o sensor irá armazenar este template. Deixe em branco para usar o menor slot livre.', null=True, unique=True, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(200)]),
+        ),
+    ]
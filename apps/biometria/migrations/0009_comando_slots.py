@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biometria', '0008_sensor_slots'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='comandosensor',
+            name='acao',
+            field=models.CharField(choices=[('enroll', 'Cadastrar'), ('delete', 'Remover'), ('delete_all', 'Limpar sensor'), ('slots', 'Ler slots ocupados')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:56
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biometria', '0009_comando_slots'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='digital',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='acessopendente',
+            name='portao',
+            field=models.CharField(default='principal', max_length=30),
+        ),
+        migrations.AddField(
+            model_name='comandosensor',
+            name='portao',
+            field=models.CharField(default='principal', max_length=30),
+        ),
+        migrations.AddField(
+            model_name='digital',
+            name='portao',
+            field=models.CharField(default='principal', help_text='ID do portão no bridge (SERIAL_PORTS / GATE_ID) cujo sensor guarda este template.', max_length=30),
+        ),
+        migrations.AddField(
+            model_name='historicoacesso',
+            name='portao',
+            field=models.CharField(default='principal', max_length=30),
+        ),
+        migrations.AddField(
+            model_name='mapaslots',
+            name='portao',
+            field=models.CharField(default='principal', max_length=30),
+        ),
+        migrations.AlterField(
+            model_name='digital',
+            name='sensor_id',
+            field=models.IntegerField(blank=True, help_text='ID (1-200) no qual o sensor irá armazenar este template. Deixe em branco para usar o menor slot livre.', null=True, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(200)]),
+        ),
+        migrations.AlterField(
+            model_name='mapaslots',
+            name='nome',
+            field=models.CharField(max_length=50),
+        ),
+        migrations.AlterUniqueTogether(
+            name='digital',
+            unique_together={('usuario', 'dedo', 'portao')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='mapaslots',
+            unique_together={('nome', 'portao')},
+        ),
+        migrations.AddConstraint(
+            model_name='digital',
+            constraint=models.UniqueConstraint(fields=('portao', 'sensor_id'), name='digital_portao_sensor_id_uniq'),
+        ),
+    ]
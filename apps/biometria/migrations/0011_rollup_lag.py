@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biometria', '0010_portoes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollupestado',
+            name='anterior_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='rollupestado',
+            name='visto_em',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='rollupestado',
+            name='visto_id',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -1,9 +1,14 @@
 import hashlib
-from django.db import models
+from django.db import models, transaction
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 
 
+# ID do portão (gate) quando o bridge não informa um: o GATE_ID padrão do bridge
+PORTAO_PADRAO = "principal"
+
+
 # ============================
 #  ENUMS / Choices (Sem mudanças)
 # ============================
@@ -18,6 +23,20 @@ class TipoAcesso(models.TextChoices):
     SAIDA = "saida", "Saída"
 
 
+class AcaoSensor(models.TextChoices):
+    ENROLL = "enroll", "Cadastrar"
+    DELETE = "delete", "Remover"
+    DELETE_ALL = "delete_all", "Limpar sensor"
+    SLOTS = "slots", "Ler slots ocupados"
+
+
+class StatusComando(models.TextChoices):
+    PENDENTE = "pendente", "Na fila"
+    ENVIADO = "enviado", "Em execução no sensor"
+    CONCLUIDO = "concluido", "Concluído"
+    FALHOU = "falhou", "Falhou"
+
+
 class Dedo(models.TextChoices):
     INDICADOR_DIR = "indicador_dir", "Indicador DIR."
     POLEGAR_DIR = "polegar_dir", "Polegar DIR."
@@ -76,12 +95,21 @@ class UsuarioSala(models.Model):
 
 class Digital(models.Model):
     usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="digitais")
+
+    # Cada portão tem o seu sensor (e os seus 200 slots): o mesmo dedo é cadastrado em cada portão
+    portao = models.CharField(
+        max_length=30,
+        default=PORTAO_PADRAO,
+        help_text="ID do portão no bridge (SERIAL_PORTS / GATE_ID) cujo sensor guarda este template."
+    )
     
-    # ID unico que o sensor usará para armazenar este template
+    # ID unico (no sensor do portão) que o sensor usará para armazenar este template
+    # (vazio = menor slot livre; desativada, a digital mantém o slot até o sensor apagar o template, ver sensor_slots.py)
     sensor_id = models.IntegerField(
-        unique=True,
+        null=True,
+        blank=True,
         validators=[MinValueValidator(1), MaxValueValidator(200)],
-        help_text="ID (1-200) no qual o sensor irá armazenar este template."
+        help_text="ID (1-200) no qual o sensor irá armazenar este template. Deixe em branco para usar o menor slot livre."
     )
 
     
@@ -95,12 +123,29 @@ class Digital(models.Model):
     criado_em = models.DateTimeField(default=timezone.now)
 
     class Meta:
-        # Garante que um usuário não cadastre o mesmo dedo duas vezes
-        unique_together = ('usuario', 'dedo')
+        # Garante que um usuário não cadastre o mesmo dedo duas vezes no mesmo portão
+        unique_together = ('usuario', 'dedo', 'portao')
+        constraints = [
+            models.UniqueConstraint(fields=['portao', 'sensor_id'], name='digital_portao_sensor_id_uniq'),
+        ]
 
     def __str__(self):
         dedo_str = self.get_dedo_display() or "Digital"
-        return f"{dedo_str} de {self.usuario.nome} (ID Sensor: {self.sensor_id})"
+        return f"{dedo_str} de {self.usuario.nome} ({self.portao}, ID Sensor: {self.sensor_id or '-'})"
+
+    def clean(self):
+        from . import sensor_slots
+        if self.ativo and self.sensor_id is None and not sensor_slots.free_count(self.portao):
+            raise ValidationError(f"O sensor do portão {self.portao} não tem slots livres. "
+                                  "Desative ou remova alguma digital: o slot fica livre quando o "
+                                  "sensor confirmar a remoção do template.")
+
+    def save(self, *args, **kwargs):
+        from . import sensor_slots
+        # Reserva/libera o slot na mesma transação do INSERT/UPDATE
+        with transaction.atomic():
+            sensor_slots.sync_digital(self)
+            super().save(*args, **kwargs)
 
 
 # ============================
@@ -114,8 +159,174 @@ class HistoricoAcesso(models.Model):
     tipo_acesso = models.CharField(max_length=10, choices=TipoAcesso.choices)
     motivo = models.TextField(blank=True, null=True)
     metadata = models.JSONField(blank=True, null=True) # confiança do sensor
+    # Chave enviada pelo bridge (event_id) para não duplicar eventos reenviados
+    chave_idempotencia = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    # Portão (gate do bridge) onde a digital foi lida
+    portao = models.CharField(max_length=30, default=PORTAO_PADRAO)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['data_hora'], name='historico_data_hora_idx'),
+        ]
 
     def __str__(self):
         u = self.usuario.nome if self.usuario else "Usuário desconhecido"
         s = self.sala.nome if self.sala else "Sala indefinida"
-        return f"{u} - {s} ({self.tipo_acesso}) em {self.data_hora:%d/%m %H:%M}"
\ No newline at end of file
+        return f"{u} - {s} ({self.tipo_acesso}) em {self.data_hora:%d/%m %H:%M}"
+
+
+# ============================
+#  ACESSOS PENDENTES
+# ============================
+
+class AcessoPendente(models.Model):
+    """
+    Acesso validado aguardando o porteiro confirmar a sala.
+    Tabela pequena: a linha some na confirmação ou depois de `expira_em`,
+    então a busca do dashboard não depende do tamanho do histórico.
+    """
+    historico = models.OneToOneField(
+        HistoricoAcesso, on_delete=models.CASCADE, primary_key=True, related_name='pendente'
+    )
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE)
+    # O dashboard de cada portão só vê os pendentes dele
+    portao = models.CharField(max_length=30, default=PORTAO_PADRAO)
+    criado_em = models.DateTimeField(default=timezone.now)
+    expira_em = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.usuario.nome} aguardando sala (até {self.expira_em:%H:%M:%S})"
+
+
+
+# ============================
+#  OCUPAÇÃO DAS SALAS
+# ============================
+
+class Presenca(models.Model):
+    """
+    Quem está dentro de cada sala agora. Mantida a cada confirmação de
+    entrada/saída (confirm_access_room); o tamanho da tabela é o número de
+    pessoas presentes, não o do histórico. `rebuild_ocupacao` recria a
+    tabela a partir do histórico.
+    """
+    sala = models.ForeignKey(Sala, on_delete=models.CASCADE, related_name='presencas')
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='presencas')
+    desde = models.DateTimeField(default=timezone.now)
+    historico = models.ForeignKey(HistoricoAcesso, on_delete=models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        unique_together = ('sala', 'usuario')
+
+    def __str__(self):
+        return f"{self.usuario.nome} em {self.sala.nome} desde {self.desde:%d/%m %H:%M}"
+
+
+
+# ============================
+#  ROLLUPS (RELATÓRIOS)
+# ============================
+
+class RollupAcessoHora(models.Model):
+    """Total de acessos por hora, sala, tipo de acesso e tipo de usuário (ver rollups.py)."""
+    inicio = models.DateTimeField()
+    sala = models.ForeignKey(Sala, on_delete=models.SET_NULL, null=True, blank=True)
+    tipo_acesso = models.CharField(max_length=10, choices=TipoAcesso.choices)
+    # Nulo = leitura sem usuário (digital desconhecida)
+    tipo_usuario = models.CharField(max_length=20, choices=TipoUsuario.choices, null=True, blank=True)
+    total = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['inicio', 'sala'], name='rollup_hora_inicio_sala_idx'),
+        ]
+
+
+class RollupAcessoDia(models.Model):
+    """Total de acessos por dia, sala, tipo de acesso e tipo de usuário (ver rollups.py)."""
+    dia = models.DateField()
+    sala = models.ForeignKey(Sala, on_delete=models.SET_NULL, null=True, blank=True)
+    tipo_acesso = models.CharField(max_length=10, choices=TipoAcesso.choices)
+    tipo_usuario = models.CharField(max_length=20, choices=TipoUsuario.choices, null=True, blank=True)
+    total = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['dia', 'sala'], name='rollup_dia_dia_sala_idx'),
+        ]
+
+
+class RollupEstado(models.Model):
+    """Marca d'água: último HistoricoAcesso.id já somado nos rollups (ver rollups.py)."""
+    nome = models.CharField(max_length=50, unique=True)
+    ultimo_id = models.BigIntegerField(default=0)
+    # Faixa (anterior_id, ultimo_id] somada na última execução: é recalculada na próxima
+    anterior_id = models.BigIntegerField(default=0)
+    # Maior id visto em `visto_em`; só vira limite depois de ROLLUP_LAG segundos
+    visto_id = models.BigIntegerField(default=0)
+    visto_em = models.DateTimeField(null=True, blank=True)
+    atualizado_em = models.DateTimeField(default=timezone.now)
+
+
+# ============================
+#  FILA DE COMANDOS DO SENSOR
+# ============================
+
+class ComandoSensor(models.Model):
+    """
+    Um comando para o sensor (ENROLL/DELETE/DELETE_ALL). Os comandos vão
+    para o bridge um de cada vez por portão e são concluídos pelas linhas
+    de status do Arduino (ver sensor_jobs.py).
+    """
+    acao = models.CharField(max_length=20, choices=AcaoSensor.choices)
+    portao = models.CharField(max_length=30, default=PORTAO_PADRAO)
+    sensor_id = models.IntegerField(null=True, blank=True)
+    digital = models.ForeignKey(Digital, on_delete=models.SET_NULL, null=True, blank=True, related_name="comandos")
+    # Agrupa os comandos de uma mesma ação do admin (tela de progresso)
+    lote = models.UUIDField(db_index=True)
+    status = models.CharField(max_length=20, choices=StatusComando.choices, default=StatusComando.PENDENTE)
+    # Última linha de status recebida (ex: enroll_prompt_1)
+    etapa = models.CharField(max_length=30, blank=True)
+    mensagem = models.TextField(blank=True)
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    criado_em = models.DateTimeField(default=timezone.now)
+    enviado_em = models.DateTimeField(null=True, blank=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'id'], name='comando_sensor_status_idx'),
+        ]
+
+    @property
+    def comando(self):
+        if self.acao in (AcaoSensor.DELETE_ALL, AcaoSensor.SLOTS):
+            return self.acao.upper()
+        return f"{self.acao.upper()}:{self.sensor_id}"
+
+    @property
+    def bridge_id(self):
+        """command_id enviado ao bridge (volta nas linhas de status)."""
+        return f"django-{self.pk}"
+
+    def __str__(self):
+        return f"{self.comando} ({self.get_status_display()})"
+
+
+class MapaSlots(models.Model):
+    """
+    Bitmap dos slots ocupados (bit i-1 = sensor_id i), um par por portão.
+    'sensor' é o mapa de alocação do Django, travado com select_for_update
+    para alocar/liberar slots; 'leitura' é o último SLOTS lido do próprio DY-50.
+    """
+    nome = models.CharField(max_length=50)
+    portao = models.CharField(max_length=30, default=PORTAO_PADRAO)
+    bitmap = models.BinaryField(default=bytes)
+    atualizado_em = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('nome', 'portao')
+
+    def __str__(self):
+        return f"{self.nome} ({self.portao})"
@@ -0,0 +1,79 @@
+"""
+Ocupação das salas mantida incrementalmente a partir das entradas/saídas.
+
+`apply_access` é chamado dentro da transação do confirm_access_room; a
+tabela Presenca guarda só quem está dentro, então ler a ocupação não depende
+do tamanho do histórico. `replay_history` reconstrói o estado do zero.
+"""
+from django.db import transaction
+
+from .models import HistoricoAcesso, Presenca, TipoAcesso
+
+
+def apply_access(acesso):
+    """Atualiza a Presenca com um acesso confirmado (entrada cria, saída remove)."""
+    if not acesso.usuario_id or not acesso.sala_id:
+        return
+    if acesso.tipo_acesso == TipoAcesso.ENTRADA:
+        Presenca.objects.get_or_create(
+            sala_id=acesso.sala_id,
+            usuario_id=acesso.usuario_id,
+            defaults={'desde': acesso.data_hora, 'historico': acesso},
+        )
+    else:
+        Presenca.objects.filter(sala_id=acesso.sala_id, usuario_id=acesso.usuario_id).delete()
+
+
+def room_occupancy(sala_id=None):
+    """
+    Ocupação atual: [{sala_id, sala_nome, total, usuarios: [...]}, ...].
+    Lê só a tabela Presenca (uma consulta).
+    """
+    presencas = Presenca.objects.select_related('sala', 'usuario').order_by('sala__nome', 'desde')
+    if sala_id is not None:
+        presencas = presencas.filter(sala_id=sala_id)
+    rooms = {}
+    for presenca in presencas:
+        room = rooms.setdefault(presenca.sala_id, {
+            'sala_id': presenca.sala_id,
+            'sala_nome': presenca.sala.nome,
+            'total': 0,
+            'usuarios': [],
+        })
+        room['total'] += 1
+        room['usuarios'].append({
+            'id': presenca.usuario_id,
+            'nome': presenca.usuario.nome,
+            'codigo': presenca.usuario.codigo,
+            'desde': presenca.desde,
+        })
+    return list(rooms.values())
+
+
+def replay_history(chunk_size=5000):
+    """
+    Recalcula a Presenca relendo os acessos confirmados em ordem, em
+    streaming (`iterator`). A memória usada é proporcional a quem está
+    dentro, não ao histórico. Retorna (acessos lidos, presenças gravadas).
+    """
+    present = {}  # (sala_id, usuario_id) -> (desde, historico_id)
+    rows = HistoricoAcesso.objects.filter(
+        sala__isnull=False, usuario__isnull=False
+    ).order_by('data_hora', 'id').values_list('id', 'sala_id', 'usuario_id', 'tipo_acesso', 'data_hora')
+
+    processed = 0
+    for historico_id, sala_id, usuario_id, tipo_acesso, data_hora in rows.iterator(chunk_size=chunk_size):
+        processed += 1
+        key = (sala_id, usuario_id)
+        if tipo_acesso == TipoAcesso.ENTRADA:
+            present.setdefault(key, (data_hora, historico_id))
+        else:
+            present.pop(key, None)
+
+    with transaction.atomic():
+        Presenca.objects.all().delete()
+        Presenca.objects.bulk_create([
+            Presenca(sala_id=sala_id, usuario_id=usuario_id, desde=desde, historico_id=historico_id)
+            for (sala_id, usuario_id), (desde, historico_id) in present.items()
+        ], batch_size=chunk_size)
+    return processed, len(present)
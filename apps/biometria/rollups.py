@@ -0,0 +1,198 @@
+"""
+Rollups de acessos por hora e por dia (sala x tipo_acesso x tipo_usuario).
+
+`refresh_rollups()` soma só os HistoricoAcesso com id acima da marca d'água
+(RollupEstado.ultimo_id), em faixas de ids, e avança a marca na mesma
+transação. Os relatórios (`report`) leem apenas as tabelas de rollup.
+
+O limite de cada execução é o menor entre:
+
+- o maior id visto há pelo menos ROLLUP_LAG segundos (RollupEstado.visto_id):
+  uma transação que pegou um id menor e commitou depois de um maior tem esse
+  tempo para aparecer antes que a marca passe por ele;
+- o id anterior ao pendente mais antigo ainda válido: sala/tipo mudam na
+  confirmação, então ele e os seguintes esperam.
+
+Um acesso só é confirmado enquanto o pendente vale, então uma confirmação
+que chega atrasada cai na faixa que a execução anterior acabou de somar.
+Por isso cada execução começa recalculando do zero as horas (e os dias)
+dessa faixa.
+"""
+import os
+from collections import Counter
+from datetime import datetime, time as dt_time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .export import parse_bound
+from .models import (
+    AcessoPendente, HistoricoAcesso, RollupAcessoDia, RollupAcessoHora, RollupEstado,
+)
+
+ROLLUP_NAME = 'acessos'
+ROLLUP_CHUNK = 50000
+ROLLUP_GRANULARIDADES = ('hora', 'dia')
+ROLLUP_LAG = float(os.getenv('ROLLUP_LAG', 60))
+
+
+def rollup_cutoff_id(estado, lag=ROLLUP_LAG):
+    """
+    Maior id que já pode ser somado (ver módulo). Registra em `estado` o
+    maior id atual como o próximo candidato; quem chama salva.
+    """
+    now = timezone.now()
+    max_id = HistoricoAcesso.objects.aggregate(id=Max('id'))['id'] or 0
+    if lag <= 0:
+        cutoff = max_id
+    elif estado.visto_em is not None and estado.visto_em <= now - timedelta(seconds=lag):
+        cutoff = estado.visto_id
+    else:
+        cutoff = estado.ultimo_id
+    if cutoff >= estado.visto_id or estado.visto_em is None:
+        estado.visto_id, estado.visto_em = max_id, now
+
+    oldest_pending = AcessoPendente.objects.filter(
+        expira_em__gt=now
+    ).aggregate(id=Min('historico_id'))['id']
+    if oldest_pending is not None:
+        cutoff = min(cutoff, oldest_pending - 1)
+    return max(cutoff, estado.ultimo_id)
+
+
+def _upsert(model, key, total):
+    updated = model.objects.filter(**key).update(total=F('total') + total)
+    if not updated:
+        model.objects.create(total=total, **key)
+
+
+def _hourly_rows(rows):
+    return (
+        rows.annotate(hora=TruncHour('data_hora'))
+        .values('hora', 'sala_id', 'tipo_acesso', 'usuario__tipo_usuario')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+
+
+def _apply_range(start_id, end_id):
+    """Soma os acessos com start_id < id <= end_id nas tabelas de rollup."""
+    daily = Counter()
+    for row in _hourly_rows(HistoricoAcesso.objects.filter(id__gt=start_id, id__lte=end_id)):
+        key = {
+            'sala_id': row['sala_id'],
+            'tipo_acesso': row['tipo_acesso'],
+            'tipo_usuario': row['usuario__tipo_usuario'],
+        }
+        _upsert(RollupAcessoHora, dict(key, inicio=row['hora']), row['total'])
+        dia = timezone.localtime(row['hora']).date()
+        daily[(dia, key['sala_id'], key['tipo_acesso'], key['tipo_usuario'])] += row['total']
+    for (dia, sala_id, tipo_acesso, tipo_usuario), total in daily.items():
+        _upsert(RollupAcessoDia, {
+            'dia': dia, 'sala_id': sala_id, 'tipo_acesso': tipo_acesso, 'tipo_usuario': tipo_usuario,
+        }, total)
+
+
+def _reroll_range(start_id, end_id):
+    """
+    Recalcula do zero as horas e os dias que têm acessos com
+    start_id < id <= end_id, contando só ids até end_id (a marca d'água).
+    """
+    horas = set(
+        HistoricoAcesso.objects.filter(id__gt=start_id, id__lte=end_id)
+        .annotate(hora=TruncHour('data_hora')).values_list('hora', flat=True).distinct()
+    )
+    if not horas:
+        return
+    RollupAcessoHora.objects.filter(inicio__in=horas).delete()
+    for hora in horas:
+        rows = HistoricoAcesso.objects.filter(id__lte=end_id, data_hora__gte=hora, data_hora__lt=hora + timedelta(hours=1))
+        RollupAcessoHora.objects.bulk_create([
+            RollupAcessoHora(inicio=row['hora'], sala_id=row['sala_id'], tipo_acesso=row['tipo_acesso'],
+                             tipo_usuario=row['usuario__tipo_usuario'], total=row['total'])
+            for row in _hourly_rows(rows)
+        ])
+
+    # O dia é a soma das horas dele (já corrigidas acima)
+    dias = {timezone.localtime(hora).date() for hora in horas}
+    RollupAcessoDia.objects.filter(dia__in=dias).delete()
+    for dia in dias:
+        inicio = timezone.make_aware(datetime.combine(dia, dt_time.min))
+        fim = timezone.make_aware(datetime.combine(dia + timedelta(days=1), dt_time.min))
+        totais = (RollupAcessoHora.objects.filter(inicio__gte=inicio, inicio__lt=fim)
+                  .values('sala_id', 'tipo_acesso', 'tipo_usuario').annotate(soma=Sum('total')).order_by())
+        RollupAcessoDia.objects.bulk_create([
+            RollupAcessoDia(dia=dia, sala_id=row['sala_id'], tipo_acesso=row['tipo_acesso'],
+                            tipo_usuario=row['tipo_usuario'], total=row['soma'])
+            for row in totais
+        ])
+
+
+def refresh_rollups(chunk=ROLLUP_CHUNK, lag=ROLLUP_LAG):
+    """Processa os acessos novos desde a última execução. Retorna (de_id, até_id)."""
+    RollupEstado.objects.get_or_create(nome=ROLLUP_NAME)
+    with transaction.atomic():
+        # Trava a marca d'água: duas execuções simultâneas não somam em dobro
+        estado = RollupEstado.objects.select_for_update().get(nome=ROLLUP_NAME)
+        first = estado.ultimo_id
+        # Confirmações que chegaram depois da execução anterior
+        _reroll_range(estado.anterior_id, estado.ultimo_id)
+        cutoff = rollup_cutoff_id(estado, lag)
+        estado.anterior_id = first
+        estado.save(update_fields=['anterior_id', 'visto_id', 'visto_em'])
+    while True:
+        with transaction.atomic():
+            estado = RollupEstado.objects.select_for_update().get(nome=ROLLUP_NAME)
+            if estado.ultimo_id >= cutoff:
+                return first, estado.ultimo_id
+            end_id = min(estado.ultimo_id + chunk, cutoff)
+            _apply_range(estado.ultimo_id, end_id)
+            estado.ultimo_id = end_id
+            estado.atualizado_em = timezone.now()
+            estado.save(update_fields=['ultimo_id', 'atualizado_em'])
+
+
+def report(granularidade='dia', inicio=None, fim=None, sala=None, tipo_acesso=None, tipo_usuario=None):
+    """
+    Totais a partir dos rollups. `inicio`/`fim` aceitam data ou data/hora ISO
+    (como na exportação); ValueError se algum filtro for inválido.
+    """
+    if granularidade not in ROLLUP_GRANULARIDADES:
+        raise ValueError(f"granularidade deve ser uma de {ROLLUP_GRANULARIDADES}")
+    inicio = parse_bound(inicio)
+    fim = parse_bound(fim, end=True)
+    if granularidade == 'hora':
+        model, campo = RollupAcessoHora, 'inicio'
+    else:
+        model, campo = RollupAcessoDia, 'dia'
+        inicio = inicio and timezone.localtime(inicio).date()
+        fim = fim and timezone.localtime(fim).date()
+    qs = model.objects.all()
+    if inicio:
+        qs = qs.filter(**{f'{campo}__gte': inicio})
+    if fim:
+        qs = qs.filter(**{f'{campo}__lt': fim})
+    if sala:
+        qs = qs.filter(sala_id=int(sala))
+    if tipo_acesso:
+        qs = qs.filter(tipo_acesso=tipo_acesso)
+    if tipo_usuario:
+        qs = qs.filter(tipo_usuario=tipo_usuario)
+    rows = (
+        qs.values(campo, 'sala_id', 'sala__nome', 'tipo_acesso', 'tipo_usuario')
+        .annotate(soma=Sum('total'))
+        .order_by(campo, 'sala__nome', 'tipo_acesso', 'tipo_usuario')
+    )
+    return [
+        {
+            'periodo': row[campo],
+            'sala_id': row['sala_id'],
+            'sala_nome': row['sala__nome'],
+            'tipo_acesso': row['tipo_acesso'],
+            'tipo_usuario': row['tipo_usuario'],
+            'total': row['soma'],
+        }
+        for row in rows
+    ]
@@ -0,0 +1,79 @@
+"""
+Cache em memória do mapeamento sensor_id -> usuário.
+
+O DY-50 tem só 200 slots, então o mapeamento de cada portão cabe numa lista
+indexada pelo sensor_id. As listas de todos os portões são carregadas numa
+única consulta no primeiro match e descartadas pelos signals de
+Digital/Usuario (ver signals.py); o caminho do match não faz nenhuma leitura
+no banco enquanto o cache estiver válido.
+
+Os signals só invalidam o processo atual. Com vários workers (gunicorn etc.)
+o SENSOR_CACHE_TTL limita por quanto tempo um worker pode ficar desatualizado.
+`QuerySet.update()` não dispara signals: chame `sensor_cache.invalidate()`.
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+
+from .models import PORTAO_PADRAO, Digital
+
+MAX_SENSOR_ID = 200
+
+SensorEntry = namedtuple('SensorEntry', ['digital_id', 'usuario_id', 'nome', 'codigo', 'tipo_usuario'])
+
+
+class SensorCache:
+
+    def __init__(self, size=MAX_SENSOR_ID + 1, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self._slots = None  # portão -> lista indexada pelo sensor_id
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def _load(self):
+        generation = self._generation
+        slots = {}
+        rows = Digital.objects.filter(ativo=True, sensor_id__isnull=False).values_list(
+            'portao', 'sensor_id', 'id', 'usuario_id', 'usuario__nome', 'usuario__codigo', 'usuario__tipo_usuario'
+        )
+        for portao, sensor_id, digital_id, usuario_id, nome, codigo, tipo_usuario in rows:
+            if 0 <= sensor_id < self.size:
+                if portao not in slots:
+                    slots[portao] = [None] * self.size
+                slots[portao][sensor_id] = SensorEntry(digital_id, usuario_id, nome, codigo, tipo_usuario)
+        with self._lock:
+            self.loads += 1
+            # Se houve invalidação durante a consulta, o resultado pode estar velho
+            if generation == self._generation:
+                self._slots = slots
+                self._loaded_at = time.monotonic()
+        return slots
+
+    def slots(self):
+        slots = self._slots
+        if slots is None or (self.ttl and time.monotonic() - self._loaded_at > self.ttl):
+            slots = self._load()
+        return slots
+
+    def get(self, sensor_id, portao=PORTAO_PADRAO):
+        """Retorna o SensorEntry da digital ativa no slot do sensor do portão, ou None."""
+        try:
+            sensor_id = int(sensor_id)
+        except (TypeError, ValueError):
+            return None
+        if not 0 <= sensor_id < self.size:
+            return None
+        slots = self.slots().get(portao)
+        return slots[sensor_id] if slots else None
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._slots = None
+
+
+sensor_cache = SensorCache(ttl=float(os.getenv('SENSOR_CACHE_TTL', 60)) or None)
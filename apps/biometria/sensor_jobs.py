@@ -0,0 +1,292 @@
+"""
+Fila de comandos do sensor (cadastro/remoção em lote pelo admin).
+
+O Arduino só executa um comando por vez e fica segundos em `delay()` (ou
+esperando o dedo) durante um cadastro. Por isso os comandos não vão todos
+de uma vez para o bridge. Cada portão tem o seu Arduino, então a fila é
+por portão (ComandoSensor.portao, enviado ao bridge como `gate`):
+
+- `enqueue()` grava os ComandoSensor como PENDENTE e devolve o lote;
+- `advance_queue()` envia o próximo PENDENTE de cada portão só quando não
+  há nenhum ENVIADO em andamento nele (ou quando o que estava em andamento
+  estourou SENSOR_JOB_TIMEOUT);
+- `handle_status()` recebe as linhas `enroll_*`/`delete_*` que o bridge
+  repassa (POST /api/sensor/status/), atualiza o comando em andamento e, ao
+  concluir, chama `advance_queue()` para o próximo.
+
+Cada comando vai ao bridge com `command_id` = ComandoSensor.bridge_id; o
+bridge devolve esse ID nas linhas de status e não reenvia um ID repetido, o
+que torna seguros os retries. A tela de progresso do admin também chama
+`advance_queue()`, que consulta o bridge (GET /command/<id>) quando um
+comando está há mais de SENSOR_JOB_POLL_AFTER s sem resposta; assim a fila
+anda mesmo se uma linha de status se perder.
+
+`start_reconcile()` põe um SLOTS na fila; quando o bitmap do sensor chega,
+`reconcile()` enfileira no mesmo lote só os DELETE/ENROLL que faltam para o
+sensor bater com as digitais ativas.
+"""
+import os
+import threading
+import uuid
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import PORTAO_PADRAO, AcaoSensor, ComandoSensor, Digital, StatusComando
+from . import sensor_slots
+from .sensor_cache import MAX_SENSOR_ID
+
+# O firmware espera o dedo sem limite de tempo; depois disso o comando é dado como falho
+SENSOR_JOB_TIMEOUT = float(os.getenv('SENSOR_JOB_TIMEOUT', 90))
+SENSOR_JOB_MAX_TENTATIVAS = 3
+# Antes disso o status ainda pode estar a caminho (POST do bridge)
+SENSOR_JOB_POLL_AFTER = float(os.getenv('SENSOR_JOB_POLL_AFTER', 5))
+
+# status do Arduino -> (ação esperada, status final ou None se for só uma etapa)
+STATUS_LINES = {
+    'enroll_starting': (AcaoSensor.ENROLL, None),
+    'enroll_prompt_1': (AcaoSensor.ENROLL, None),
+    'enroll_prompt_2': (AcaoSensor.ENROLL, None),
+    'enroll_success': (AcaoSensor.ENROLL, StatusComando.CONCLUIDO),
+    'enroll_failed': (AcaoSensor.ENROLL, StatusComando.FALHOU),
+    'delete_success': (AcaoSensor.DELETE, StatusComando.CONCLUIDO),
+    'delete_failed': (AcaoSensor.DELETE, StatusComando.FALHOU),
+    'delete_all_success': (AcaoSensor.DELETE_ALL, StatusComando.CONCLUIDO),
+    'delete_all_failed': (AcaoSensor.DELETE_ALL, StatusComando.FALHOU),
+    'slots': (AcaoSensor.SLOTS, StatusComando.CONCLUIDO),
+    'slots_failed': (AcaoSensor.SLOTS, StatusComando.FALHOU),
+    # Erro de leitura durante o cadastro: o firmware tenta de novo sozinho
+    'error': (AcaoSensor.ENROLL, None),
+}
+
+
+def parse_sensor_id(value):
+    """sensor_id (1..200) vindo do admin ou do bridge como int; None se inválido."""
+    if isinstance(value, bool):
+        return None
+    try:
+        sensor_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    return sensor_id if 1 <= sensor_id <= MAX_SENSOR_ID else None
+
+
+def enqueue(acao, digitais=(), sensor_ids=(), lote=None, portao=PORTAO_PADRAO):
+    """
+    Cria os comandos de um lote (um por Digital/sensor_id) e retorna o UUID do
+    lote. Comandos de digitais vão para o portão da digital; os demais, para `portao`.
+    """
+    lote = lote or uuid.uuid4()
+    if acao in (AcaoSensor.DELETE_ALL, AcaoSensor.SLOTS):
+        comandos = [ComandoSensor(acao=acao, lote=lote, portao=portao)]
+    else:
+        comandos = [ComandoSensor(acao=acao, digital=d, sensor_id=d.sensor_id, lote=lote, portao=d.portao)
+                    for d in digitais if d.sensor_id is not None]
+        comandos += [ComandoSensor(acao=acao, sensor_id=sensor_id, lote=lote, portao=portao)
+                     for sensor_id in sensor_ids]
+    ComandoSensor.objects.bulk_create(comandos)
+    return lote
+
+
+def advance_in_background():
+    """Dispara `advance_queue()` numa thread (a request do admin volta na hora)."""
+    def run():
+        try:
+            advance_queue()
+        finally:
+            close_old_connections()
+    threading.Thread(target=run, name='sensor-jobs', daemon=True).start()
+
+
+def _finish(comando, status, mensagem=''):
+    comando.status = status
+    comando.concluido_em = timezone.now()
+    if mensagem:
+        comando.mensagem = mensagem
+    comando.save(update_fields=['status', 'concluido_em', 'mensagem', 'etapa', 'tentativas'])
+
+
+def _sync_with_bridge(comando):
+    """Aplica o estado que o bridge tem do comando em andamento, se já for final."""
+    from .views import get_bridge_command
+
+    if comando.enviado_em and timezone.now() - comando.enviado_em < timedelta(seconds=SENSOR_JOB_POLL_AFTER):
+        return
+    data = get_bridge_command(comando.bridge_id)
+    if data is None:
+        return
+    state = data.get('state')
+    if state in ('success', 'failed') and data.get('result'):
+        # Mesma linha de status que o bridge já tentou repassar
+        handle_status(dict(data['result'], command_id=comando.bridge_id), advance=False)
+    elif state in ('failed', 'timeout', 'unknown'):
+        mensagem = {
+            'failed': data.get('msg') or "Falha no bridge.",
+            'timeout': "Sem resposta do sensor (timeout no bridge).",
+            'unknown': "O bridge não conhece o comando (reiniciou?).",
+        }[state]
+        with transaction.atomic():
+            atual = ComandoSensor.objects.select_for_update().filter(pk=comando.pk, status=StatusComando.ENVIADO).first()
+            if atual:
+                _finish(atual, StatusComando.FALHOU, mensagem)
+
+
+def advance_queue(portao=None):
+    """
+    Envia o próximo comando de `portao` (ou de cada portão com fila) se o
+    sensor dele estiver livre. Retorna o comando enviado (o primeiro, com
+    vários portões) ou None.
+    """
+    if portao is not None:
+        return _advance_portao(portao)
+    ativos = (ComandoSensor.objects.filter(status__in=[StatusComando.PENDENTE, StatusComando.ENVIADO])
+              .order_by('portao').values_list('portao', flat=True).distinct())
+    enviados = [_advance_portao(p) for p in ativos]
+    return next((comando for comando in enviados if comando), None)
+
+
+def _advance_portao(portao):
+    from .views import send_bridge_command
+
+    fila = ComandoSensor.objects.filter(portao=portao)
+    while True:
+        running = fila.filter(status=StatusComando.ENVIADO).order_by('id').first()
+        if running:
+            # Fora da transação: é uma chamada HTTP
+            _sync_with_bridge(running)
+        with transaction.atomic():
+            # Trava a cabeça da fila antes de olhar o "em andamento": dois
+            # processos chamando ao mesmo tempo não enviam dois comandos
+            head = (fila.select_for_update()
+                    .filter(status=StatusComando.PENDENTE).order_by('id').first())
+            running = fila.filter(status=StatusComando.ENVIADO).order_by('id').first()
+            if running:
+                limite = timezone.now() - timedelta(seconds=SENSOR_JOB_TIMEOUT)
+                if running.enviado_em and running.enviado_em > limite:
+                    return None
+                _finish(running, StatusComando.FALHOU, "Sem resposta do sensor (timeout).")
+            if head is None:
+                return None
+            # Ocupa o sensor antes de soltar o lock: quem chegar depois já vê o ENVIADO
+            head.status = StatusComando.ENVIADO
+            head.enviado_em = timezone.now()
+            head.tentativas += 1
+            head.save(update_fields=['status', 'enviado_em', 'tentativas'])
+
+        # Já commitado: a chamada HTTP não segura transação nem lock
+        ok, response = send_bridge_command(head.comando, command_id=head.bridge_id, portao=portao)
+        if ok:
+            return head
+        with transaction.atomic():
+            head = fila.select_for_update().filter(pk=head.pk, status=StatusComando.ENVIADO).first()
+            if head is None:
+                return None
+            head.mensagem = f"Falha ao enviar ao bridge: {response}"
+            if head.tentativas < SENSOR_JOB_MAX_TENTATIVAS:
+                # Bridge fora do ar: volta para a fila e tenta de novo na próxima chamada
+                head.status = StatusComando.PENDENTE
+                head.enviado_em = None
+                head.save(update_fields=['status', 'enviado_em', 'mensagem'])
+                return None
+            _finish(head, StatusComando.FALHOU)
+        # Desistiu deste comando: segue para o próximo
+
+
+def handle_status(msg, advance=True):
+    """
+    Aplica uma linha de status do Arduino ao comando em andamento.
+    Retorna o comando atualizado, ou None se a linha não for de nenhum.
+
+    A linha vale para o portão em `gate` (o padrão se o bridge não mandar).
+    Com `command_id` (bridge com correlação) casa só pelo ID; sem ele, pelo
+    comando ENVIADO mais antigo da mesma ação no portão.
+    """
+    status_line = msg.get('status')
+    if status_line not in STATUS_LINES:
+        return None
+    acao, final = STATUS_LINES[status_line]
+    portao = str(msg.get('gate') or PORTAO_PADRAO)
+    with transaction.atomic():
+        if status_line == 'slots':
+            # Guarda a leitura mesmo sem comando (ex: SLOTS pedido pelo bridge no boot)
+            sensor_bits, fora = sensor_slots.record_dump(msg, portao)
+            sensor_slots.free_empty(sensor_bits, portao)
+        enviados = ComandoSensor.objects.select_for_update().filter(portao=portao, status=StatusComando.ENVIADO)
+        command_id = str(msg.get('command_id') or '')
+        if command_id:
+            # IDs que não são "django-<pk>" são do próprio bridge (ex: SLOTS do boot)
+            pk = command_id.removeprefix('django-')
+            comando = enviados.filter(pk=pk).first() if command_id.startswith('django-') and pk.isdigit() else None
+        else:
+            comando = enviados.order_by('id').first()
+        if comando is None or comando.acao != acao:
+            return None
+        sensor_id = msg.get('id')
+        if sensor_id is not None and parse_sensor_id(sensor_id) is None:
+            # Linha corrompida: não dá para saber de qual comando é
+            return None
+        if sensor_id is not None and comando.sensor_id is not None and int(sensor_id) != comando.sensor_id:
+            # Resposta de outro comando (ex: enviado fora da fila); não mexe neste
+            return None
+        comando.etapa = status_line
+        if status_line == 'slots':
+            diff = reconcile(sensor_bits, fora, lote=comando.lote, portao=portao)
+            msg = dict(msg, msg=f"{len(diff['remover'])} a remover, {len(diff['cadastrar'])} a cadastrar")
+        elif status_line == 'delete_success':
+            # Só agora o template saiu do sensor: o slot pode ir para outra digital
+            sensor_slots.template_deleted(comando.sensor_id, portao)
+        elif status_line == 'delete_all_success':
+            desativadas = sensor_slots.sensor_wiped(portao)
+            msg = dict(msg, msg=f"{desativadas} digital(is) desativada(s)")
+        if final is not None:
+            _finish(comando, final, msg.get('msg', ''))
+        else:
+            comando.mensagem = msg.get('msg', comando.mensagem)
+            comando.save(update_fields=['etapa', 'mensagem'])
+    if final is not None and advance:
+        advance_queue(portao)
+    return comando
+
+
+def start_reconcile(portao=PORTAO_PADRAO):
+    """Pede o bitmap ao sensor do portão; a reconciliação segue sozinha quando ele chegar."""
+    return enqueue(AcaoSensor.SLOTS, portao=portao)
+
+
+def reconcile(sensor_bits, fora=(), lote=None, portao=PORTAO_PADRAO):
+    """
+    Enfileira o mínimo para o sensor do portão bater com as digitais ativas dele: DELETE dos
+    templates sem digital (inclusive IDs fora de 1..200) e ENROLL das
+    digitais sem template. Slots que já têm o mesmo comando na fila ficam de
+    fora. Retorna o diff aplicado e o lote.
+    """
+    diff = sensor_slots.diff_dump(sensor_bits, portao)
+    na_fila = set(ComandoSensor.objects.filter(
+        portao=portao,
+        status__in=[StatusComando.PENDENTE, StatusComando.ENVIADO],
+        acao__in=[AcaoSensor.ENROLL, AcaoSensor.DELETE],
+    ).values_list('acao', 'sensor_id'))
+    remover = [i for i in diff['remover'] + [i for i in fora if i > 0] if (AcaoSensor.DELETE, i) not in na_fila]
+    cadastrar = [i for i in diff['cadastrar'] if (AcaoSensor.ENROLL, i) not in na_fila]
+
+    lote = lote or uuid.uuid4()
+    # DELETE primeiro: são rápidos e não dependem de ninguém no leitor
+    enqueue(AcaoSensor.DELETE, sensor_ids=remover, lote=lote, portao=portao)
+    enqueue(AcaoSensor.ENROLL, lote=lote,
+            digitais=Digital.objects.filter(portao=portao, ativo=True, sensor_id__in=cadastrar).order_by('sensor_id'))
+    return {'remover': remover, 'cadastrar': cadastrar, 'em_dia': diff['em_dia'], 'lote': lote}
+
+
+def lote_progress(lote):
+    """Comandos do lote e contagem por status (tela de progresso)."""
+    comandos = list(ComandoSensor.objects.filter(lote=lote).select_related('digital__usuario'))
+    contagem = {value: 0 for value, _ in StatusComando.choices}
+    for comando in comandos:
+        contagem[comando.status] += 1
+    return {
+        'comandos': comandos,
+        'contagem': contagem,
+        'total': len(comandos),
+        'terminado': contagem[StatusComando.PENDENTE] == 0 and contagem[StatusComando.ENVIADO] == 0,
+    }
@@ -0,0 +1,345 @@
+"""
+Alocação dos slots de template do sensor (IDs 1-200).
+
+Cada portão tem o seu sensor, então os slots são por portão: os ocupados
+ficam num bitmap de 25 bytes (MapaSlots nome='sensor' + portao); alocar ou
+liberar trava essa única linha com select_for_update, então dois cadastros
+no mesmo portão nunca recebem o mesmo slot. `Digital.save()` chama
+`sync_digital()`:
+
+- digital ativa sem sensor_id recebe o menor slot livre;
+- digital desativada põe um DELETE na fila, para o template sair do
+  sensor, e mantém o slot até ele ser confirmado;
+- digital reativada antes disso volta ao mesmo slot (o DELETE que ainda
+  estiver na fila é cancelado); depois, recebe um slot novo (e precisa ser
+  cadastrada de novo no sensor);
+- digital removida, que muda de portão ou de sensor_id põe um DELETE do
+  slot antigo na fila.
+
+Um slot só volta a ficar livre quando o sensor confirma que o template saiu
+(`template_deleted()`, no delete_success: a digital inativa que o reservava
+fica sem sensor_id) ou quando o SLOTS mostra o slot vazio (`free_empty()`).
+Liberar antes disso deixaria o template antigo no slot até o novo cadastro:
+o dedo de quem saiu seria reconhecido como o novo dono.
+
+`QuerySet.update()` não passa por aqui: depois de mudanças em massa, rode
+`manage.py sensor_slots --rebuild`, que recalcula o bitmap a partir das
+digitais (e dos DELETE ainda na fila).
+
+O que está gravado de fato no DY-50 vem do comando SLOTS (ReadIndexTable do
+sensor): o Arduino responde `{"status":"slots","count":N,"bitmap":"<hex>"}`,
+com o byte k / bit b do bitmap = template k*8+b. `record_dump()` guarda a
+leitura e `diff_dump()` compara com as digitais ativas (ver
+sensor_jobs.reconcile).
+"""
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .models import PORTAO_PADRAO, AcaoSensor, ComandoSensor, Digital, MapaSlots, StatusComando
+from .sensor_cache import MAX_SENSOR_ID, sensor_cache
+
+MAPA_SENSOR = 'sensor'
+MAPA_LEITURA = 'leitura'
+_FULL = (1 << MAX_SENSOR_ID) - 1
+
+
+class SensorCheio(ValidationError):
+    pass
+
+
+def portoes():
+    """Portões conhecidos: os das digitais e dos mapas, mais o padrão."""
+    conhecidos = set(Digital.objects.values_list('portao', flat=True).distinct())
+    conhecidos.update(MapaSlots.objects.values_list('portao', flat=True).distinct())
+    conhecidos.add(PORTAO_PADRAO)
+    return sorted(conhecidos)
+
+
+def _bits_from_db(portao, **filters):
+    bits = 0
+    rows = Digital.objects.filter(portao=portao, sensor_id__isnull=False, **filters).values_list('sensor_id', flat=True)
+    for sensor_id in rows:
+        if 1 <= sensor_id <= MAX_SENSOR_ID:
+            bits |= 1 << (sensor_id - 1)
+    return bits
+
+
+def _ids(bits):
+    ids = []
+    while bits:
+        low = bits & -bits
+        ids.append(low.bit_length())
+        bits ^= low
+    return ids
+
+
+def _to_bits(mapa):
+    return int.from_bytes(bytes(mapa.bitmap), 'little')
+
+
+def _save(mapa, bits):
+    mapa.bitmap = bits.to_bytes(MAX_SENSOR_ID // 8, 'little')
+    mapa.atualizado_em = timezone.now()
+    mapa.save(update_fields=['bitmap', 'atualizado_em'])
+
+
+def _lock(portao):
+    """Trava (ou cria a partir das digitais) o bitmap do portão. Chamar dentro de transaction.atomic()."""
+    mapa = MapaSlots.objects.select_for_update().filter(nome=MAPA_SENSOR, portao=portao).first()
+    if mapa is None:
+        mapa, _ = MapaSlots.objects.get_or_create(nome=MAPA_SENSOR, portao=portao)
+        mapa = MapaSlots.objects.select_for_update().get(pk=mapa.pk)
+        if not mapa.bitmap:
+            _save(mapa, _bits_from_db(portao))
+    return mapa, _to_bits(mapa)
+
+
+def lowest_free(bits):
+    """Menor sensor_id livre no bitmap, ou None se o sensor estiver cheio."""
+    free = ~bits & _FULL
+    if not free:
+        return None
+    return (free & -free).bit_length()
+
+
+def free_count(portao=PORTAO_PADRAO):
+    mapa = MapaSlots.objects.filter(nome=MAPA_SENSOR, portao=portao).first()
+    bits = _to_bits(mapa) if mapa and mapa.bitmap else _bits_from_db(portao)
+    return MAX_SENSOR_ID - bin(bits).count('1')
+
+
+def allocate(portao=PORTAO_PADRAO):
+    """Reserva e retorna o menor slot livre no sensor do portão."""
+    with transaction.atomic():
+        mapa, bits = _lock(portao)
+        slot = lowest_free(bits)
+        if slot is None:
+            raise SensorCheio(f"Todos os {MAX_SENSOR_ID} slots do sensor ({portao}) estão ocupados.")
+        _save(mapa, bits | 1 << (slot - 1))
+    return slot
+
+
+def _pending_deletes(portao):
+    """ComandoSensor DELETE do portão ainda não concluídos."""
+    return ComandoSensor.objects.filter(
+        portao=portao, acao=AcaoSensor.DELETE, status__in=[StatusComando.PENDENTE, StatusComando.ENVIADO],
+    )
+
+
+def queue_delete(sensor_id, portao=PORTAO_PADRAO):
+    """Põe na fila o DELETE do template do slot; o bit continua marcado até o delete_success."""
+    from . import sensor_jobs
+
+    if sensor_id is None or not 1 <= sensor_id <= MAX_SENSOR_ID:
+        return
+    if _pending_deletes(portao).filter(sensor_id=sensor_id).exists():
+        return
+    sensor_jobs.enqueue(AcaoSensor.DELETE, sensor_ids=[sensor_id], portao=portao)
+    transaction.on_commit(sensor_jobs.advance_in_background)
+
+
+def template_deleted(sensor_id, portao=PORTAO_PADRAO):
+    """
+    DELETE confirmado pelo sensor: a digital inativa que reservava o slot
+    fica sem sensor_id e o slot fica livre, a não ser que uma digital ativa
+    o use (ex: reativada depois que o DELETE já tinha ido ao sensor).
+    Retorna se o slot foi liberado.
+    """
+    if sensor_id is None or not 1 <= sensor_id <= MAX_SENSOR_ID:
+        return False
+    with transaction.atomic():
+        mapa, bits = _lock(portao)
+        # update() não passa por save()/sync_digital: o bitmap é ajustado aqui
+        Digital.objects.filter(portao=portao, sensor_id=sensor_id, ativo=False).update(sensor_id=None)
+        if Digital.objects.filter(portao=portao, sensor_id=sensor_id).exists():
+            return False
+        _save(mapa, bits & ~(1 << (sensor_id - 1)))
+    return True
+
+
+def free_empty(sensor_bits, portao=PORTAO_PADRAO):
+    """
+    Libera os slots reservados sem digital que a leitura do sensor mostra
+    vazios (ex: DELETE que falhou porque o slot nunca foi gravado).
+    Retorna os IDs liberados.
+    """
+    with transaction.atomic():
+        mapa, bits = _lock(portao)
+        orfaos = bits & ~_bits_from_db(portao) & ~sensor_bits
+        if orfaos:
+            _save(mapa, bits & ~orfaos)
+    return _ids(orfaos)
+
+
+def sync_digital(digital):
+    """Ajusta digital.sensor_id, o bitmap e os DELETE da fila antes de salvar (ver módulo)."""
+    old_id, old_portao, old_ativo = None, digital.portao, False
+    if digital.pk:
+        old = Digital.objects.filter(pk=digital.pk).values_list('sensor_id', 'portao', 'ativo').first()
+        if old:
+            old_id, old_portao, old_ativo = old
+    moved = old_portao != digital.portao
+    # Mudou de portão sem escolher outro ID: ganha um slot no sensor de lá
+    new_id = None if moved and digital.sensor_id == old_id else digital.sensor_id
+
+    if old_id is not None:
+        if moved or new_id != old_id:
+            queue_delete(old_id, old_portao)
+        elif old_ativo and not digital.ativo:
+            queue_delete(old_id, old_portao)
+        elif not old_ativo and digital.ativo:
+            # Reativada antes do DELETE ir ao sensor: o template ainda vale
+            _pending_deletes(old_portao).filter(sensor_id=old_id, status=StatusComando.PENDENTE).update(
+                status=StatusComando.FALHOU, concluido_em=timezone.now(),
+                mensagem="Cancelado: a digital foi reativada.",
+            )
+        if not moved and new_id == old_id:
+            return
+    if not digital.ativo:
+        # Inativa só guarda o slot em que já estava (até o delete_success); nunca ganha outro.
+        # Vale também para uma instância antiga que ainda traz o sensor_id já liberado.
+        digital.sensor_id = None
+        return
+
+    mapa, bits = _lock(digital.portao)
+    if new_id is None:
+        new_id = lowest_free(bits)
+        if new_id is None:
+            raise SensorCheio(f"Todos os {MAX_SENSOR_ID} slots do sensor ({digital.portao}) estão ocupados.")
+    if 1 <= new_id <= MAX_SENSOR_ID:
+        # ID escolhido à mão: se outra digital já usa, o UNIQUE falha e desfaz o bitmap junto
+        _save(mapa, bits | 1 << (new_id - 1))
+    digital.sensor_id = new_id
+
+
+def rebuild(portao=PORTAO_PADRAO):
+    """
+    Recalcula o bitmap do portão a partir das digitais e dos DELETE ainda na
+    fila. Retorna (ocupados antes, depois).
+    """
+    with transaction.atomic():
+        mapa, bits = _lock(portao)
+        new_bits = _bits_from_db(portao)
+        for sensor_id in _pending_deletes(portao).values_list('sensor_id', flat=True):
+            if sensor_id is not None and 1 <= sensor_id <= MAX_SENSOR_ID:
+                new_bits |= 1 << (sensor_id - 1)
+        _save(mapa, new_bits)
+    return bin(bits).count('1'), bin(new_bits).count('1')
+
+
+def report(portao=PORTAO_PADRAO):
+    """
+    Ocupação e fragmentação da memória do sensor.
+
+    `fragmentacao` é 1 - (maior bloco livre / slots livres): 0 quando todo o
+    espaço livre é contíguo. `plano_compactacao` lista os recadastros
+    (slot atual -> slot livre mais baixo) que deixariam os ocupados em 1..N.
+    """
+    mapa = MapaSlots.objects.filter(nome=MAPA_SENSOR, portao=portao).first()
+    db_bits = _bits_from_db(portao)
+    bits = _to_bits(mapa) if mapa and mapa.bitmap else db_bits
+
+    used = [i for i in range(1, MAX_SENSOR_ID + 1) if bits >> (i - 1) & 1]
+    blocos = []
+    start = None
+    for i in range(1, MAX_SENSOR_ID + 2):
+        livre = i <= MAX_SENSOR_ID and not bits >> (i - 1) & 1
+        if livre and start is None:
+            start = i
+        elif not livre and start is not None:
+            blocos.append((start, i - 1))
+            start = None
+
+    livres = MAX_SENSOR_ID - len(used)
+    maior = max((fim - ini + 1 for ini, fim in blocos), default=0)
+    maior_usado = used[-1] if used else 0
+    buracos = [i for i in range(1, maior_usado) if not bits >> (i - 1) & 1]
+
+    plano = []
+    altos = list(reversed(used))
+    for destino in buracos:
+        if not altos or altos[0] < destino:
+            break
+        plano.append((altos.pop(0), destino))
+
+    return {
+        'portao': portao,
+        'capacidade': MAX_SENSOR_ID,
+        'ocupados': len(used),
+        'livres': livres,
+        'maior_usado': maior_usado,
+        'blocos_livres': blocos,
+        'maior_bloco_livre': maior,
+        'buracos': buracos,
+        'fragmentacao': round(1 - maior / livres, 3) if livres else 0.0,
+        'plano_compactacao': plano,
+        'bitmap': ''.join('#' if bits >> (i - 1) & 1 else '.' for i in range(1, MAX_SENSOR_ID + 1)),
+        # Divergências entre o bitmap e a tabela de digitais (corrigir com --rebuild).
+        # Slots esperando o delete_success de uma digital removida aparecem em so_no_mapa.
+        'so_no_mapa': [i for i in used if not db_bits >> (i - 1) & 1],
+        'so_no_banco': [i for i in range(1, MAX_SENSOR_ID + 1) if db_bits >> (i - 1) & 1 and not bits >> (i - 1) & 1],
+    }
+
+
+# --- Leitura do sensor (SLOTS) ---
+
+def parse_dump(hex_bitmap):
+    """
+    Converte o bitmap do SLOTS em (bits no formato do MapaSlots, IDs fora de
+    1..200 que o sensor diz ter).
+    """
+    raw = int.from_bytes(bytes.fromhex(hex_bitmap or ''), 'little')
+    fora = _ids(raw & ~(_FULL << 1))
+    return raw >> 1 & _FULL, [i - 1 for i in fora]
+
+
+def record_dump(msg, portao=PORTAO_PADRAO):
+    """Guarda o bitmap lido do sensor do portão. Retorna o mesmo que `parse_dump()`."""
+    bits, fora = parse_dump(msg.get('bitmap'))
+    mapa, _ = MapaSlots.objects.get_or_create(nome=MAPA_LEITURA, portao=portao)
+    _save(mapa, bits)
+    return bits, fora
+
+
+def last_dump(portao=PORTAO_PADRAO):
+    """(bits, lido_em) do último SLOTS do portão, ou (None, None) se o sensor nunca foi lido."""
+    mapa = MapaSlots.objects.filter(nome=MAPA_LEITURA, portao=portao).first()
+    if mapa is None or not mapa.bitmap:
+        return None, None
+    return _to_bits(mapa), mapa.atualizado_em
+
+
+def diff_dump(sensor_bits, portao=PORTAO_PADRAO):
+    """
+    Compara o sensor com as digitais ativas do portão numa passada (operações de bits).
+    `cadastrar`: digitais ativas sem template no sensor;
+    `remover`: templates no sensor sem digital ativa.
+    """
+    db_bits = _bits_from_db(portao, ativo=True)
+    return {
+        'cadastrar': _ids(db_bits & ~sensor_bits),
+        'remover': _ids(sensor_bits & ~db_bits),
+        'em_dia': bin(db_bits & sensor_bits).count('1'),
+    }
+
+
+def sensor_wiped(portao=PORTAO_PADRAO):
+    """
+    DELETE_ALL concluído: nenhum template sobrou no sensor do portão, então as
+    digitais dele deixam de valer (ficam inativas, sem slot) e os mapas são
+    zerados. Retorna quantas digitais foram desativadas.
+
+    O update() não dispara os signals, então o sensor_cache é invalidado
+    aqui (agora e de novo após o commit, como em signals.py).
+    """
+    with transaction.atomic():
+        # update() não passa por save(): o bitmap é zerado logo abaixo
+        desativadas = Digital.objects.filter(portao=portao, sensor_id__isnull=False).update(ativo=False, sensor_id=None)
+        mapa, _ = _lock(portao)
+        _save(mapa, 0)
+        leitura, _ = MapaSlots.objects.get_or_create(nome=MAPA_LEITURA, portao=portao)
+        _save(leitura, 0)
+        sensor_cache.invalidate()
+        transaction.on_commit(sensor_cache.invalidate)
+    return desativadas
@@ -0,0 +1,28 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Digital, Usuario
+from .sensor_cache import sensor_cache
+from . import sensor_slots
+
+
+def _invalidate_sensor_cache():
+    sensor_cache.invalidate()
+    # De novo após o commit: outra thread pode ter recarregado antes dele
+    transaction.on_commit(sensor_cache.invalidate)
+
+
+@receiver(post_save, sender=Digital)
+@receiver(post_delete, sender=Digital)
+@receiver(post_save, sender=Usuario)
+@receiver(post_delete, sender=Usuario)
+def invalidate_sensor_cache(sender, **kwargs):
+    """Qualquer mudança em digitais ou usuários invalida o cache sensor_id -> usuário."""
+    _invalidate_sensor_cache()
+
+
+@receiver(post_delete, sender=Digital)
+def release_sensor_slot(sender, instance, **kwargs):
+    """Digital removida: o template sai do sensor e o slot fica livre no delete_success (ver sensor_slots.py)."""
+    sensor_slots.queue_delete(instance.sensor_id, instance.portao)
@@ -1,3 +1,691 @@
+import asyncio
+import csv
+import json
+import threading
+from datetime import datetime, timedelta
+from unittest import mock
+
+import requests
+from asgiref.sync import sync_to_async
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import (
+    Usuario, Sala, Digital, UsuarioSala, HistoricoAcesso, Dedo, AcessoPendente, AcaoSensor, StatusComando,
+    ComandoSensor, Presenca, RollupEstado,
+)
+from . import sensor_jobs, sensor_slots
+from .events import PendingBroadcaster, pending_broadcaster
+from .occupancy import replay_history, room_occupancy
+from .benchmark import measure_queries, seed
+from .rollups import refresh_rollups, report as rollup_report
+from .sensor_cache import sensor_cache
+
+
+class AdminChangelistQueriesTest(TestCase):
+    """As listagens do admin não podem fazer uma consulta por linha."""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'senha')
+        self.client.force_login(self.admin)
+
+    def create_usuarios(self, total, offset=0):
+        dedos = [d for d, _ in Dedo.choices]
+        for i in range(offset, offset + total):
+            usuario = Usuario.objects.create(nome=f"Usuário {i}", codigo=f"U{i:04d}")
+            sala = Sala.objects.create(nome=f"Sala {i}")
+            UsuarioSala.objects.create(usuario=usuario, sala=sala)
+            Digital.objects.create(usuario=usuario, sensor_id=i + 1, dedo=dedos[0])
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_usuario_changelist_query_count_independent_of_page_size(self):
+        self.create_usuarios(3)
+        small = self.changelist_queries('/admin/biometria/usuario/')
+        self.create_usuarios(30, offset=3)
+        large = self.changelist_queries('/admin/biometria/usuario/')
+        self.assertEqual(small, large)
+
+    def test_sala_changelist_query_count_independent_of_page_size(self):
+        self.create_usuarios(3)
+        small = self.changelist_queries('/admin/biometria/sala/')
+        self.create_usuarios(30, offset=3)
+        large = self.changelist_queries('/admin/biometria/sala/')
+        self.assertEqual(small, large)
+
+    def test_annotated_columns_are_sortable(self):
+        self.create_usuarios(2)
+        usuario = Usuario.objects.get(codigo='U0000')
+        Digital.objects.create(usuario=usuario, sensor_id=100, dedo=Dedo.MEDIO_ESQ)
+        # Colunas 5 e 6 = total_salas / total_digitais
+        response = self.client.get('/admin/biometria/usuario/?o=-6')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_list[0], usuario)
+        self.assertEqual(response.context['cl'].result_list[0]._total_digitais, 2)
+
+    def test_historico_changelist_query_count_independent_of_page_size(self):
+        self.create_usuarios(3)
+        sala = Sala.objects.first()
+        for usuario in Usuario.objects.all():
+            HistoricoAcesso.objects.create(usuario=usuario, sala=sala, tipo_acesso='entrada',
+                                           metadata={'sensor_id': 1, 'confidence': 90})
+        small = self.changelist_queries('/admin/biometria/historicoacesso/')
+        for usuario in Usuario.objects.all():
+            for _ in range(10):
+                HistoricoAcesso.objects.create(usuario=usuario, sala=sala, tipo_acesso='entrada')
+        large = self.changelist_queries('/admin/biometria/historicoacesso/')
+        self.assertEqual(small, large)
+
+    def test_historico_keyset_pages_cover_everything_without_offset(self):
+        self.create_usuarios(1)
+        usuario, sala = Usuario.objects.get(), Sala.objects.get()
+        base = timezone.now()
+        # Metade com o mesmo data_hora: o desempate é pelo id
+        for i in range(12):
+            HistoricoAcesso.objects.create(usuario=usuario, sala=sala, tipo_acesso='entrada',
+                                           data_hora=base - timedelta(minutes=i // 2))
+        seen, query = [], ''
+        with mock.patch('biometria.admin.HistoricoAcessoAdmin.list_per_page', 5):
+            while query is not None:
+                with CaptureQueriesContext(connection) as ctx:
+                    response = self.client.get('/admin/biometria/historicoacesso/' + query)
+                cl = response.context['cl']
+                seen.extend(row.pk for row in cl.result_list)
+                self.assertFalse(any('OFFSET' in q['sql'] for q in ctx.captured_queries))
+                query = cl.next_page_url
+                if query:
+                    self.assertContains(response, 'Próximos 5')
+        expected = list(HistoricoAcesso.objects.order_by('-data_hora', '-id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+
+
+class RollupRefreshTest(TestCase):
+    """O refresh dos rollups é incremental, espera os acessos pendentes e corrige confirmações atrasadas."""
+
+    def setUp(self):
+        self.sala = Sala.objects.create(nome="Lab")
+        self.usuario = Usuario.objects.create(nome="Ana", codigo="A1")
+
+    def total(self, granularidade='dia', **filters):
+        return sum(row['total'] for row in rollup_report(granularidade, **filters))
+
+    def test_refresh_is_incremental_and_waits_for_pending(self):
+        for _ in range(3):
+            HistoricoAcesso.objects.create(usuario=self.usuario, sala=self.sala, tipo_acesso='entrada')
+        refresh_rollups(lag=0)
+        refresh_rollups(lag=0)  # Sem acessos novos: não soma de novo
+        self.assertEqual(self.total(), 3)
+
+        pendente = HistoricoAcesso.objects.create(usuario=self.usuario, tipo_acesso='entrada')
+        AcessoPendente.objects.create(historico=pendente, usuario=self.usuario,
+                                      expira_em=timezone.now() + timedelta(seconds=30))
+        refresh_rollups(lag=0)
+        self.assertEqual(self.total('hora'), 3)
+
+        pendente.sala = self.sala
+        pendente.save()
+        AcessoPendente.objects.all().delete()
+        refresh_rollups(lag=0)
+        self.assertEqual(self.total(sala=self.sala.id), 4)
+        self.assertEqual(self.total('hora', sala=self.sala.id), 4)
+
+    def test_new_ids_wait_for_the_safety_lag(self):
+        first = HistoricoAcesso.objects.create(usuario=self.usuario, sala=self.sala, tipo_acesso='entrada')
+        # Primeira execução só registra o maior id visto
+        self.assertEqual(refresh_rollups(lag=60), (0, 0))
+        HistoricoAcesso.objects.create(usuario=self.usuario, sala=self.sala, tipo_acesso='entrada')
+        self.assertEqual(refresh_rollups(lag=60), (0, 0))
+
+        RollupEstado.objects.update(visto_em=timezone.now() - timedelta(seconds=61))
+        # Só até o id visto há 60 s: o segundo (que poderia ter um vizinho menor ainda sem commit) espera
+        self.assertEqual(refresh_rollups(lag=60), (0, first.id))
+        self.assertEqual(self.total(), 1)
+
+    def test_late_confirmation_is_rerolled(self):
+        acesso = HistoricoAcesso.objects.create(usuario=self.usuario, tipo_acesso='entrada')
+        AcessoPendente.objects.create(historico=acesso, usuario=self.usuario,
+                                      expira_em=timezone.now() - timedelta(seconds=1))
+        refresh_rollups(lag=0)
+        self.assertEqual(self.total(sala=self.sala.id), 0)
+
+        # A confirmação commitou depois da execução que somou o acesso sem sala
+        acesso.sala = self.sala
+        acesso.tipo_acesso = 'saida'
+        acesso.save()
+        refresh_rollups(lag=0)
+        self.assertEqual(self.total(sala=self.sala.id, tipo_acesso='saida'), 1)
+        self.assertEqual(self.total('hora'), 1)
+        self.assertEqual(self.total(), 1)
+
+
+class MatchFlowQueriesTest(TestCase):
+    """Consultas por endpoint do fluxo de match (mesma medição do `benchmark_api`)."""
+
+    def test_query_counts_do_not_grow(self):
+        counts = measure_queries(seed(usuarios=50, salas=5))
+        self.assertLessEqual(counts['log_access'], 4)
+        self.assertLessEqual(counts['check_pending'], 2)
+        self.assertLessEqual(counts['confirm_room'], 10)
+
+
+class MetricsEndpointTest(TestCase):
+
+    def test_requests_are_recorded_per_url_name(self):
+        self.client.get('/api/check_pending/')
+        response = self.client.get('/api/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('django_http_request_duration_seconds_count{view="check_pending",method="GET"}', body)
+        self.assertIn('django_db_queries_per_request_bucket{view="check_pending",le="+Inf"}', body)
+
+    @mock.patch.dict('os.environ', {'BRIDGE_API_URL': 'http://bridge.invalid/command'})
+    def test_bridge_calls_are_timed_per_action(self):
+        from .views import send_bridge_command
+        with mock.patch('biometria.views.get_bridge_session') as session, self.assertLogs('biometria.views', 'ERROR'):
+            session.return_value.post.side_effect = requests.exceptions.ConnectionError("recusado")
+            ok, _ = send_bridge_command("DELETE:9")
+        self.assertFalse(ok)
+        body = self.client.get('/api/metrics').content.decode()
+        self.assertIn('django_bridge_command_duration_seconds_count{acao="DELETE",outcome="error"}', body)
+
+
+class LogAccessBatchTest(TestCase):
+    """O lote grava cada evento uma vez só e um evento ruim não derruba os outros."""
+
+    def setUp(self):
+        self.usuario = Usuario.objects.create(nome="Ana", codigo="A1")
+        Digital.objects.create(usuario=self.usuario, sensor_id=5, dedo=Dedo.INDICADOR_DIR)
+
+    def post_batch(self, events):
+        response = self.client.post('/api/log_access_batch/', {'events': events}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return [r['status'] for r in response.json()['results']]
+
+    def test_duplicates_in_batch_and_already_known(self):
+        now = timezone.now().timestamp()
+        self.client.post('/api/log_access/', {'sensor_id': 5, 'event_id': 'a'}, content_type='application/json')
+        statuses = self.post_batch([
+            {'sensor_id': 5, 'event_id': 'a', 'received_at': now},
+            {'sensor_id': 5, 'event_id': 'b', 'received_at': now},
+            {'sensor_id': 5, 'event_id': 'b', 'received_at': now},
+            {'sensor_id': 9, 'event_id': 'c', 'received_at': now},
+        ])
+        self.assertEqual(statuses, ['duplicate', 'created', 'duplicate', 'unknown_sensor'])
+        self.assertEqual(HistoricoAcesso.objects.count(), 3)
+
+    def test_invalid_events_are_rejected_one_by_one(self):
+        statuses = self.post_batch([
+            {'sensor_id': 5, 'event_id': 'x' * 100},
+            {'sensor_id': 5, 'event_id': {'nested': 1}},
+            {'event_id': 'sem-sensor'},
+            'nem-objeto',
+            {'sensor_id': 5, 'event_id': 'ok'},
+        ])
+        self.assertEqual(statuses, ['invalid', 'invalid', 'invalid', 'invalid', 'created'])
+        self.assertEqual(list(HistoricoAcesso.objects.values_list('chave_idempotencia', flat=True)), ['ok'])
+
+        response = self.client.post('/api/log_access/', {'sensor_id': 5, 'event_id': 'x' * 100},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_only_events_inside_window_become_pending(self):
+        now = timezone.now().timestamp()
+        self.post_batch([
+            {'sensor_id': 5, 'event_id': 'recente', 'received_at': now - 5},
+            {'sensor_id': 5, 'event_id': 'antigo', 'received_at': now - 3600},
+        ])
+        pendentes = AcessoPendente.objects.values_list('historico__chave_idempotencia', flat=True)
+        self.assertEqual(list(pendentes), ['recente'])
+
+
+class PendingPushTest(TestCase):
+    """Um match acorda os dashboards em espera (SSE/long-poll) sem prender threads no WSGI."""
+
+    def setUp(self):
+        self.usuario = Usuario.objects.create(nome="Ana", codigo="A1")
+        Digital.objects.create(usuario=self.usuario, sensor_id=5, dedo=Dedo.INDICADOR_DIR)
+
+    def log_match(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/log_access/', {'sensor_id': 5}, content_type='application/json')
+
+    async def test_broadcaster_wakes_waiters_from_other_threads(self):
+        broadcaster = PendingBroadcaster()
+        self.assertEqual(await broadcaster.wait(0, timeout=0.01), (0, None))
+        asyncio.get_running_loop().call_later(
+            0.05, lambda: threading.Thread(target=broadcaster.publish, args=({'access_id': 1},)).start())
+        self.assertEqual(await broadcaster.wait(0, timeout=5), (1, {'access_id': 1}))
+        # Versão já vista ficou para trás: responde na hora
+        self.assertEqual(await broadcaster.wait(0, timeout=5), (1, {'access_id': 1}))
+
+    async def test_long_poll_answers_when_a_match_is_published(self):
+        since = pending_broadcaster.version
+
+        async def match_later():
+            await asyncio.sleep(0.05)
+            await sync_to_async(self.log_match)()
+
+        response, _ = await asyncio.gather(self.async_client.get(f'/api/wait_pending/?since={since}'), match_later())
+        data = response.json()
+        self.assertTrue(data['pending'])
+        self.assertEqual((data['usuario_codigo'], data['version']), ("A1", since + 1))
+
+    async def test_stream_sends_current_pending_first(self):
+        await sync_to_async(self.log_match)()
+        response = await self.async_client.get('/api/pending_stream/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunk = await anext(aiter(response.streaming_content))
+        await response.streaming_content.aclose()
+        self.assertIn(b'event: pending', chunk)
+        self.assertIn(b'"usuario_codigo": "A1"', chunk)
+
+    def test_wsgi_refuses_held_requests(self):
+        # No WSGI cada espera seguraria uma thread: o dashboard fica no check_pending
+        self.assertEqual(self.client.get('/api/wait_pending/?since=0').status_code, 501)
+        self.assertEqual(self.client.get('/api/pending_stream/').status_code, 501)
+
+    def test_batch_publishes_recent_matches(self):
+        version = pending_broadcaster.version
+        now = timezone.now().timestamp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/log_access_batch/', {'events': [
+                {'sensor_id': 5, 'event_id': 'recente', 'received_at': now - 5},
+                {'sensor_id': 5, 'event_id': 'antigo', 'received_at': now - 3600},
+                {'sensor_id': 9, 'event_id': 'desconhecido', 'received_at': now},
+            ]}, content_type='application/json')
+        self.assertEqual(pending_broadcaster.version, version + 1)
+        self.assertEqual(pending_broadcaster.last_event['usuario_codigo'], "A1")
+
+
+class OccupancyTest(TestCase):
+    """Cada confirmação de entrada/saída mantém a Presenca; só acessos ainda pendentes são confirmados."""
+
+    def setUp(self):
+        self.ana = Usuario.objects.create(nome="Ana", codigo="A1")
+        Digital.objects.create(usuario=self.ana, sensor_id=5, dedo=Dedo.INDICADOR_DIR)
+        self.lab = Sala.objects.create(nome="Lab")
+        self.aula = Sala.objects.create(nome="Aula")
+
+    def match(self):
+        self.client.post('/api/log_access/', {'sensor_id': 5}, content_type='application/json')
+        return HistoricoAcesso.objects.latest('id').id
+
+    def confirm(self, access_id, sala, tipo_acesso):
+        return self.client.post('/api/confirm_room/', {
+            'access_id': access_id, 'sala_id': sala.id, 'tipo_acesso': tipo_acesso,
+        }, content_type='application/json')
+
+    def present(self):
+        return {(room['sala_nome'], user['codigo']) for room in room_occupancy() for user in room['usuarios']}
+
+    def test_entry_then_exit(self):
+        access_id = self.match()
+        self.assertEqual(self.confirm(access_id, self.lab, 'entrada').status_code, 200)
+        self.assertEqual(self.present(), {("Lab", "A1")})
+        self.assertEqual(Presenca.objects.get().historico_id, access_id)
+
+        self.assertEqual(self.confirm(self.match(), self.lab, 'saida').status_code, 200)
+        self.assertEqual(self.present(), set())
+
+    def test_only_pending_accesses_are_confirmed(self):
+        access_id = self.match()
+        self.confirm(access_id, self.lab, 'entrada')
+        # Segunda confirmação (ex: outro dashboard) não muda a sala nem a ocupação
+        response = self.confirm(access_id, self.aula, 'saida')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(HistoricoAcesso.objects.get(pk=access_id).sala, self.lab)
+        self.assertEqual(self.present(), {("Lab", "A1")})
+
+        expired = self.match()
+        AcessoPendente.objects.filter(historico_id=expired).update(expira_em=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.confirm(expired, self.lab, 'saida').status_code, 409)
+        self.assertEqual(self.present(), {("Lab", "A1")})
+
+    def test_replay_history_rebuilds_presenca(self):
+        inicio = timezone.now() - timedelta(hours=2)
+
+        def acesso(minutes, sala, tipo_acesso):
+            return HistoricoAcesso.objects.create(usuario=self.ana, sala=sala, tipo_acesso=tipo_acesso,
+                                                  data_hora=inicio + timedelta(minutes=minutes))
+
+        acesso(0, self.lab, 'entrada')
+        na_aula = acesso(10, self.aula, 'entrada')
+        acesso(20, self.lab, 'saida')
+        acesso(30, None, 'entrada')  # Nunca confirmado: não conta
+        Presenca.objects.create(sala=self.lab, usuario=self.ana)  # Estado divergente
+
+        self.assertEqual(replay_history(chunk_size=2), (3, 1))
+        presenca = Presenca.objects.get()
+        self.assertEqual((presenca.sala, presenca.historico_id, presenca.desde), (self.aula, na_aula.id, na_aula.data_hora))
+
+
+class ExportHistoryTest(TestCase):
+    """A exportação sai em streaming, linha a linha, sem carregar o queryset inteiro."""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'senha'))
+        ana = Usuario.objects.create(nome="Ana, a Primeira", codigo="A1")
+        self.lab = Sala.objects.create(nome="Lab")
+        dia = timezone.make_aware(datetime(2025, 3, 10, 8, 0))
+        for i in range(5):
+            HistoricoAcesso.objects.create(usuario=ana, sala=self.lab if i % 2 == 0 else None, tipo_acesso='entrada',
+                                           data_hora=dia + timedelta(days=i), metadata={'confidence': 90 + i})
+
+    def test_csv_streams_filtered_rows(self):
+        response = self.client.get('/api/historico/export/', {'sala': self.lab.id, 'fim': '2025-03-13'})
+        self.assertTrue(response.streaming)
+        chunks = iter(response.streaming_content)
+        with CaptureQueriesContext(connection) as ctx:
+            header = next(chunks)
+        # O cabeçalho sai antes de qualquer consulta ao histórico
+        self.assertEqual(len(ctx.captured_queries), 0)
+        # Daqui em diante, só o iterator(): nada de _fetch_all (queryset inteiro em memória)
+        with mock.patch('django.db.models.query.QuerySet._fetch_all', side_effect=AssertionError("_fetch_all")):
+            body = b''.join([header, *chunks]).decode()
+
+        rows = list(csv.DictReader(body.splitlines()))
+        self.assertEqual(len(rows), 2)  # dias 10 e 12 (14 fica fora do `fim`)
+        self.assertEqual(rows[0]['usuario_nome'], "Ana, a Primeira")
+        self.assertEqual(rows[0]['sala_nome'], "Lab")
+        self.assertEqual(json.loads(rows[1]['metadata']), {'confidence': 92})
+        self.assertTrue(rows[0]['data_hora'].startswith('2025-03-10T'))
+
+    def test_ndjson_and_bad_filters(self):
+        response = self.client.get('/api/historico/export/', {'formato': 'ndjson', 'inicio': '2025-03-13'})
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([r['metadata']['confidence'] for r in records], [93, 94])
+        self.assertEqual(self.client.get('/api/historico/export/', {'inicio': 'ontem'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/historico/export/', {'formato': 'xml'}).status_code, 400)
+
+
+class SensorCacheInvalidationTest(TestCase):
+    """Um cache velho atribuiria o match à pessoa errada: toda mudança tem que invalidá-lo."""
+
+    def setUp(self):
+        self.ana = Usuario.objects.create(nome="Ana", codigo="A1")
+        self.bia = Usuario.objects.create(nome="Bia", codigo="B1")
+        self.digital = Digital.objects.create(usuario=self.ana, sensor_id=4, dedo=Dedo.INDICADOR_DIR)
+        self.assertEqual(sensor_cache.get(4).codigo, "A1")
+
+    def test_digital_save_and_delete(self):
+        self.digital.usuario = self.bia
+        self.digital.save()
+        self.assertEqual(sensor_cache.get(4).codigo, "B1")
+        self.digital.delete()
+        self.assertIsNone(sensor_cache.get(4))
+
+    def test_usuario_save_and_delete(self):
+        self.ana.nome = "Ana Maria"
+        self.ana.save()
+        self.assertEqual(sensor_cache.get(4).nome, "Ana Maria")
+        self.ana.delete()
+        self.assertIsNone(sensor_cache.get(4))
+
+    def test_sensor_wiped(self):
+        sensor_slots.sensor_wiped()
+        self.assertIsNone(sensor_cache.get(4))
+
+
+@mock.patch('biometria.views.send_bridge_command', return_value=(True, {'status': 'command_sent'}))
+class SensorJobQueueTest(TestCase):
+    """Os comandos vão para o sensor um de cada vez, guiados pelas linhas de status."""
+
+    def test_commands_are_serialized(self, send):
+        usuario = Usuario.objects.create(nome="Ana", codigo="A1")
+        Digital.objects.create(usuario=usuario, sensor_id=3, dedo=Dedo.INDICADOR_DIR)
+        Digital.objects.create(usuario=usuario, sensor_id=7, dedo=Dedo.MEDIO_DIR)
+        lote = sensor_jobs.enqueue(AcaoSensor.ENROLL, digitais=Digital.objects.order_by('sensor_id'))
+
+        sensor_jobs.advance_queue()
+        sensor_jobs.advance_queue()
+        self.assertEqual([c.args[0] for c in send.call_args_list], ["ENROLL:3"])
+
+        sensor_jobs.handle_status({'status': 'enroll_prompt_1'})
+        sensor_jobs.handle_status({'status': 'enroll_success', 'id': 3})
+        self.assertEqual([c.args[0] for c in send.call_args_list], ["ENROLL:3", "ENROLL:7"])
+
+        sensor_jobs.handle_status({'status': 'enroll_failed', 'msg': 'Erro Img1'})
+        progress = sensor_jobs.lote_progress(lote)
+        self.assertTrue(progress['terminado'])
+        self.assertEqual(progress['contagem'][StatusComando.CONCLUIDO], 1)
+        self.assertEqual(progress['contagem'][StatusComando.FALHOU], 1)
+
+    def test_lost_status_recovered_from_bridge(self, send):
+        usuario = Usuario.objects.create(nome="Ana", codigo="A1")
+        Digital.objects.create(usuario=usuario, sensor_id=3, dedo=Dedo.INDICADOR_DIR)
+        lote = sensor_jobs.enqueue(AcaoSensor.ENROLL, digitais=Digital.objects.all())
+        comando = sensor_jobs.advance_queue()
+        self.assertEqual(send.call_args.kwargs['command_id'], comando.bridge_id)
+
+        # Status de um comando do próprio bridge não casa com o da fila
+        self.assertIsNone(sensor_jobs.handle_status({'status': 'enroll_success', 'id': 3, 'command_id': 'abc'}))
+
+        # A linha de status se perdeu: a fila consulta o bridge
+        ComandoSensor.objects.filter(pk=comando.pk).update(enviado_em=timezone.now() - timedelta(seconds=30))
+        result = {'state': 'success', 'result': {'status': 'enroll_success', 'id': 3}}
+        with mock.patch('biometria.views.get_bridge_command', return_value=result) as poll:
+            sensor_jobs.advance_queue()
+        poll.assert_called_once_with(comando.bridge_id)
+        self.assertTrue(sensor_jobs.lote_progress(lote)['terminado'])
+        self.assertEqual(ComandoSensor.objects.get(pk=comando.pk).status, StatusComando.CONCLUIDO)
+
+    def test_command_is_claimed_before_calling_the_bridge(self, send):
+        usuario = Usuario.objects.create(nome="Ana", codigo="A1")
+        Digital.objects.create(usuario=usuario, sensor_id=3, dedo=Dedo.INDICADOR_DIR)
+        Digital.objects.create(usuario=usuario, sensor_id=7, dedo=Dedo.MEDIO_DIR)
+        sensor_jobs.enqueue(AcaoSensor.ENROLL, digitais=Digital.objects.order_by('sensor_id'))
+        seen = []
+
+        def bridge_down(command, **kwargs):
+            # Quando o HTTP começa o comando já está gravado como ENVIADO
+            seen.append(ComandoSensor.objects.get(sensor_id=3).status)
+            return False, 'Connection refused'
+
+        send.side_effect = bridge_down
+        for _ in range(sensor_jobs.SENSOR_JOB_MAX_TENTATIVAS - 1):
+            self.assertIsNone(sensor_jobs.advance_queue())
+            self.assertEqual(ComandoSensor.objects.get(sensor_id=3).status, StatusComando.PENDENTE)
+        send.side_effect = [(False, 'Connection refused'), (True, {'status': 'command_sent'})]
+        self.assertEqual(sensor_jobs.advance_queue().sensor_id, 7)
+        self.assertEqual(seen, [StatusComando.ENVIADO] * (sensor_jobs.SENSOR_JOB_MAX_TENTATIVAS - 1))
+        self.assertEqual(ComandoSensor.objects.get(sensor_id=3).status, StatusComando.FALHOU)
+
+    @mock.patch('biometria.sensor_jobs.advance_in_background')
+    def test_admin_reports_commands_actually_queued(self, advance, send):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'senha'))
+        usuario = Usuario.objects.create(nome="Ana", codigo="A1")
+        com_slot = Digital.objects.create(usuario=usuario, dedo=Dedo.INDICADOR_DIR)
+        sem_slot = Digital.objects.create(usuario=usuario, dedo=Dedo.MEDIO_DIR, ativo=False)
+
+        def run_action(*digitais):
+            return self.client.post('/admin/biometria/digital/', {
+                'action': 'send_enroll_command', '_selected_action': [d.pk for d in digitais],
+            }, follow=True)
+
+        response = run_action(com_slot, sem_slot)
+        self.assertEqual([str(m) for m in response.context['messages']], ["1 comando(s) ENROLL na fila do sensor."])
+        response = run_action(sem_slot)
+        self.assertEqual(advance.call_count, 1)
+        self.assertIn("nada foi enviado", str(list(response.context['messages'])[0]))
+
+    @mock.patch('biometria.sensor_jobs.advance_in_background')
+    def test_invalid_sensor_id_is_rejected(self, advance, send):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'senha'))
+        for url in ('/api/sensor/enroll/', '/api/sensor/delete/'):
+            for value in ('abc', 0, 201, [5]):
+                response = self.client.post(url, {'sensor_id': value}, content_type='application/json')
+                self.assertEqual(response.status_code, 400, (url, value))
+        self.assertFalse(ComandoSensor.objects.exists())
+        response = self.client.post('/api/sensor/delete/', {'sensor_id': '5'}, content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(ComandoSensor.objects.get().sensor_id, 5)
+
+        # Linha do bridge com id corrompido não casa com nada (nem derruba a view)
+        sensor_jobs.advance_queue()
+        response = self.client.post('/api/sensor/status/', {'status': 'delete_success', 'id': 'x5'},
+                                    content_type='application/json')
+        self.assertEqual(response.json(), {'matched': False})
+        self.assertEqual(ComandoSensor.objects.get().status, StatusComando.ENVIADO)
+
+
+@mock.patch('biometria.views.send_bridge_command', return_value=(True, {'status': 'command_sent'}))
+class SensorSlotAllocatorTest(TestCase):
+    """sensor_id vazio recebe o menor slot livre; um slot só fica livre depois que o sensor apaga o template."""
+
+    def setUp(self):
+        self.ana = Usuario.objects.create(nome="Ana", codigo="A1")
+        self.bia = Usuario.objects.create(nome="Bia", codigo="B1")
+
+    def delete_queue(self):
+        return list(ComandoSensor.objects.filter(acao=AcaoSensor.DELETE).order_by('id').values_list('sensor_id', 'status'))
+
+    def test_lowest_free_slot_and_reclaim(self, send):
+        manual = Digital.objects.create(usuario=self.ana, sensor_id=2, dedo=Dedo.POLEGAR_DIR)
+        first = Digital.objects.create(usuario=self.ana, dedo=Dedo.INDICADOR_DIR)
+        second = Digital.objects.create(usuario=self.ana, dedo=Dedo.MEDIO_DIR)
+        self.assertEqual((first.sensor_id, second.sensor_id), (1, 3))
+
+        # Removida: o slot 2 continua ocupado até o sensor confirmar o DELETE
+        manual.delete()
+        self.assertEqual(Digital.objects.create(usuario=self.ana, dedo=Dedo.ANELAR_DIR).sensor_id, 4)
+        sensor_jobs.advance_queue()
+        sensor_jobs.handle_status({'status': 'delete_success', 'id': 2})
+        self.assertEqual(Digital.objects.create(usuario=self.ana, dedo=Dedo.MINIMO_DIR).sensor_id, 2)
+
+        report = sensor_slots.report()
+        self.assertEqual(report['ocupados'], 4)
+        self.assertEqual(report['blocos_livres'], [(5, 200)])
+        self.assertEqual(report['so_no_mapa'], [])
+
+    def test_deactivate_enroll_other_then_reactivate(self, send):
+        ana = Digital.objects.create(usuario=self.ana, dedo=Dedo.INDICADOR_DIR)
+        ana.ativo = False
+        ana.save()
+        # O template vai sair do sensor; até lá o slot continua com a Ana
+        self.assertEqual(ana.sensor_id, 1)
+        self.assertEqual(self.delete_queue(), [(1, StatusComando.PENDENTE)])
+
+        bia = Digital.objects.create(usuario=self.bia, dedo=Dedo.INDICADOR_DIR)
+        self.assertEqual(bia.sensor_id, 2)
+        sensor_jobs.advance_queue()
+        sensor_jobs.handle_status({'status': 'delete_success', 'id': 1})
+        # Template apagado: a Ana perde o slot e ele volta a ficar livre
+        ana.refresh_from_db()
+        self.assertIsNone(ana.sensor_id)
+        self.assertEqual(sensor_slots.report()['ocupados'], 1)
+
+        # Reativada, recebe o menor slot livre e precisa ser cadastrada de novo
+        ana.ativo = True
+        ana.save()
+        self.assertEqual(Digital.objects.get(pk=ana.pk).sensor_id, 1)
+        self.assertEqual(sensor_slots.diff_dump(1 << 1)['cadastrar'], [1])
+
+    def test_full_sensor_frees_slot_after_deactivation(self, send):
+        ana = Digital.objects.create(usuario=self.ana, dedo=Dedo.INDICADOR_DIR)
+        for _ in range(199):
+            sensor_slots.allocate()
+        nova = Digital(usuario=self.bia, dedo=Dedo.INDICADOR_DIR)
+        with self.assertRaises(ValidationError):
+            nova.full_clean()
+
+        ana.ativo = False
+        ana.save()
+        # Ainda cheio até o sensor confirmar que apagou o template
+        self.assertEqual(sensor_slots.free_count(), 0)
+        sensor_jobs.advance_queue()
+        sensor_jobs.handle_status({'status': 'delete_success', 'id': 1})
+        self.assertEqual(sensor_slots.free_count(), 1)
+
+        nova.full_clean()
+        nova.save()
+        self.assertEqual(nova.sensor_id, 1)
+        self.assertIsNone(Digital.objects.get(pk=ana.pk).sensor_id)
+
+    def test_reactivation_cancels_queued_delete(self, send):
+        ana = Digital.objects.create(usuario=self.ana, dedo=Dedo.INDICADOR_DIR)
+        ana.ativo = False
+        ana.save()
+        ana.ativo = True
+        ana.save()
+        self.assertEqual(self.delete_queue(), [(1, StatusComando.FALHOU)])
+        sensor_jobs.advance_queue()
+        send.assert_not_called()
+
+    def test_empty_slot_in_dump_is_freed(self, send):
+        Digital.objects.create(usuario=self.ana, dedo=Dedo.INDICADOR_DIR).delete()
+        # O DELETE falhou, mas o SLOTS mostra o slot vazio: pode ser reutilizado
+        sensor_jobs.handle_status({'status': 'slots', 'bitmap': '00'})
+        self.assertEqual(sensor_slots.report()['ocupados'], 0)
+
+
+@mock.patch('biometria.views.send_bridge_command', return_value=(True, {'status': 'command_sent'}))
+class SensorReconcileTest(TestCase):
+    """O bitmap do SLOTS vira só os DELETE/ENROLL que faltam; DELETE_ALL desativa as digitais."""
+
+    def setUp(self):
+        usuario = Usuario.objects.create(nome="Ana", codigo="A1")
+        for sensor_id, dedo in ((1, Dedo.INDICADOR_DIR), (2, Dedo.MEDIO_DIR), (3, Dedo.ANELAR_DIR)):
+            Digital.objects.create(usuario=usuario, sensor_id=sensor_id, dedo=dedo)
+
+    def test_reconcile_queues_minimal_set(self, send):
+        lote = sensor_jobs.start_reconcile()
+        sensor_jobs.advance_queue()
+        # Sensor tem 2, 3 e 9: falta o 1, sobra o 9
+        bitmap = (1 << 2 | 1 << 3 | 1 << 9).to_bytes(32, 'little').hex().upper()
+        sensor_jobs.handle_status({'status': 'slots', 'count': 3, 'bitmap': bitmap})
+
+        comandos = [c.comando for c in sensor_jobs.lote_progress(lote)['comandos']]
+        self.assertEqual(comandos, ["SLOTS", "DELETE:9", "ENROLL:1"])
+        self.assertEqual(send.call_args_list[-1].args[0], "DELETE:9")
+        self.assertEqual(sensor_slots.diff_dump(sensor_slots.last_dump()[0])['cadastrar'], [1])
+
+    def test_wipe_deactivates_digitais(self, send):
+        sensor_jobs.enqueue(AcaoSensor.DELETE_ALL)
+        sensor_jobs.advance_queue()
+        sensor_jobs.handle_status({'status': 'delete_all_success'})
+        self.assertFalse(Digital.objects.filter(ativo=True).exists())
+        self.assertEqual(sensor_slots.report()['ocupados'], 0)
+
+
+@mock.patch('biometria.views.send_bridge_command', return_value=(True, {'status': 'command_sent'}))
+class MultiPortaoTest(TestCase):
+    """Cada portão tem o seu sensor: slots, matches, pendentes e fila de comandos são por portão."""
+
+    def setUp(self):
+        self.ana = Usuario.objects.create(nome="Ana", codigo="A1")
+        self.bia = Usuario.objects.create(nome="Bia", codigo="B1")
+        self.portaria = Digital.objects.create(usuario=self.ana, dedo=Dedo.INDICADOR_DIR, portao='portaria')
+        self.garagem = Digital.objects.create(usuario=self.bia, dedo=Dedo.INDICADOR_DIR, portao='garagem')
+
+    def test_slots_and_matches_are_scoped_per_gate(self, send):
+        self.assertEqual((self.portaria.sensor_id, self.garagem.sensor_id), (1, 1))
+        # O mesmo dedo pode ser cadastrado no sensor de outro portão
+        Digital.objects.create(usuario=self.ana, dedo=Dedo.INDICADOR_DIR, portao='garagem')
+        self.assertEqual(sensor_slots.report('garagem')['ocupados'], 2)
+        self.assertEqual(sensor_slots.report('portaria')['ocupados'], 1)
+
+        response = self.client.post('/api/log_access/', {'gate': 'garagem', 'sensor_id': 1, 'confidence': 90},
+                                    content_type='application/json')
+        self.assertEqual(response.json()['codigo'], "B1")
+        self.assertEqual(HistoricoAcesso.objects.get().portao, 'garagem')
+        self.assertFalse(self.client.get('/api/check_pending/?portao=portaria').json()['pending'])
+        self.assertEqual(self.client.get('/api/check_pending/?portao=garagem').json()['usuario_codigo'], "B1")
+
+    def test_each_gate_has_its_own_command_queue(self, send):
+        sensor_jobs.enqueue(AcaoSensor.ENROLL, digitais=Digital.objects.all())
+        sensor_jobs.advance_queue()
+        self.assertEqual(sorted(c.kwargs['portao'] for c in send.call_args_list), ['garagem', 'portaria'])
 
-# Create your tests here.
+        # Status da garagem não conclui o comando da portaria
+        sensor_jobs.handle_status({'status': 'enroll_success', 'id': 1, 'gate': 'garagem'})
+        status = dict(ComandoSensor.objects.values_list('portao', 'status'))
+        self.assertEqual(status, {'garagem': StatusComando.CONCLUIDO, 'portaria': StatusComando.ENVIADO})
@@ -4,12 +4,32 @@ from . import views
 urlpatterns = [
     # Endpoint que o BRIDGE chama quando o SENSOR lê uma digital
     path('log_access/', views.log_access, name='log_access'),
+    # Lote de acessos (reenvio do spool do bridge)
+    path('log_access_batch/', views.log_access_batch, name='log_access_batch'),
 
     path('check_pending/', views.check_pending_access, name='check_pending'),
+    # Push para o dashboard: SSE (ASGI) e long-poll (fallback)
+    path('pending_stream/', views.pending_stream, name='pending_stream'),
+    path('wait_pending/', views.wait_pending_access, name='wait_pending'),
     path('confirm_room/', views.confirm_access_room, name='confirm_room'),
 
+    # Ocupação atual das salas
+    path('ocupacao/', views.room_occupancy_view, name='room_occupancy'),
+    path('ocupacao/<int:sala_id>/', views.room_occupancy_view, name='room_occupancy_detail'),
+
+    # Exportação do histórico (CSV/NDJSON em streaming)
+    path('historico/export/', views.export_history, name='export_history'),
+
+    # Relatórios agregados (tabelas de rollup)
+    path('relatorios/acessos/', views.access_report, name='access_report'),
+
+    # Métricas por view (Prometheus)
+    path('metrics', views.metrics_view, name='metrics'),
+
     # Endpoint para o ADMIN mandar o bridge cadastrar
     path('sensor/enroll/', views.sensor_enroll_command, name='sensor_enroll'),
     # Endpoint para o ADMIN mandar o bridge deletar
     path('sensor/delete/', views.sensor_delete_command, name='sensor_delete'),
+    # Linhas de status do Arduino (enroll_*, delete_*) repassadas pelo bridge
+    path('sensor/status/', views.sensor_status, name='sensor_status'),
 ]
\ No newline at end of file
@@ -1,18 +1,35 @@
+import json
+import logging
 import requests
 import os
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
+from django.db import IntegrityError, transaction
 from django.utils import timezone  # O timezone do Django (tem .now())
-from datetime import timedelta
+from datetime import timedelta, datetime, timezone as dt_timezone
 
 from .models import (
-    Usuario, Digital, HistoricoAcesso, TipoAcesso, UsuarioSala, Sala
+    Usuario, Digital, HistoricoAcesso, AcessoPendente, TipoAcesso, TipoUsuario, UsuarioSala, Sala, AcaoSensor,
+    PORTAO_PADRAO,
 )
+from .events import pending_broadcaster
+from .metrics import bridge_command_duration, registry as metrics_registry
+from .export import EXPORT_FORMATS, export_queryset, iter_export
+from .occupancy import apply_access, room_occupancy
+from .rollups import report as rollup_report
+from .sensor_cache import sensor_cache
+from . import sensor_jobs
 from .forms import (
     UsuarioCadastroForm # Vamos manter este, mas simplificado
 )
@@ -21,70 +38,412 @@ from .forms import (
 # Helper: Função para falar com o Bridge
 # ===============================
 
-def send_bridge_command(command: str):
+logger = logging.getLogger(__name__)
+_bridge_session = None
+
+
+def get_bridge_session():
+    """
+    Session compartilhada (keep-alive) para as chamadas ao bridge.
+    Criada sob demanda; pool e retry configuráveis via .env.
+    """
+    global _bridge_session
+    if _bridge_session is None:
+        retries = int(os.getenv('BRIDGE_HTTP_RETRIES', 2))
+        # Só repete falhas de conexão: um comando que chegou ao bridge não é reenviado
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=0,
+            backoff_factor=float(os.getenv('BRIDGE_HTTP_BACKOFF', 0.2)),
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=int(os.getenv('BRIDGE_HTTP_POOL_SIZE', 4)),
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _bridge_session = session
+    return _bridge_session
+
+
+def send_bridge_command(command: str, command_id=None, wait=None, portao=None):
     """
-    Envia um comando (ex: "ENROLL:5") para a API do serial_bridge.py
+    Envia um comando (ex: "ENROLL:5") para a API do serial_bridge.py.
+    `portao` escolhe o Arduino (gate) no bridge; sem ele, o bridge usa o
+    único portão que tiver. `command_id` deixa o envio idempotente (o bridge
+    não repete um ID que já recebeu) e volta nas linhas de status; com
+    `wait` o bridge segura a resposta até o resultado (ou até `wait` s).
     """
     bridge_url = os.getenv('BRIDGE_API_URL')
     if not bridge_url:
-        print("ERRO: BRIDGE_API_URL não está definida no .env")
+        logger.error("BRIDGE_API_URL não está definida no .env")
         return False, "Bridge API URL não configurada"
-        
+
+    payload = {'command': command}
+    if portao:
+        payload['gate'] = portao
+    if command_id:
+        payload['command_id'] = command_id
+    if wait:
+        payload['wait'] = wait
+    start = time.perf_counter()
+    outcome = 'error'
     try:
-        response = requests.post(
+        response = get_bridge_session().post(
             bridge_url,
-            json={'command': command},
-            timeout=5 # Timeout de 5 segundos
+            json=payload,
+            timeout=5 + (wait or 0) # Timeout de 5 segundos (+ a espera pedida)
         )
         response.raise_for_status() # Lança erro se for 4xx/5xx
+        outcome = 'ok'
         return True, response.json()
     except requests.exceptions.RequestException as e:
-        print(f"ERRO ao conectar com o bridge: {e}")
+        logger.error("Erro ao conectar com o bridge: %s", e)
         return False, str(e)
+    finally:
+        elapsed = time.perf_counter() - start
+        # A ação sem o argumento (ENROLL:5 -> ENROLL) para não criar uma série por sensor_id
+        bridge_command_duration.observe(elapsed, command.partition(':')[0], outcome)
+        logger.debug("Bridge API: %s @ %s (%.1f ms)", command, portao or '-', elapsed * 1000)
+
+
+def get_bridge_command(command_id):
+    """
+    Consulta o estado de um comando no bridge (GET /command/<id>), sem
+    bloquear. Retorna o dict do bridge, {'state': 'unknown'} se o bridge não
+    conhece o ID (ex: reiniciou) ou None se o bridge não respondeu.
+    """
+    bridge_url = os.getenv('BRIDGE_API_URL')
+    if not bridge_url:
+        return None
+    try:
+        response = get_bridge_session().get(f"{bridge_url.rstrip('/')}/{command_id}", timeout=2)
+    except requests.exceptions.RequestException:
+        return None
+    if response.status_code == 404:
+        return {'state': 'unknown'}
+    if not response.ok:
+        return None
+    return response.json()
 
 # ===============================
 # API: Bridge -> Django (Log de Acesso)
 # ===============================
+
+MAX_BATCH_EVENTS = 500
+# Tempo que um match fica esperando o porteiro escolher a sala
+PENDING_WINDOW = timedelta(seconds=30)
+# Intervalo mínimo entre limpezas dos pendentes expirados
+PENDING_PURGE_INTERVAL = 60
+_last_pending_purge = 0.0
+
+
+def build_pending_record(access):
+    """AcessoPendente (sem salvar) para um match recém-registrado."""
+    return AcessoPendente(
+        historico=access,
+        usuario_id=access.usuario_id,
+        portao=access.portao,
+        criado_em=access.data_hora,
+        expira_em=access.data_hora + PENDING_WINDOW,
+    )
+
+
+def purge_expired_pending():
+    """Remove pendentes expirados, no máximo uma vez a cada PENDING_PURGE_INTERVAL."""
+    global _last_pending_purge
+    now = time.monotonic()
+    if now - _last_pending_purge < PENDING_PURGE_INTERVAL:
+        return
+    _last_pending_purge = now
+    AcessoPendente.objects.filter(expira_em__lte=timezone.now()).delete()
+
+
+def parse_client_timestamp(value):
+    """Converte o `received_at` (epoch em segundos) do bridge em datetime; None se inválido."""
+    try:
+        return datetime.fromtimestamp(float(value), tz=dt_timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+
+EVENT_ID_MAX_LENGTH = HistoricoAcesso._meta.get_field('chave_idempotencia').max_length
+
+
+def parse_event_id(value):
+    """
+    `event_id` do bridge como texto, ou None se não veio. Levanta ValueError
+    se não couber na chave_idempotencia (no PostgreSQL viraria DataError).
+    """
+    if value is None or value == '':
+        return None
+    if not isinstance(value, (str, int)) or isinstance(value, bool):
+        raise ValueError('event_id deve ser texto')
+    value = str(value)
+    if len(value) > EVENT_ID_MAX_LENGTH:
+        raise ValueError(f'event_id com mais de {EVENT_ID_MAX_LENGTH} caracteres')
+    return value
+
+
+def request_portao(data):
+    """Portão (gate) informado pelo bridge; o padrão se ele não mandar."""
+    return str(data.get('gate') or PORTAO_PADRAO)[:30]
+
+
+def build_access_record(sensor_id, confidence, received_at, entry, event_id=None, data_hora=None,
+                        portao=PORTAO_PADRAO):
+    """
+    Monta (sem salvar) o HistoricoAcesso de uma leitura do sensor do portão.
+    `entry` é o SensorEntry do sensor_cache; com None, registra a falha de autenticação.
+    """
+    metadata = {'sensor_id': sensor_id, 'confidence': confidence, 'received_at': received_at}
+    extra = {'data_hora': data_hora} if data_hora else {}
+
+    if not entry:
+        # Digital não encontrada ou inativa
+        return HistoricoAcesso(
+            tipo_acesso=TipoAcesso.ENTRADA, # Fallback
+            motivo=f"Falha de autenticacao: sensor_id {sensor_id} desconhecido ({portao}).",
+            portao=portao,
+            metadata=metadata,
+            chave_idempotencia=event_id,
+            **extra
+        )
+
+    # Cria registro pendente (tipo será definido na confirmação)
+    metadata['status'] = 'pending_room'
+    return HistoricoAcesso(
+        usuario_id=entry.usuario_id,
+        tipo_acesso=TipoAcesso.ENTRADA,  # Valor temporário
+        motivo=f"Acesso biométrico validado - Aguardando confirmação de sala",
+        portao=portao,
+        metadata=metadata,
+        chave_idempotencia=event_id,
+        **extra
+    )
+
+
 @api_view(['POST'])
 def log_access(request):
     """
     Recebe um SENSOR_ID do bridge, valida e registra o acesso.
-    JSON esperado: { "sensor_id": 5, "confidence": 95 }
+    JSON esperado: { "gate": "portaria", "sensor_id": 5, "confidence": 95,
+                     "received_at": 1700000000.123, "event_id": "..." }
+    `gate` (opcional) é o portão cujo sensor leu a digital: o sensor_id só vale nele.
+    `received_at` (opcional) é o instante em que o bridge leu a linha da serial.
+    `event_id` (opcional) evita registrar duas vezes o mesmo evento.
     """
     sensor_id = request.data.get('sensor_id')
     confidence = request.data.get('confidence')
+    received_at = request.data.get('received_at')
+    portao = request_portao(request.data)
     
     if not sensor_id:
         return Response({'error': 'sensor_id obrigatório'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        event_id = parse_event_id(request.data.get('event_id'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    digital = Digital.objects.filter(sensor_id=sensor_id, ativo=True).select_related('usuario').first()
+    # Sem consulta: o mapeamento (portão, sensor_id) -> usuário fica em memória
+    entry = sensor_cache.get(sensor_id, portao)
 
-    if not digital:
-        # Digital não encontrada ou inativa
-        HistoricoAcesso.objects.create(
-            tipo_acesso=TipoAcesso.ENTRADA, # Fallback
-            motivo=f"Falha de autenticacao: sensor_id {sensor_id} desconhecido.",
-            metadata={'sensor_id': sensor_id, 'confidence': confidence}
-        )
+    access = build_access_record(sensor_id, confidence, received_at, entry, event_id=event_id, portao=portao)
+    try:
+        with transaction.atomic():
+            access.save()
+            if entry:
+                build_pending_record(access).save(force_insert=True)
+    except IntegrityError:
+        # event_id já registrado: o bridge está reenviando um evento já processado
+        if not event_id:
+            raise
+        duplicate = True
+    else:
+        duplicate = False
+        if entry:
+            # Avisa os dashboards conectados (SSE / long-poll) assim que o registro existir
+            event = pending_event(access, entry)
+            transaction.on_commit(lambda: pending_broadcaster.publish(event))
+        purge_expired_pending()
+
+    if not entry:
         return Response({'error': 'Digital não cadastrada'}, status=status.HTTP_404_NOT_FOUND)
 
     # --- Match Encontrado ---
-    usuario = digital.usuario
-    
-    # Cria registro pendente (tipo será definido na confirmação)
-    access = HistoricoAcesso.objects.create(
-            usuario=usuario,
-            tipo_acesso=TipoAcesso.ENTRADA,  # Valor temporário
-            motivo=f"Acesso biométrico validado - Aguardando confirmação de sala",
-            metadata={'sensor_id': sensor_id, 'confidence': confidence, 'status': 'pending_room'}
-        )
-    
     return Response({
         'match': True,
-        'usuario': usuario.nome,
-        'codigo': usuario.codigo
+        'usuario': entry.nome,
+        'codigo': entry.codigo,
+        'duplicate': duplicate,
     }, status=status.HTTP_200_OK)
-    
+
+
+@api_view(['POST'])
+def log_access_batch(request):
+    """
+    Registra vários acessos de uma vez (reenvio do spool do bridge, rajadas).
+    JSON esperado: { "events": [ { "gate": "portaria", "sensor_id": 5, "confidence": 95,
+                                   "received_at": 1700000000.123, "event_id": "..." }, ... ] }
+    `received_at` vira o data_hora do registro. Resolve os sensor_id pelo
+    sensor_cache e grava tudo com um bulk_create numa transação.
+    Retorna um resultado por evento, na mesma ordem; um evento inválido
+    (sem sensor_id, event_id grande demais) vira `invalid` sem derrubar o lote.
+    """
+    events = request.data.get('events') if isinstance(request.data, dict) else request.data
+    if not isinstance(events, list) or not events:
+        return Response({'error': 'events deve ser uma lista não vazia'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(events) > MAX_BATCH_EVENTS:
+        return Response({'error': f'Máximo de {MAX_BATCH_EVENTS} eventos por lote'}, status=status.HTTP_400_BAD_REQUEST)
+
+    event_ids = set()
+    for event in events:
+        try:
+            event_id = parse_event_id(event.get('event_id')) if isinstance(event, dict) else None
+        except ValueError:
+            continue
+        if event_id:
+            event_ids.add(event_id)
+    existing = dict(
+        HistoricoAcesso.objects.filter(chave_idempotencia__in=event_ids).values_list('chave_idempotencia', 'id')
+    ) if event_ids else {}
+
+    results = []
+    to_create = []  # (resultado, registro, entrada do sensor_cache)
+    seen = set()
+    for event in events:
+        if not isinstance(event, dict):
+            results.append({'status': 'invalid', 'error': 'evento deve ser um objeto'})
+            continue
+        try:
+            event_id = parse_event_id(event.get('event_id'))
+        except ValueError as e:
+            # Só este evento é recusado: o resto do lote segue
+            results.append({'status': 'invalid', 'error': str(e)})
+            continue
+        result = {'event_id': event_id}
+        results.append(result)
+
+        try:
+            sensor_id = int(event.get('sensor_id'))
+        except (TypeError, ValueError):
+            result.update(status='invalid', error='sensor_id obrigatório')
+            continue
+
+        if event_id and (event_id in existing or event_id in seen):
+            result.update(status='duplicate', access_id=existing.get(event_id))
+            continue
+        if event_id:
+            seen.add(event_id)
+
+        portao = request_portao(event)
+        entry = sensor_cache.get(sensor_id, portao)
+        received_at = event.get('received_at')
+        record = build_access_record(
+            sensor_id, event.get('confidence'), received_at, entry,
+            event_id=event_id, data_hora=parse_client_timestamp(received_at), portao=portao,
+        )
+        if entry:
+            result.update(status='created', usuario=entry.nome, codigo=entry.codigo)
+        else:
+            result.update(status='unknown_sensor')
+        to_create.append((result, record, entry))
+
+    now = timezone.now()
+    with transaction.atomic():
+        HistoricoAcesso.objects.bulk_create([record for _, record, _ in to_create])
+        # Só eventos ainda dentro da janela viram pendentes (reenvios antigos não)
+        pending = [
+            (record, entry) for _, record, entry in to_create
+            if entry and record.data_hora + PENDING_WINDOW > now
+        ]
+        AcessoPendente.objects.bulk_create([build_pending_record(record) for record, _ in pending])
+        # Avisa os dashboards como no log_access, do mais antigo ao mais recente
+        pending.sort(key=lambda item: item[0].data_hora)
+        for record, entry in pending:
+            transaction.on_commit(lambda event=pending_event(record, entry): pending_broadcaster.publish(event))
+    for result, record, _ in to_create:
+        result['access_id'] = record.pk
+
+    return Response({'results': results}, status=status.HTTP_200_OK)
+
+# ===============================
+# Dashboard: acesso pendente (polling, long-poll e SSE)
+# ===============================
+
+LONG_POLL_TIMEOUT = 25
+SSE_KEEPALIVE = 15
+
+
+def pending_event(access, entry):
+    """Dados do acesso pendente publicados no pending_broadcaster (sem consulta ao banco)."""
+    return {
+        'access_id': access.id,
+        'portao': access.portao,
+        'usuario_id': entry.usuario_id,
+        'usuario_nome': entry.nome,
+        'usuario_codigo': entry.codigo,
+        'usuario_tipo': TipoUsuario(entry.tipo_usuario).label,
+        'data_hora': access.data_hora.strftime('%d/%m/%Y %H:%M:%S'),
+    }
+
+
+def find_pending_event(portao=None):
+    """
+    Busca o acesso pendente mais recente ainda não expirado (do portão, se informado).
+    Consulta só a tabela AcessoPendente, que não cresce com o histórico.
+    """
+    pendentes = AcessoPendente.objects.filter(expira_em__gt=timezone.now())
+    if portao:
+        pendentes = pendentes.filter(portao=portao)
+    pending = pendentes.select_related('usuario').order_by('-criado_em').first()
+    if not pending:
+        return None
+    usuario = pending.usuario
+    return {
+        'access_id': pending.historico_id,
+        'portao': pending.portao,
+        'usuario_id': usuario.id,
+        'usuario_nome': usuario.nome,
+        'usuario_codigo': usuario.codigo,
+        'usuario_tipo': usuario.get_tipo_usuario_display(),
+        'data_hora': pending.criado_em.strftime('%d/%m/%Y %H:%M:%S'),
+    }
+
+
+def pending_response_data(event, tipo_acesso):
+    """Monta a resposta que o dashboard espera a partir de um evento pendente."""
+    # Busca as salas que este usuário tem permissão
+    salas_permitidas = UsuarioSala.objects.filter(usuario_id=event['usuario_id']).values_list('sala_id', 'sala__nome')
+    data = {key: value for key, value in event.items() if key != 'usuario_id'}
+    data.update(
+        pending=True,
+        salas_permitidas=[{'id': sala_id, 'nome': nome} for sala_id, nome in salas_permitidas],
+        tipo_acesso=tipo_acesso,
+    )
+    return data
+
+
+def session_tipo_acesso(request):
+    """Contexto de acesso (entrada/saída) da sessão do porteiro."""
+    return request.session.get('tipo_acesso', TipoAcesso.ENTRADA)
+
+
+def session_portao(request):
+    """Portão do dashboard: `?portao=` na chamada ou o da sessão; vazio = todos."""
+    return request.GET.get('portao') or request.session.get('portao') or None
+
+
+def event_matches_portao(event, portao):
+    return event is not None and (not portao or event.get('portao') == portao)
+
+
 # O Dashboard pergunta "Tem alguém esperando?"
 @api_view(['GET'])
 def check_pending_access(request):
@@ -92,37 +451,88 @@ def check_pending_access(request):
     Busca o acesso mais recente (nos últimos 30 segundos) que ainda não tem sala definida.
     Retorna também o contexto atual de Entrada/Saída da sessão.
     """
-    time_threshold = timezone.now() - timedelta(seconds=30)
-    
-    # Pega o último acesso válido, sem sala, criado recentemente
-    pending = HistoricoAcesso.objects.filter(
-        data_hora__gte=time_threshold,
-        sala__isnull=True,
-        usuario__isnull=False
-    ).order_by('-data_hora').first()
-
-    if not pending:
+    event = find_pending_event(session_portao(request))
+    if not event:
         return Response({'pending': False})
+    return Response(pending_response_data(event, session_tipo_acesso(request)))
 
-    # Busca as salas que este usuário tem permissão
-    usuario = pending.usuario
-    salas_permitidas = UsuarioSala.objects.filter(usuario=usuario).select_related('sala')
-    
-    salas_data = [{'id': us.sala.id, 'nome': us.sala.nome} for us in salas_permitidas]
-    
-    # Captura o contexto de acesso da sessão do porteiro
-    tipo_acesso = request.session.get('tipo_acesso', TipoAcesso.ENTRADA)
 
-    return Response({
-        'pending': True,
-        'access_id': pending.id,
-        'usuario_nome': usuario.nome,
-        'usuario_codigo': usuario.codigo,
-        'usuario_tipo': usuario.get_tipo_usuario_display(),
-        'data_hora': pending.data_hora.strftime('%d/%m/%Y %H:%M:%S'),
-        'salas_permitidas': salas_data,
-        'tipo_acesso': tipo_acesso
-    })
+async def wait_pending_access(request):
+    """
+    Long-poll: `?since=<version>` segura a requisição até um novo match ser
+    publicado (ou ~25 s). Sem `since`, responde na hora com o estado atual.
+    Sempre devolve `version`, que o cliente manda de volta na próxima chamada.
+    Matches de outros portões (com portão na sessão) não acordam o cliente.
+
+    Como o SSE, só funciona via ASGI: no WSGI cada espera prenderia uma thread
+    do servidor, então responde 501 e o dashboard fica no check_pending.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Long-poll requer servidor ASGI; use /api/check_pending/'}, status=501)
+
+    tipo_acesso = await sync_to_async(session_tipo_acesso)(request)
+    portao = await sync_to_async(session_portao)(request)
+    since = request.GET.get('since')
+    if since is None or not since.lstrip('-').isdigit():
+        version = pending_broadcaster.version
+        event = await sync_to_async(find_pending_event)(portao)
+    else:
+        version, event = int(since), None
+        deadline = time.monotonic() + LONG_POLL_TIMEOUT
+        while not event_matches_portao(event, portao):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                event = None
+                break
+            new_version, event = await pending_broadcaster.wait(version, remaining)
+            if new_version == version:
+                event = None
+                break
+            version = new_version
+
+    if not event:
+        return JsonResponse({'pending': False, 'version': version})
+    data = await sync_to_async(pending_response_data)(event, tipo_acesso)
+    data['version'] = version
+    return JsonResponse(data)
+
+
+def _sse(event_name, data, event_id):
+    return f"id: {event_id}\nevent: {event_name}\ndata: {json.dumps(data)}\n\n"
+
+
+async def pending_stream(request):
+    """
+    Server-Sent Events com os acessos pendentes. Só funciona servido via ASGI
+    (biometria_server.asgi); no WSGI responde 501 e o dashboard cai no long-poll.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'SSE requer servidor ASGI; use /api/wait_pending/'}, status=501)
+
+    tipo_acesso = await sync_to_async(session_tipo_acesso)(request)
+    portao = await sync_to_async(session_portao)(request)
+
+    async def stream():
+        version = pending_broadcaster.version
+        event = await sync_to_async(find_pending_event)(portao)
+        if event:
+            data = await sync_to_async(pending_response_data)(event, tipo_acesso)
+            yield _sse('pending', data, version)
+        while True:
+            new_version, event = await pending_broadcaster.wait(version, SSE_KEEPALIVE)
+            if new_version == version:
+                yield ": keepalive\n\n"
+                continue
+            version = new_version
+            if not event_matches_portao(event, portao):
+                continue
+            data = await sync_to_async(pending_response_data)(event, tipo_acesso)
+            yield _sse('pending', data, version)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 # O Porteiro confirma a sala
@@ -145,22 +555,32 @@ def confirm_access_room(request):
     try:
         acesso = HistoricoAcesso.objects.get(id=access_id)
         sala = Sala.objects.get(id=sala_id)
-        
+    except (HistoricoAcesso.DoesNotExist, Sala.DoesNotExist, ValueError):
+        return Response({'error': 'Registro não encontrado'}, status=404)
+
+    with transaction.atomic():
+        # Só confirma o que ainda está pendente: uma segunda confirmação (ou
+        # uma depois do prazo) mexeria de novo na ocupação da sala. O DELETE
+        # condicional é a trava: de duas confirmações simultâneas, só uma apaga
+        apagados, _ = AcessoPendente.objects.filter(historico_id=acesso.id, expira_em__gt=timezone.now()).delete()
+        if not apagados:
+            return Response({'error': 'Acesso não está mais pendente (já confirmado ou expirado)'},
+                            status=status.HTTP_409_CONFLICT)
+
         # Atualiza o registro com TODOS os dados corretos
         acesso.sala = sala
         acesso.tipo_acesso = tipo_acesso  # Define o tipo correto agora
         acesso.motivo = f"Acesso confirmado: {tipo_acesso.upper()} em {sala.nome}"
-        
+
         # Atualiza metadata removendo flag de pendente
         meta = acesso.metadata or {}
         meta['status'] = 'confirmed'
         acesso.metadata = meta
-        
+
         acesso.save()
-        
-        return Response({'status': 'ok'})
-    except (HistoricoAcesso.DoesNotExist, Sala.DoesNotExist):
-        return Response({'error': 'Registro não encontrado'}, status=404)
+        apply_access(acesso)
+
+    return Response({'status': 'ok'})
 
 
 # ===============================
@@ -172,36 +592,146 @@ def confirm_access_room(request):
 def sensor_enroll_command(request):
     """
     API interna para o Admin enviar um comando de CADASTRO.
-    JSON esperado: { "sensor_id": 5 }
+    JSON esperado: { "sensor_id": 5, "portao": "portaria" }  (portao opcional)
+    O comando entra na fila do sensor do portão (ver sensor_jobs.py).
     """
-    sensor_id = request.data.get('sensor_id')
-    if not sensor_id:
+    if not request.data.get('sensor_id'):
         return Response({'error': 'sensor_id obrigatório'}, status=status.HTTP_400_BAD_REQUEST)
-        
-    ok, response_data = send_bridge_command(f"ENROLL:{sensor_id}")
-    
-    if ok:
-        return Response({'status': 'Comando ENROLL enviado', 'bridge_response': response_data})
-    else:
-        return Response({'error': f'Falha ao enviar comando: {response_data}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    sensor_id = sensor_jobs.parse_sensor_id(request.data.get('sensor_id'))
+    if sensor_id is None:
+        return Response({'error': 'sensor_id deve ser um inteiro de 1 a 200'}, status=status.HTTP_400_BAD_REQUEST)
+
+    portao = request.data.get('portao') or PORTAO_PADRAO
+    lote = sensor_jobs.enqueue(AcaoSensor.ENROLL, sensor_ids=[sensor_id], portao=portao)
+    transaction.on_commit(sensor_jobs.advance_in_background)
+    return Response({'status': 'Comando ENROLL na fila', 'lote': str(lote)}, status=status.HTTP_202_ACCEPTED)
 
 @staff_member_required
 @api_view(['POST'])
 def sensor_delete_command(request):
     """
     API interna para o Admin enviar um comando de DELETE.
-    JSON esperado: { "sensor_id": 5 }
+    JSON esperado: { "sensor_id": 5, "portao": "portaria" }  (portao opcional)
     """
-    sensor_id = request.data.get('sensor_id')
-    if not sensor_id:
+    if not request.data.get('sensor_id'):
         return Response({'error': 'sensor_id obrigatório'}, status=status.HTTP_400_BAD_REQUEST)
+    sensor_id = sensor_jobs.parse_sensor_id(request.data.get('sensor_id'))
+    if sensor_id is None:
+        return Response({'error': 'sensor_id deve ser um inteiro de 1 a 200'}, status=status.HTTP_400_BAD_REQUEST)
 
-    ok, response_data = send_bridge_command(f"DELETE:{sensor_id}")
-    
-    if ok:
-        return Response({'status': 'Comando DELETE enviado', 'bridge_response': response_data})
-    else:
-        return Response({'error': f'Falha ao enviar comando: {response_data}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    portao = request.data.get('portao') or PORTAO_PADRAO
+    lote = sensor_jobs.enqueue(AcaoSensor.DELETE, sensor_ids=[sensor_id], portao=portao)
+    transaction.on_commit(sensor_jobs.advance_in_background)
+    return Response({'status': 'Comando DELETE na fila', 'lote': str(lote)}, status=status.HTTP_202_ACCEPTED)
+
+
+# O BRIDGE repassa as linhas de status do Arduino (enroll_*, delete_*)
+@api_view(['POST'])
+def sensor_status(request):
+    """
+    JSON esperado: a linha do Arduino, ex: { "status": "enroll_success", "id": 5, "gate": "portaria" }
+    Atualiza o comando em andamento no portão e libera o próximo da fila dele.
+    """
+    if not request.data.get('status'):
+        return Response({'error': 'status obrigatório'}, status=status.HTTP_400_BAD_REQUEST)
+    comando = sensor_jobs.handle_status(request.data)
+    if comando is None:
+        return Response({'matched': False})
+    return Response({'matched': True, 'comando_id': comando.id, 'status': comando.status})
+
+
+# ===============================
+# API: Ocupação das salas
+# ===============================
+
+@api_view(['GET'])
+def room_occupancy_view(request, sala_id=None):
+    """
+    Quem está dentro de cada sala agora (mantido a cada entrada/saída).
+    GET /api/ocupacao/ (todas as salas ocupadas) ou /api/ocupacao/<sala_id>/
+    """
+    rooms = room_occupancy(sala_id)
+    if sala_id is not None:
+        if rooms:
+            return Response(rooms[0])
+        nome = Sala.objects.filter(id=sala_id).values_list('nome', flat=True).first()
+        if nome is None:
+            return Response({'error': 'Sala não encontrada'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'sala_id': sala_id, 'sala_nome': nome, 'total': 0, 'usuarios': []})
+    return Response({'salas': rooms, 'total': sum(room['total'] for room in rooms)})
+
+
+# ===============================
+# API: Exportação do histórico
+# ===============================
+
+@staff_member_required
+def export_history(request):
+    """
+    Exporta o histórico em streaming (memória constante).
+    GET /api/historico/export/?formato=csv|ndjson&inicio=2025-01-01&fim=2025-06-30&sala=1&usuario=2
+    """
+    formato = request.GET.get('formato', 'csv')
+    if formato not in EXPORT_FORMATS:
+        return JsonResponse({'error': f'formato deve ser um de {EXPORT_FORMATS}'}, status=400)
+    try:
+        queryset = export_queryset(
+            inicio=request.GET.get('inicio'),
+            fim=request.GET.get('fim'),
+            sala=request.GET.get('sala'),
+            usuario=request.GET.get('usuario'),
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    content_type = 'text/csv; charset=utf-8' if formato == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(iter_export(queryset, formato), content_type=content_type)
+    filename = f"historico_{timezone.localdate():%Y%m%d}.{formato}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+# ===============================
+# API: Relatórios (rollups)
+# ===============================
+
+@staff_member_required
+@api_view(['GET'])
+def access_report(request):
+    """
+    Totais de acessos por hora/dia, lidos só das tabelas de rollup
+    (atualizadas pelo comando `refresh_rollups`).
+    GET /api/relatorios/acessos/?granularidade=dia&inicio=2025-01-01&fim=2025-01-31&sala=1&tipo_acesso=entrada&tipo_usuario=aluno
+    """
+    try:
+        rows = rollup_report(
+            granularidade=request.GET.get('granularidade', 'dia'),
+            inicio=request.GET.get('inicio'),
+            fim=request.GET.get('fim'),
+            sala=request.GET.get('sala'),
+            tipo_acesso=request.GET.get('tipo_acesso'),
+            tipo_usuario=request.GET.get('tipo_usuario'),
+        )
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'resultados': rows, 'total': sum(row['total'] for row in rows)})
+
+
+# ===============================
+# API: Métricas (Prometheus)
+# ===============================
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+
+def metrics_view(request):
+    """
+    Histogramas de latência, consultas e tamanho por view, no formato texto do
+    Prometheus. Se METRICS_TOKEN estiver definido, exige `Authorization: Bearer <token>`.
+    """
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return HttpResponse('Não autorizado\n', status=401, content_type='text/plain; charset=utf-8')
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 # ===============================
@@ -212,10 +742,17 @@ def dashboard(request):
     ctx = request.session.get('tipo_acesso') or TipoAcesso.ENTRADA
     if ctx not in (TipoAcesso.ENTRADA, TipoAcesso.SAIDA):
         ctx = TipoAcesso.ENTRADA
-    recentes = HistoricoAcesso.objects.select_related('usuario', 'sala').order_by('-data_hora')[:10]
+    # /?portao=garagem prende este dashboard a um portão (vazio volta a mostrar todos)
+    if 'portao' in request.GET:
+        request.session['portao'] = request.GET['portao'][:30]
+    portao = request.session.get('portao') or None
+    recentes = HistoricoAcesso.objects.select_related('usuario', 'sala').order_by('-data_hora')
+    if portao:
+        recentes = recentes.filter(portao=portao)
     return render(request, 'dashboard.html', {
         'current_context': ctx,
-        'recent_history': recentes,
+        'current_portao': portao,
+        'recent_history': recentes[:10],
     })
 
 def set_access_context(request):
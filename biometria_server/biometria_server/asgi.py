@@ -3,14 +3,37 @@ ASGI config for biometria_server project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+É assim que o compose sobe o Django (uvicorn), para que o SSE e o long-poll
+dos acessos pendentes (ver biometria/events.py) funcionem; no
+`manage.py runserver` (WSGI) eles respondem 501 e o dashboard volta a
+consultar o banco a cada 2 s. Rodando da raiz do projeto:
+
+    uvicorn --app-dir biometria_server biometria_server.asgi:application --host 0.0.0.0 --port 8000
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
 import os
+import sys
+from pathlib import Path
+
+# Mesmo ajuste do manage.py: o pacote do projeto e a pasta apps/ no sys.path,
+# qualquer que seja o diretório de onde o servidor ASGI foi iniciado
+project_root = Path(__file__).resolve().parent.parent.parent
+for path in (project_root / 'biometria_server', project_root / 'apps'):
+    if path.exists() and str(path) not in sys.path:
+        sys.path.insert(0, str(path))
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'biometria_server.settings')
 
 application = get_asgi_application()
+
+if settings.DEBUG:
+    # Como o runserver: em DEBUG os arquivos estáticos (admin) saem pelo próprio Django
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+
+    application = ASGIStaticFilesHandler(application)
@@ -0,0 +1,163 @@
+"""
+Log estruturado (JSON, uma linha por registro) sem I/O no event loop do bridge.
+
+A leitura da serial, os workers e o servidor HTTP só colocam o registro numa
+fila limitada (`put_nowait`); uma thread de fundo (QueueListener) formata e
+escreve no stdout. Se a fila encher (stdout/journald travado), o registro é
+descartado e contado em vez de bloquear quem chamou.
+
+Linhas repetitivas do Arduino ([STATUS], [DEBUG]) são amostradas: passe
+`extra={'sample': 'status'}` e só 1 a cada `LOG_SAMPLE_EVERY` registros com
+a mesma chave é escrito.
+
+    LOG_LEVEL=INFO  LOG_FORMAT=json|text  LOG_QUEUE_SIZE=10000  LOG_SAMPLE_EVERY=20
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+# Atributos padrão do LogRecord; o resto veio do `extra=` e vai como campo no JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sample'}
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        data = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato legível para rodar no terminal: mensagem + campos extras."""
+
+    def format(self, record):
+        extras = ' '.join(
+            f"{key}={value}" for key, value in vars(record).items()
+            if key not in _RECORD_ATTRS and not key.startswith('_')
+        )
+        stamp = time.strftime('%H:%M:%S', time.localtime(record.created))
+        line = f"{stamp} {record.levelname:<7} [{record.threadName}] {record.getMessage()}"
+        if extras:
+            line += f"  {extras}"
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        elif record.exc_text:
+            line += '\n' + record.exc_text
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """Deixa passar 1 a cada `every` registros com a mesma chave `sample`."""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(1, every)
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'sample', None)
+        if key is None or self.every == 1:
+            return True
+        with self._lock:
+            count = self._seen.get(key, 0)
+            self._seen[key] = count + 1
+        if count % self.every:
+            return False
+        record.sampled_1_in = self.every
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que descarta (e conta) em vez de bloquear ou levantar erro com a fila cheia."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Só congela a mensagem; a formatação (json.dumps) fica para a thread de escrita
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener = None
+_queue_handler = None
+
+
+def setup_logging(level='INFO', fmt='json', queue_size=10000, sample_every=20, stream=None):
+    """
+    Liga o logger raiz à fila + thread de escrita. Pode ser chamada de novo
+    (ex: simulador) para trocar nível/formato.
+    """
+    global _listener, _queue_handler
+    shutdown_logging()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    _queue_handler.addFilter(SamplingFilter(sample_every))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    return _queue_handler
+
+
+def shutdown_logging():
+    """Esvazia a fila e para a thread de escrita."""
+    global _listener
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except queue.Full:
+            # Sem espaço nem para o sentinela: a thread de escrita é daemon e morre com o processo
+            pass
+        _listener = None
+
+
+def logging_stats():
+    if _queue_handler is None:
+        return None
+    return {
+        'queue_length': _queue_handler.queue.qsize(),
+        'queue_maxsize': _queue_handler.queue.maxsize,
+        'dropped': _queue_handler.dropped,
+    }
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,166 @@
+"""
+Correlação dos comandos enviados ao Arduino com as linhas de status.
+
+O firmware executa um comando por vez e responde na ordem (enroll_*,
+delete_*, delete_all_*, slots), mas sem repetir o ID do comando. Por isso
+cada comando escrito na serial é registrado aqui, em ordem, com um
+`command_id` (o do Django ou um gerado), e cada status é casado com o
+comando em andamento mais antigo da mesma ação (e do mesmo sensor_id, se a
+linha trouxer um).
+
+Estados: sent -> running (primeira linha de status) -> success | failed |
+timeout. Um mesmo `command_id` registrado de novo (retry do Django) não é
+reenviado ao Arduino: devolve o comando que já existe.
+
+Tudo roda no event loop do bridge (leitura da serial e servidor HTTP), então
+não há locks: `wait()` é uma corrotina que dorme num asyncio.Event.
+"""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+
+# status do Arduino -> (ação, estado final ou None se for só uma etapa)
+STATUS_LINES = {
+    'enroll_starting': ('ENROLL', None),
+    'enroll_prompt_1': ('ENROLL', None),
+    'enroll_prompt_2': ('ENROLL', None),
+    'error': ('ENROLL', None),
+    'enroll_success': ('ENROLL', 'success'),
+    'enroll_failed': ('ENROLL', 'failed'),
+    'delete_success': ('DELETE', 'success'),
+    'delete_failed': ('DELETE', 'failed'),
+    'delete_all_success': ('DELETE_ALL', 'success'),
+    'delete_all_failed': ('DELETE_ALL', 'failed'),
+    'slots': ('SLOTS', 'success'),
+    'slots_failed': ('SLOTS', 'failed'),
+}
+FINAL_STATES = ('success', 'failed', 'timeout')
+
+
+class TrackedCommand:
+
+    def __init__(self, command_id, command):
+        self.command_id = command_id
+        self.command = command
+        action, _, arg = command.partition(':')
+        self.action = action
+        self.sensor_id = int(arg) if arg.isdigit() else None
+        self.state = 'sent'
+        self.etapa = None
+        self.msg = None
+        self.result = None
+        self.sent_at = time.time()
+        self.finished_at = None
+        self.done = asyncio.Event()
+
+    @property
+    def finished(self):
+        return self.state in FINAL_STATES
+
+    def to_dict(self):
+        return {
+            'command_id': self.command_id,
+            'command': self.command,
+            'state': self.state,
+            'etapa': self.etapa,
+            'msg': self.msg,
+            'result': self.result,
+            'sent_at': self.sent_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class CommandTracker:
+
+    def __init__(self, timeout=90.0, keep=256):
+        self.timeout = timeout
+        self.keep = keep
+        self._commands = OrderedDict()  # command_id -> TrackedCommand, na ordem de envio
+        self.unmatched = 0
+
+    def register(self, command, command_id=None):
+        """Registra um comando antes de escrevê-lo. Retorna (comando, criado)."""
+        command_id = str(command_id or uuid.uuid4().hex)
+        existing = self._commands.get(command_id)
+        if existing is not None:
+            return existing, False
+        tracked = self._commands[command_id] = TrackedCommand(command_id, command)
+        self._trim()
+        return tracked, True
+
+    def get(self, command_id):
+        self._expire()
+        return self._commands.get(command_id)
+
+    def _trim(self):
+        # Esquece os finalizados mais antigos; os em andamento nunca saem
+        excess = len(self._commands) - self.keep
+        for command_id in [c.command_id for c in self._commands.values() if c.finished][:max(excess, 0)]:
+            del self._commands[command_id]
+
+    def _expire(self):
+        limit = time.time() - self.timeout
+        for tracked in self._commands.values():
+            if not tracked.finished and tracked.sent_at < limit:
+                self._finish(tracked, 'timeout', "Sem resposta do Arduino")
+
+    def _finish(self, tracked, state, msg=None):
+        tracked.state = state
+        if msg:
+            tracked.msg = msg
+        tracked.finished_at = time.time()
+        tracked.done.set()
+
+    def fail(self, tracked, msg):
+        self._finish(tracked, 'failed', msg)
+
+    def fail_all(self, msg):
+        """Falha tudo o que está em andamento (ex: o Arduino reiniciou)."""
+        for tracked in self._commands.values():
+            if not tracked.finished:
+                self._finish(tracked, 'failed', msg)
+
+    def match(self, msg):
+        """
+        Aplica uma linha de status ao comando em andamento mais antigo da
+        mesma ação. Retorna o comando, ou None se a linha não for de nenhum.
+        """
+        status = msg.get('status')
+        if status not in STATUS_LINES:
+            return None
+        action, final = STATUS_LINES[status]
+        self._expire()
+        for tracked in self._commands.values():
+            if tracked.finished or tracked.action != action:
+                continue
+            sensor_id = msg.get('id')
+            if sensor_id is not None and tracked.sensor_id is not None and int(sensor_id) != tracked.sensor_id:
+                continue
+            tracked.etapa = status
+            tracked.result = dict(msg)
+            if msg.get('msg'):
+                tracked.msg = msg['msg']
+            if final:
+                self._finish(tracked, final)
+            else:
+                tracked.state = 'running'
+            return tracked
+        self.unmatched += 1
+        return None
+
+    async def wait(self, tracked, timeout):
+        """Espera o resultado por até `timeout` s. Retorna True se o comando terminou."""
+        try:
+            await asyncio.wait_for(tracked.done.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            self._expire()
+        return tracked.finished
+
+    def stats(self):
+        self._expire()
+        states = {}
+        for tracked in self._commands.values():
+            states[tracked.state] = states.get(tracked.state, 0) + 1
+        return {'tracked': len(self._commands), 'states': states, 'unmatched': self.unmatched}
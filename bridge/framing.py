@@ -0,0 +1,336 @@
+"""
+Protocolo binário opcional da serial Arduino <-> bridge.
+
+Cada quadro:
+
+    0xA5 | LEN | OP | PAYLOAD (LEN-1 bytes) | CRC8
+
+LEN conta OP + PAYLOAD (1..255); o CRC-8 (polinômio 0x07, início 0) cobre
+LEN, OP e PAYLOAD. Inteiros são little-endian. Um match_found vai em 8
+bytes, contra 59 da linha JSON (a 9600 baud, ~1 ms por byte).
+
+Negociação: o firmware anuncia `proto=bin1` na linha [BOOT]; o bridge
+responde com o comando texto `PROTO:BIN:1` e o firmware confirma com um
+quadro HELLO. Sem o anúncio (firmware antigo) ou com SERIAL_PROTOCOL=json,
+tudo continua em linhas JSON. Mesmo no modo binário o firmware aceita os
+comandos em texto, e o decoder aceita linhas de texto misturadas com quadros
+(o 0xA5 nunca começa uma linha ASCII/UTF-8).
+
+    python framing.py --bench    # bytes e tempo por evento, JSON x binário
+"""
+import argparse
+import json
+import time
+
+SOF = 0xA5
+PROTO_VERSION = 1
+
+# --- Opcodes: Arduino -> bridge ---
+EV_HELLO = 0x01        # versão u8, templateCount u16
+EV_HEARTBEAT = 0x02    # [STATUS] Ativo...
+EV_TEXT = 0x03         # linha de texto ([INFO], [DEBUG]...) em UTF-8
+EV_MATCH = 0x10        # sensor_id u16, confidence u16
+EV_NO_MATCH = 0x11
+EV_STATUS = 0x20       # código u8, id u16 (0 = sem id), msg ASCII no resto
+EV_SLOTS = 0x21        # count u16, bitmap de 32 bytes (ReadIndexTable)
+
+# --- Opcodes: bridge -> Arduino ---
+CMD_ENROLL = 0x80      # id u16
+CMD_DELETE = 0x81      # id u16
+CMD_DELETE_ALL = 0x82
+CMD_SLOTS = 0x83
+
+# Códigos do EV_STATUS (mesma ordem do firmware)
+STATUS_CODES = (
+    None, 'enroll_starting', 'enroll_prompt_1', 'enroll_prompt_2', 'enroll_success', 'enroll_failed',
+    'delete_success', 'delete_failed', 'delete_all_success', 'delete_all_failed', 'slots_failed', 'error',
+)
+STATUS_BY_NAME = {name: code for code, name in enumerate(STATUS_CODES) if name}
+
+COMMANDS = {'ENROLL': CMD_ENROLL, 'DELETE': CMD_DELETE, 'DELETE_ALL': CMD_DELETE_ALL, 'SLOTS': CMD_SLOTS}
+COMMAND_NAMES = {opcode: name for name, opcode in COMMANDS.items()}
+
+
+def _crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07 if crc & 0x80 else crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+
+_CRC8 = _crc8_table()
+
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc = _CRC8[crc ^ byte]
+    return crc
+
+
+def encode_frame(opcode, payload=b''):
+    if len(payload) > 254:
+        raise ValueError("payload maior que 254 bytes")
+    body = bytes((len(payload) + 1, opcode)) + bytes(payload)
+    return bytes((SOF,)) + body + bytes((crc8(body),))
+
+
+def _u16(payload, offset=0):
+    return int.from_bytes(payload[offset:offset + 2], 'little')
+
+
+# --- Eventos (o que o firmware envia) ---
+
+def encode_event(msg):
+    """
+    Dict no formato das linhas JSON do firmware -> quadro. Usado pelo
+    simulador (e pelos testes) para falar binário como o UFCGuard.ino.
+    """
+    if msg.get('event') == 'match_found':
+        payload = int(msg['sensor_id']).to_bytes(2, 'little') + int(msg['confidence']).to_bytes(2, 'little')
+        return encode_frame(EV_MATCH, payload)
+    if msg.get('event') == 'match_failed':
+        return encode_frame(EV_NO_MATCH)
+    status = msg.get('status')
+    if status == 'slots':
+        return encode_frame(EV_SLOTS, int(msg['count']).to_bytes(2, 'little') + bytes.fromhex(msg['bitmap']))
+    if status in STATUS_BY_NAME:
+        payload = bytes((STATUS_BY_NAME[status],)) + int(msg.get('id') or 0).to_bytes(2, 'little')
+        return encode_frame(EV_STATUS, payload + msg.get('msg', '').encode('ascii', 'replace'))
+    raise ValueError(f"evento sem opcode: {msg}")
+
+
+def decode_event(opcode, payload):
+    """
+    Quadro -> dict no mesmo formato das linhas JSON (o resto do bridge não
+    sabe de onde veio). Lê direto do memoryview, sem copiar o payload.
+    Retorna None para opcodes que não viram mensagem (HELLO, HEARTBEAT, TEXT).
+    """
+    if opcode == EV_MATCH:
+        return {'event': 'match_found', 'sensor_id': _u16(payload), 'confidence': _u16(payload, 2)}
+    if opcode == EV_NO_MATCH:
+        return {'event': 'match_failed'}
+    if opcode == EV_STATUS:
+        code = payload[0]
+        msg = {'status': STATUS_CODES[code] if code < len(STATUS_CODES) else f'unknown_{code}'}
+        sensor_id = _u16(payload, 1)
+        if sensor_id:
+            msg['id'] = sensor_id
+        if len(payload) > 3:
+            msg['msg'] = bytes(payload[3:]).decode('ascii', 'replace')
+        return msg
+    if opcode == EV_SLOTS:
+        return {'status': 'slots', 'count': _u16(payload), 'bitmap': payload[2:].hex().upper()}
+    return None
+
+
+# --- Comandos (o que o bridge envia) ---
+
+def encode_command(command):
+    """'ENROLL:5' -> quadro. Levanta ValueError para comandos sem opcode."""
+    name, _, arg = command.strip().upper().partition(':')
+    if name not in COMMANDS:
+        raise ValueError(f"comando sem opcode: {command}")
+    payload = int(arg).to_bytes(2, 'little') if name in ('ENROLL', 'DELETE') else b''
+    return encode_frame(COMMANDS[name], payload)
+
+
+def decode_command(opcode, payload):
+    """Quadro de comando -> texto ('ENROLL:5'), como o firmware o trataria."""
+    name = COMMAND_NAMES.get(opcode)
+    if name in ('ENROLL', 'DELETE'):
+        return f"{name}:{_u16(payload)}"
+    return name
+
+
+# --- Decoder ---
+
+FRAME = 'frame'
+LINE = 'line'
+
+
+class FrameDecoder:
+    """
+    Separa quadros binários e linhas de texto de um fluxo de bytes da serial.
+
+    `feed(data)` recebe o que chegou na porta (data_received do transporte) e
+    `events()` devolve (FRAME, opcode, payload), com o payload como memoryview
+    do próprio buffer (válido só até o próximo feed), ou (LINE, texto, None).
+
+    Um quadro só é reconhecido no começo de uma linha (logo depois de um '\n'
+    ou de outro quadro): um 0xA5 no meio de uma linha de texto é só um byte
+    da linha. Depois de um quadro com CRC errado o decoder perde o
+    alinhamento e descarta bytes até o próximo 0xA5 ou fim de linha.
+
+    Os bytes ficam num bytearray de tamanho fixo. O espaço já consumido é
+    recuperado movendo o resto para o início do buffer (uma cópia curta, só
+    quando falta espaço no fim) em vez de dar a volta como um anel: assim um
+    quadro nunca fica partido em dois pedaços.
+    """
+
+    def __init__(self, size=4096, max_line=1024):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.max_line = max_line
+        self.resync = False
+        self.frames = 0
+        self.lines = 0
+        self.crc_errors = 0
+        self.dropped_bytes = 0
+
+    def _reserve(self, count):
+        if len(self.buffer) - self.end < count:
+            pending = self.end - self.start
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, pending
+            if len(self.buffer) - self.end < count:
+                # Buffer cheio sem nenhum quadro/linha completo: é lixo
+                self.dropped_bytes += self.end
+                self.start = self.end = 0
+
+    def feed(self, data):
+        """Acrescenta ao buffer os bytes recebidos da porta."""
+        for offset in range(0, len(data), self.max_line):
+            chunk = data[offset:offset + self.max_line]
+            self._reserve(len(chunk))
+            self.buffer[self.end:self.end + len(chunk)] = chunk
+            self.end += len(chunk)
+
+    def events(self):
+        buffer, view = self.buffer, self.view
+        while self.start < self.end:
+            start, end = self.start, self.end
+            if buffer[start] == SOF:
+                if end - start < 2:
+                    return
+                length = buffer[start + 1]
+                total = length + 3
+                if end - start < total:
+                    return
+                if length == 0 or crc8(view[start + 1:start + 2 + length]) != buffer[start + total - 1]:
+                    # Quadro corrompido: pula o SOF e procura o próximo
+                    self.crc_errors += 1
+                    self.dropped_bytes += 1
+                    self.start = start + 1
+                    self.resync = True
+                    continue
+                self.start = start + total
+                self.resync = False
+                self.frames += 1
+                yield FRAME, buffer[start + 2], view[start + 3:start + 2 + length]
+                continue
+
+            newline = buffer.find(b'\n', start, end)
+            if self.resync:
+                # Resto de um quadro perdido: descarta até o próximo SOF ou fim de linha
+                sof = buffer.find(SOF, start, newline if newline >= 0 else end)
+                if sof >= 0:
+                    self.dropped_bytes += sof - start
+                    self.start = sof
+                    continue
+                stop = newline + 1 if newline >= 0 else end
+                self.dropped_bytes += stop - start
+                self.start = stop
+                self.resync = newline < 0
+                continue
+            if newline < 0:
+                if end - start > self.max_line:
+                    self.dropped_bytes += end - start
+                    self.start = end
+                    self.resync = True
+                return
+            self.start = newline + 1
+            line = bytes(view[start:newline]).decode('utf-8', errors='replace').strip()
+            if line:
+                self.lines += 1
+                yield LINE, line, None
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'lines': self.lines,
+            'crc_errors': self.crc_errors,
+            'dropped_bytes': self.dropped_bytes,
+            'buffered': self.end - self.start,
+        }
+
+
+# --- Medição ---
+
+SAMPLE_EVENTS = [
+    {'event': 'match_found', 'sensor_id': 42, 'confidence': 187},
+    {'event': 'match_failed'},
+    {'status': 'enroll_success', 'id': 42},
+    {'status': 'enroll_failed', 'msg': 'Erro Img1'},
+    {'status': 'slots', 'count': 3, 'bitmap': (1 << 2 | 1 << 3 | 1 << 9).to_bytes(32, 'little').hex().upper()},
+]
+
+
+def _json_line(msg):
+    # Mesmo espaçamento do firmware: {"event":"match_found", "sensor_id":42, ...}
+    return (json.dumps(msg, separators=(', ', ':')) + '\r\n').encode()
+
+
+def _legacy_handle(line):
+    # O que o bridge fazia por linha antes: 4 buscas de substring + json.loads
+    if "[STATUS]" in line or "[DEBUG]" in line or "[BOOT]" in line or "[INFO]" in line:
+        return None
+    return json.loads(line)
+
+
+def bench(baud=9600, repeat=20000):
+    """Bytes, tempo no fio (10 bits/byte) e custo de decodificação por evento."""
+    rows = []
+    for msg in SAMPLE_EVENTS:
+        line, frame = _json_line(msg), encode_event(msg)
+
+        decoder = FrameDecoder()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            decoder.feed(line)
+            for _, text, _ in decoder.events():
+                _legacy_handle(text)
+        json_us = (time.perf_counter() - start) / repeat * 1e6
+
+        decoder = FrameDecoder()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            decoder.feed(frame)
+            for _, opcode, payload in decoder.events():
+                decode_event(opcode, payload)
+        bin_us = (time.perf_counter() - start) / repeat * 1e6
+
+        rows.append({
+            'evento': msg.get('event') or msg.get('status'),
+            'json_bytes': len(line),
+            'bin_bytes': len(frame),
+            'json_wire_ms': len(line) * 10 / baud * 1000,
+            'bin_wire_ms': len(frame) * 10 / baud * 1000,
+            'json_decode_us': json_us,
+            'bin_decode_us': bin_us,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara o protocolo JSON com o binário.")
+    parser.add_argument('--bench', action='store_true', required=True)
+    parser.add_argument('--baud', type=int, default=9600)
+    parser.add_argument('--repeat', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'evento':<20}{'bytes json/bin':>16}{'fio ms json/bin':>20}{'decode µs json/bin':>22}")
+    for row in bench(args.baud, args.repeat):
+        print(f"{row['evento']:<20}"
+              f"{row['json_bytes']:>9}/{row['bin_bytes']:<6}"
+              f"{row['json_wire_ms']:>12.1f}/{row['bin_wire_ms']:<7.1f}"
+              f"{row['json_decode_us']:>14.2f}/{row['bin_decode_us']:<7.2f}")
+
+
+if __name__ == "__main__":
+    main()
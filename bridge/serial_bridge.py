@@ -1,159 +1,1014 @@
+"""
+Bridge entre os Arduinos (portas seriais) e o Django.
+
+Tudo roda num único event loop asyncio: a leitura das portas
+(pyserial-asyncio), o envio dos eventos ao Django (aiohttp, com pool de
+conexões) e o servidor HTTP que recebe os comandos do Django (aiohttp.web).
+Uma porta que cai é reaberta com backoff; SIGINT/SIGTERM desligam em ordem
+(ver shutdown).
+"""
+import asyncio
 import os
 import serial
-import requests
+import serial_asyncio
 import json
-import threading
+import logging
+import re
+import signal
 import time
+import uuid
+import aiohttp
+from aiohttp import web
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+
+import framing
+from commands import CommandTracker
+from bridge_logging import logging_stats, setup_logging
+from metrics import registry as metrics_registry
+from spool import Spool
 
 # --- Configuração Global ---
 load_dotenv()
 SERIAL_PORT = os.getenv('SERIAL_PORT', 'COM5')
 SERIAL_BAUD = int(os.getenv('SERIAL_BAUD', 9600))
+# Vários portões no mesmo host: "portaria=COM5,garagem=/dev/ttyUSB1@115200" (ver parse_gates).
+# Sem SERIAL_PORTS, um portão só (GATE_ID) na SERIAL_PORT.
+SERIAL_PORTS = os.getenv('SERIAL_PORTS', '')
+GATE_ID = os.getenv('GATE_ID', 'principal')
 LOG_ACCESS_URL = os.getenv('LOG_ACCESS_URL')
+# Endpoint de lote (reenvio do spool); por padrão derivado do LOG_ACCESS_URL
+LOG_ACCESS_BATCH_URL = os.getenv('LOG_ACCESS_BATCH_URL') or (
+    LOG_ACCESS_URL.replace('/log_access/', '/log_access_batch/') if LOG_ACCESS_URL else None
+)
+# Linhas de status do Arduino (enroll_*, delete_*) para a fila de comandos do Django
+SENSOR_STATUS_URL = os.getenv('SENSOR_STATUS_URL') or (
+    LOG_ACCESS_URL.replace('/log_access/', '/sensor/status/') if LOG_ACCESS_URL else None
+)
 BRIDGE_PORT = int(os.getenv('BRIDGE_PORT', 8081))
+# 'auto' negocia o protocolo binário se o firmware anunciar no [BOOT]; 'json' nunca (ver framing.py)
+SERIAL_PROTOCOL = os.getenv('SERIAL_PROTOCOL', 'auto').lower()
+# Comandos sem status final depois disso viram 'timeout'; /command?wait= espera no máximo COMMAND_MAX_WAIT
+COMMAND_TIMEOUT = float(os.getenv('COMMAND_TIMEOUT', 90))
+COMMAND_MAX_WAIT = float(os.getenv('COMMAND_MAX_WAIT', 60))
+# Pede o mapa de slots (SLOTS) assim que o Arduino informa o templateCount no boot
+SLOTS_ON_BOOT = os.getenv('SLOTS_ON_BOOT', '1') == '1'
 HTTP_TIMEOUT = 5
+# Fila de envio de matches para o Django (ver MatchDispatcher)
+DISPATCH_QUEUE_SIZE = int(os.getenv('DISPATCH_QUEUE_SIZE', 256))
+DISPATCH_WORKERS = int(os.getenv('DISPATCH_WORKERS', 2))
+# 'drop_oldest' descarta o evento mais antigo; 'drop_newest' descarta o que acabou de chegar
+DISPATCH_OVERFLOW = os.getenv('DISPATCH_OVERFLOW', 'drop_oldest')
+# Pool de conexões HTTP (keep-alive) para o Django
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', DISPATCH_WORKERS))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', 3))
+HTTP_BACKOFF = float(os.getenv('HTTP_BACKOFF', 0.2))
+# Porta que caiu (ou não abriu) é tentada de novo após MIN s, dobrando até MAX s
+SERIAL_RECONNECT_MIN = float(os.getenv('SERIAL_RECONNECT_MIN', 1))
+SERIAL_RECONNECT_MAX = float(os.getenv('SERIAL_RECONNECT_MAX', 30))
+# No desligamento, quanto tempo esperar as filas esvaziarem (o resto dos matches vai para o spool)
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', 10))
+# Spool em disco para eventos que não chegaram ao Django (ver spool.py)
+SPOOL_PATH = os.getenv('SPOOL_PATH', 'spool/access_events.log')
+SPOOL_FSYNC_INTERVAL = float(os.getenv('SPOOL_FSYNC_INTERVAL', 0.5))
+SPOOL_RETRY_INTERVAL = float(os.getenv('SPOOL_RETRY_INTERVAL', 5))
+# No máximo o MAX_BATCH_EVENTS do /api/log_access_batch/ (lotes maiores são recusados com 400)
+SPOOL_BATCH_SIZE = min(int(os.getenv('SPOOL_BATCH_SIZE', 100)), 500)
+# Log estruturado (ver bridge_logging.py)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+LOG_SAMPLE_EVERY = int(os.getenv('LOG_SAMPLE_EVERY', 20))
+
+log = logging.getLogger('bridge')
+arduino_log = logging.getLogger('bridge.arduino')
+
+# Portões (um por porta serial), por ID; montado no main a partir do SERIAL_PORTS
+gates = {}
+# Spool global (criado no main)
+spool = None
+spool_wakeup = asyncio.Event()
+TEMPLATE_COUNT_RE = re.compile(r'contem (\d+) templates')
+PROTO_OFFER_RE = re.compile(r'proto=bin(\d+)')
+GATE_ID_RE = re.compile(r'^[A-Za-z0-9_.-]{1,30}$')
+
+# --- Cliente HTTP (Bridge -> Django) ---
+
+class HttpClient:
+    """
+    Sessão aiohttp com pool de conexões keep-alive e retry com backoff.
+
+    Só repete falhas de conexão e respostas 502/503/504, onde o Django não
+    chegou a processar o evento; timeouts de leitura não são repetidos para
+    não duplicar registros.
+    """
+    RETRY_STATUS = (502, 503, 504)
+
+    def __init__(self, pool_size, retries, backoff, timeout):
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = None
+
+    async def start(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def post(self, url, payload):
+        """POST JSON. Retorna (status HTTP, corpo); levanta aiohttp.ClientError ou asyncio.TimeoutError."""
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                async with self.session.post(url, json=payload) as r:
+                    body = await r.text()
+                if r.status not in self.RETRY_STATUS or last:
+                    return r.status, body
+            except aiohttp.ClientConnectorError:
+                if last:
+                    raise
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+
+class HttpTimings:
+    """Tempo por chamada HTTP (ms), para acompanhar o round-trip até o Django."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.last_ms = None
+        self.max_ms = 0.0
+        self._total_ms = 0.0
+
+    def record(self, elapsed_ms, ok):
+        self.calls += 1
+        if not ok:
+            self.errors += 1
+        self.last_ms = elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self._total_ms += elapsed_ms
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'last_ms': self.last_ms,
+            'avg_ms': (self._total_ms / self.calls) if self.calls else None,
+            'max_ms': self.max_ms,
+        }
+
+
+# A sessão é aberta no event loop (main)
+http_client = HttpClient(HTTP_POOL_SIZE, HTTP_RETRIES, HTTP_BACKOFF, HTTP_TIMEOUT)
+http_timings = HttpTimings()
+# Erros de rede do cliente HTTP (o timeout do aiohttp é um asyncio.TimeoutError)
+HTTP_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
 
-# Objeto Serial global
-ser = None
-# Objeto Flask global
-app = Flask(__name__)
+# --- Métricas (GET /metrics, formato Prometheus) ---
+# Onde vai a latência de um match: linha na serial -> fila -> POST no Django
+serial_line_seconds = metrics_registry.histogram(
+    'bridge_serial_line_seconds', "Tempo de processamento de cada linha lida da serial.", ('gate',))
+queue_wait_seconds = metrics_registry.histogram(
+    'bridge_queue_wait_seconds', "Tempo do evento na fila até um worker pegá-lo.", ('fila',))
+http_post_seconds = metrics_registry.histogram(
+    'bridge_http_post_seconds', "Duração dos POSTs para o Django.", ('endpoint', 'outcome'))
+match_latency_seconds = metrics_registry.histogram(
+    'bridge_match_latency_seconds', "Da linha na serial até o fim do envio ao Django.", ('fila', 'outcome'))
+dispatch_events = metrics_registry.counter(
+    'bridge_dispatch_events_total', "Eventos por resultado nas filas de envio.", ('fila', 'result'))
 
-# --- Lógica de Leitura do Arduino ---
+# --- Fila de Envio (Bridge -> Django) ---
 
-def handle_arduino_message(line):
-    """Processa mensagens JSON ou de STATUS recebidas DO Arduino."""
-    
-    if "[STATUS]" in line or "[BOOT]" in line or "[INFO]" in line or "[DEBUG]" in line:
-        print(f"[Arduino] {line}")
+class MatchDispatcher:
+    """
+    Fila limitada + workers (tarefas asyncio) que enviam os matches para o Django.
+
+    A leitura da serial só faz `submit()` (não espera); o POST acontece
+    nos workers. Se a fila encher, aplica a política `overflow`. Cada worker
+    guarda em `current` o payload que está enviando, para que stop() não o
+    perca ao cancelar o worker no meio do POST.
+    """
+
+    def __init__(self, send_func, maxsize=256, workers=2, overflow='drop_oldest', name='match'):
+        if overflow not in ('drop_oldest', 'drop_newest'):
+            raise ValueError(f"Política de overflow inválida: {overflow}")
+        self.name = name
+        self.send_func = send_func
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflow = overflow
+        self.n_workers = workers
+        self.tasks = []
+        self.in_flight = 0
+        self.current = {}  # worker (task) -> payload em envio
+        # Contadores
+        self.enqueued = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self.last_latency_ms = None
+        self.max_latency_ms = 0.0
+        self._total_latency_ms = 0.0
+
+    def start(self):
+        """Cria os workers no event loop em execução."""
+        for i in range(self.n_workers):
+            self.tasks.append(asyncio.create_task(self._worker(), name=f"dispatch-{self.name}-{i}"))
+
+    @property
+    def idle(self):
+        """Fila vazia e nenhum envio em andamento."""
+        return self.queue.empty() and not self.in_flight
+
+    def submit(self, payload, received_at):
+        """Enfileira um evento. Retorna False se ele foi descartado."""
+        item = (payload, received_at, time.perf_counter())
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            dispatch_events.inc(self.name, 'dropped')
+            if self.overflow == 'drop_newest':
+                log.warning("Fila cheia: evento descartado", extra={'queue_maxsize': self.queue.maxsize, 'payload': payload})
+                return False
+            old_payload, _, _ = self.queue.get_nowait()
+            self.queue.task_done()
+            log.warning("Fila cheia: evento antigo descartado", extra={'queue_maxsize': self.queue.maxsize, 'payload': old_payload})
+            self.queue.put_nowait(item)
+        self.enqueued += 1
+        return True
+
+    async def _worker(self):
+        task = asyncio.current_task()
+        while True:
+            payload, received_at, enqueued_at = await self.queue.get()
+            self.in_flight += 1
+            self.current[task] = payload
+            queue_wait_seconds.observe(time.perf_counter() - enqueued_at, self.name)
+            try:
+                ok = await self.send_func(payload, received_at)
+            except Exception:
+                log.exception("Erro no worker de envio")
+                ok = False
+            finally:
+                # Cancelado no meio do envio (stop): stop() já guardou o payload
+                del self.current[task]
+                self.in_flight -= 1
+                self.queue.task_done()
+            latency_ms = (time.time() - received_at) * 1000
+            outcome = 'sent' if ok else 'failed'
+            match_latency_seconds.observe(latency_ms / 1000, self.name, outcome)
+            dispatch_events.inc(self.name, outcome)
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self.last_latency_ms = latency_ms
+            self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+            self._total_latency_ms += latency_ms
+
+    async def stop(self, timeout):
+        """
+        Espera a fila esvaziar por até `timeout` s e encerra os workers.
+        Retorna os payloads não enviados, na ordem: os que estavam no meio do
+        POST (cancelados) e depois os que ficaram na fila. Um POST cancelado
+        pode ter chegado ao Django; o reenvio é seguro porque o Django ignora
+        event_id repetidos.
+        """
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        # Sem await entre a cópia e o cancel: nenhum worker termina no meio
+        leftover = list(self.current.values())
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        while not self.queue.empty():
+            leftover.append(self.queue.get_nowait()[0])
+            self.queue.task_done()
+        return leftover
+
+    def stats(self):
+        done = self.sent + self.failed
+        return {
+            'queue_length': self.queue.qsize(),
+            'queue_maxsize': self.queue.maxsize,
+            'overflow_policy': self.overflow,
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'sent': self.sent,
+            'failed': self.failed,
+            'last_latency_ms': self.last_latency_ms,
+            'avg_latency_ms': (self._total_latency_ms / done) if done else None,
+            'max_latency_ms': self.max_latency_ms,
+        }
+
+
+async def spool_event(payload, reason):
+    """Guarda o evento no spool em disco para reenvio posterior."""
+    if spool is None:
+        log.error("Evento perdido (spool desativado)", extra={'payload': payload})
         return
+    # A escrita pode esperar o fsync do spool: fica fora do event loop
+    seq = await asyncio.to_thread(spool.append, payload)
+    log.warning("Evento guardado no spool", extra={'seq': seq, 'reason': reason})
+    spool_wakeup.set()
 
+
+async def post_match(payload, received_at):
+    """Envia um match para o Django (roda nos workers do MatchDispatcher)."""
+    if spool is not None and spool.pending_count():
+        # Já há eventos esperando: mantém a ordem e não espera outro timeout
+        await spool_event(payload, "spool com eventos pendentes")
+        return False
+
+    start = time.perf_counter()
     try:
-        msg = json.loads(line)
-        
+        status, body = await http_client.post(LOG_ACCESS_URL, payload)
+    except HTTP_ERRORS as e:
+        http_timings.record((time.perf_counter() - start) * 1000, False)
+        http_post_seconds.observe(time.perf_counter() - start, 'log_access', 'error')
+        log.error("Falha ao registrar acesso no Django", extra={'error': str(e) or type(e).__name__})
+        await spool_event(payload, "Django inacessível")
+        return False
+    post_ms = (time.perf_counter() - start) * 1000
+    http_timings.record(post_ms, status < 500)
+    http_post_seconds.observe(post_ms / 1000, 'log_access', f"{status // 100}xx")
+
+    if status >= 500:
+        log.error("Falha ao registrar acesso no Django", extra={'http_status': status})
+        await spool_event(payload, f"HTTP {status}")
+        return False
+    if status >= 400:
+        # 4xx é resposta definitiva (ex: digital desconhecida, já registrada no Django)
+        log.warning("Django recusou o acesso", extra={'http_status': status, 'body': body[:200]})
+        return False
+
+    elapsed_ms = (time.time() - received_at) * 1000
+    log.info("Acesso registrado", extra={
+        'gate': payload.get('gate'),
+        'sensor_id': payload.get('sensor_id'),
+        'post_ms': round(post_ms, 1),
+        'serial_to_response_ms': round(elapsed_ms, 1),
+    })
+    return True
+
+
+# Recusas que podem passar sozinhas (token, rate limit): o lote fica no spool para a próxima tentativa
+RETRY_LATER_STATUS = (401, 403, 408, 429)
+
+
+async def send_spooled_batch(records):
+    """
+    Reenvia registros do spool num único POST para o endpoint de lote.
+    Retorna o status HTTP (None se o Django não respondeu). O lote é
+    entregue todo ou nada: o Django grava o lote numa transação e ignora
+    event_id repetidos.
+    """
+    payload = {'events': [record['payload'] for record in records]}
+    start = time.perf_counter()
+    try:
+        status, _ = await http_client.post(LOG_ACCESS_BATCH_URL, payload)
+    except HTTP_ERRORS:
+        http_timings.record((time.perf_counter() - start) * 1000, False)
+        http_post_seconds.observe(time.perf_counter() - start, 'log_access_batch', 'error')
+        return None
+    elapsed = time.perf_counter() - start
+    http_timings.record(elapsed * 1000, status < 400)
+    http_post_seconds.observe(elapsed, 'log_access_batch', f"{status // 100}xx")
+    if status >= 400:
+        log.warning("Reenvio em lote recusado", extra={'http_status': status, 'events': len(records)})
+    return status
+
+
+async def deliver_spooled(records):
+    """
+    Entrega registros do spool. Retorna quantos, a partir do início, podem
+    ser confirmados (ack). Um lote recusado de vez (4xx) é dividido ao meio
+    e reenviado; um registro sozinho recusado vai para o `.rejected` do
+    spool: um evento ruim não pode parar a entrega de todos os outros.
+    """
+    status = await send_spooled_batch(records)
+    if status is None or status >= 500 or status in RETRY_LATER_STATUS:
+        return 0
+    if status < 400:
+        return len(records)
+    if len(records) == 1:
+        await asyncio.to_thread(spool.reject, records[0], f"HTTP {status}")
+        log.error("Evento do spool recusado pelo Django; guardado à parte", extra={
+            'seq': records[0]['seq'], 'http_status': status, 'path': spool.rejected_path})
+        return 1
+    half = len(records) // 2
+    done = await deliver_spooled(records[:half])
+    if done < half:
+        return done
+    return half + await deliver_spooled(records[half:])
+
+
+async def replay_spool():
+    """
+    Como Spool.replay(), mas com o envio assíncrono; ler e confirmar o
+    arquivo (que pode esperar o fsync) fica numa thread à parte.
+    """
+    total = 0
+    while True:
+        records = await asyncio.to_thread(spool.read_pending, SPOOL_BATCH_SIZE)
+        if not records:
+            return total
+        accepted = await deliver_spooled(records)
+        if accepted:
+            await asyncio.to_thread(spool.ack, records[accepted - 1]['seq'])
+            total += accepted
+        if accepted < len(records):
+            return total
+
+
+async def replay_spool_loop():
+    """Tarefa: tenta esvaziar o spool quando há eventos e a cada SPOOL_RETRY_INTERVAL."""
+    while True:
+        try:
+            await asyncio.wait_for(spool_wakeup.wait(), SPOOL_RETRY_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        spool_wakeup.clear()
+        if not spool.pending_count():
+            continue
+        try:
+            sent = await replay_spool()
+        except Exception:
+            log.exception("Erro ao reenviar spool")
+            continue
+        if sent:
+            log.info("Spool reenviado", extra={'sent': sent, 'pending': spool.pending_count()})
+
+
+async def post_sensor_status(payload, received_at):
+    """
+    Repassa uma linha de status do Arduino (enroll_*, delete_*) para o Django.
+    Sem spool: se a linha se perder, o comando estoura o timeout da fila no Django.
+    """
+    start = time.perf_counter()
+    try:
+        status, _ = await http_client.post(SENSOR_STATUS_URL, payload)
+    except HTTP_ERRORS as e:
+        http_post_seconds.observe(time.perf_counter() - start, 'sensor_status', 'error')
+        log.error("Falha ao repassar status do sensor", extra={'error': str(e) or type(e).__name__, 'arduino': payload})
+        return False
+    http_post_seconds.observe(time.perf_counter() - start, 'sensor_status', f"{status // 100}xx")
+    if status >= 400:
+        log.warning("Django recusou o status do sensor", extra={'http_status': status, 'arduino': payload})
+    return status < 400
+
+
+dispatcher = MatchDispatcher(
+    post_match,
+    maxsize=DISPATCH_QUEUE_SIZE,
+    workers=DISPATCH_WORKERS,
+    overflow=DISPATCH_OVERFLOW,
+)
+# Um worker só: as linhas de status precisam chegar na ordem em que o Arduino as imprimiu
+status_dispatcher = MatchDispatcher(post_sensor_status, maxsize=64, workers=1, name='status')
+
+# --- Portões (uma porta serial cada) ---
+
+def parse_gates(spec, default_port=SERIAL_PORT, default_gate=GATE_ID, baud=SERIAL_BAUD):
+    """
+    "portaria=COM5,garagem=/dev/ttyUSB1@115200" -> [(gate, porta, baud), ...].
+    Sem `spec`, um portão só (`default_gate` em `default_port`).
+    """
+    if not spec.strip():
+        return [(default_gate, default_port, baud)]
+    result = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        gate_id, sep, port = item.partition('=')
+        gate_id, port = gate_id.strip(), port.strip()
+        if not sep or not port or not GATE_ID_RE.match(gate_id):
+            raise ValueError(f"SERIAL_PORTS inválido: {item!r} (use gate=porta[@baud])")
+        if gate_id in (g for g, _, _ in result):
+            raise ValueError(f"Portão repetido em SERIAL_PORTS: {gate_id}")
+        port, _, port_baud = port.partition('@')
+        result.append((gate_id, port, int(port_baud) if port_baud else baud))
+    return result
+
+
+class GateLog(logging.LoggerAdapter):
+    """Acrescenta o `gate` em todo registro, sem apagar o `extra` de quem chamou."""
+
+    def process(self, msg, kwargs):
+        kwargs['extra'] = dict(self.extra, **kwargs.get('extra', {}))
+        return msg, kwargs
+
+
+class SerialProtocol(asyncio.Protocol):
+    """Liga o transporte da porta serial ao Gate; `closed` resolve quando a porta cai."""
+
+    def __init__(self, gate):
+        self.gate = gate
+        self.closed = asyncio.get_running_loop().create_future()
+
+    def data_received(self, data):
+        self.gate.data_received(data)
+
+    def connection_lost(self, exc):
+        if not self.closed.done():
+            self.closed.set_result(exc)
+
+
+class Gate:
+    """
+    Um portão: a porta serial do seu Arduino, o protocolo negociado e os
+    comandos em andamento. Eventos e linhas de status saem com `gate` = ID
+    do portão; as filas de envio ao Django, o spool e o servidor HTTP são
+    compartilhados por todos.
+
+    `connect(protocol_factory)` abre a porta e devolve (transporte,
+    protocolo), como serial_asyncio.create_serial_connection (o padrão); o
+    simulador passa o seu.
+    """
+
+    def __init__(self, gate_id, port, baud=SERIAL_BAUD, connect=None):
+        self.id = gate_id
+        self.port = port
+        self.baud = baud
+        self.connect = connect
+        self.transport = None
+        self.task = None
+        self.reconnects = 0
+        self._stopping = asyncio.Event()
+        # Último templateCount (boot) e mapa de slots (SLOTS) informados pelo Arduino
+        self.sensor_info = {'template_count': None, 'slots_count': None, 'slots_bitmap': None, 'slots_at': None}
+        # Protocolo em uso na serial (volta a 'json' a cada [BOOT] ou reconexão) e o decoder da conexão atual
+        self.protocol = {'mode': 'json', 'version': None}
+        self.decoder = None
+        # Comandos enviados a este Arduino e o status de cada um (ver commands.py)
+        self.commands = CommandTracker(timeout=COMMAND_TIMEOUT)
+        self.log = GateLog(log, {'gate': gate_id})
+        self.arduino_log = GateLog(arduino_log, {'gate': gate_id})
+
+    @property
+    def is_open(self):
+        return self.transport is not None and not self.transport.is_closing()
+
+    async def open(self):
+        """Abre a porta. Retorna o SerialProtocol da conexão."""
+        factory = lambda: SerialProtocol(self)
+        if self.connect is not None:
+            transport, protocol = await self.connect(factory)
+        else:
+            loop = asyncio.get_running_loop()
+            transport, protocol = await serial_asyncio.create_serial_connection(
+                loop, factory, self.port, baudrate=self.baud)
+        self.decoder = framing.FrameDecoder()
+        self.transport = transport
+        self.log.info("Conectado na porta serial", extra={'port': self.port, 'baud': self.baud})
+        return protocol
+
+    def start(self):
+        self.task = asyncio.create_task(self.run(), name=f"serial-{self.id}")
+
+    async def stop(self):
+        self._stopping.set()
+        if self.transport is not None:
+            self.transport.close()
+        if self.task is not None:
+            await self.task
+
+    async def run(self):
+        """
+        Mantém a porta aberta: se ela não abrir ou cair (cabo USB, Arduino
+        desligado), tenta de novo após SERIAL_RECONNECT_MIN s, dobrando a
+        espera até SERIAL_RECONNECT_MAX. Roda até stop().
+        """
+        delay = SERIAL_RECONNECT_MIN
+        while not self._stopping.is_set():
+            try:
+                protocol = await self.open()
+            except (serial.SerialException, OSError) as e:
+                self.log.error("Não foi possível abrir a porta serial", extra={
+                    'port': self.port, 'error': str(e), 'retry_in': delay})
+                await self._sleep(delay)
+                delay = min(delay * 2, SERIAL_RECONNECT_MAX)
+                continue
+
+            delay = SERIAL_RECONNECT_MIN
+            exc = await protocol.closed
+            self.transport = None
+            # Quem estava esperando resposta não vai recebê-la; o Arduino volta em JSON
+            self.commands.fail_all("Porta serial desconectada")
+            self.protocol.update(mode='json', version=None)
+            if self._stopping.is_set():
+                break
+            self.reconnects += 1
+            self.log.error("Porta serial desconectada; reconectando", extra={
+                'port': self.port, 'error': str(exc) if exc else None, 'retry_in': delay})
+            await self._sleep(delay)
+
+    async def _sleep(self, delay):
+        # Acorda antes se o bridge estiver desligando
+        try:
+            await asyncio.wait_for(self._stopping.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    # --- Leitura (Arduino -> PC) ---
+
+    def handle_message(self, msg, received_at):
+        """Uma mensagem do Arduino (linha JSON ou quadro binário já decodificado)."""
         if msg.get('event') == 'match_found':
             sensor_id = msg.get('sensor_id')
             confidence = msg.get('confidence')
-            print(f"============================================================")
-            print(f"[Bridge] SENSOR ENCONTROU MATCH! ID: {sensor_id}, Confiança: {confidence}")
-            
+            self.log.info("Match no sensor", extra={'sensor_id': sensor_id, 'confidence': confidence})
+
             if not LOG_ACCESS_URL:
-                print("[Bridge] ERRO: LOG_ACCESS_URL não definida no .env")
+                self.log.error("LOG_ACCESS_URL não definida no .env")
                 return
 
-            try:
-                payload = {'sensor_id': sensor_id, 'confidence': confidence}
-                r = requests.post(LOG_ACCESS_URL, json=payload, timeout=HTTP_TIMEOUT)
-                r.raise_for_status()
-                print(f"[Bridge] Servidor respondeu: {r.json()}")
-                print(f"============================================================")
-            except Exception as e:
-                print(f"[Bridge] ERRO ao registrar acesso no Django: {e}")
+            # Não faz o POST aqui: a leitura da serial não espera o Django
+            payload = {
+                'gate': self.id,
+                'sensor_id': sensor_id,
+                'confidence': confidence,
+                'received_at': received_at,
+                # Chave de idempotência: o Django ignora o evento se ele for reenviado
+                'event_id': uuid.uuid4().hex,
+            }
+            dispatcher.submit(payload, received_at)
 
         elif msg.get('event') == 'match_failed':
-            print("[Bridge] Leitura falhou (Acesso Negado).")
-        
+            self.log.info("Leitura falhou (acesso negado)")
+
         elif "status" in msg:
-            print(f"[Arduino] {line}")
-        
+            # Cada portão tem o seu sensor: o Django escolhe a fila pelo `gate`
+            msg = dict(msg, gate=self.id)
+            tracked = self.commands.match(msg)
+            if tracked is not None:
+                # O Django casa o status pelo command_id em vez de adivinhar
+                msg['command_id'] = tracked.command_id
+            self.arduino_log.info("Status do Arduino", extra={'arduino': msg})
+            if msg['status'] == 'slots':
+                self.sensor_info.update(slots_count=msg.get('count'), slots_bitmap=msg.get('bitmap'), slots_at=received_at)
+            if SENSOR_STATUS_URL:
+                status_dispatcher.submit(msg, received_at)
+
         else:
-            print(f"[Arduino JSON] {line}")
+            self.arduino_log.info("JSON do Arduino", extra={'arduino': msg})
 
-    except json.JSONDecodeError:
-        if line.strip():
-            print(f"[Arduino TXT] {line}") 
-    except Exception as e:
-        print(f"[Bridge] Erro ao processar linha: {e}")
+    def handle_arduino_message(self, line, received_at=None):
+        """
+        Processa uma linha de texto recebida DO Arduino (JSON ou [TAG] ...).
+        `received_at` é o timestamp (epoch) em que a linha chegou na serial.
+        """
+        if received_at is None:
+            received_at = time.time()
 
-def read_from_port(ser_conn):
-    """
-    Thread 1: Ouve continuamente o que o Arduino envia.
-    """
-    print(f"[Bridge] Thread de LEITURA (Arduino -> PC) iniciada.")
-    while True:
         try:
-            if ser_conn.in_waiting > 0:
-                line = ser_conn.readline().decode('utf-8').strip()
-                if line:
-                    handle_arduino_message(line)
-        except Exception as e:
-            print(f"[Bridge] Porta serial desconectada. Encerrando thread de leitura. {e}")
-            break
-        time.sleep(0.05)
+            # O primeiro caractere decide o caminho: só linhas '{' passam pelo json.loads
+            if line.startswith('{'):
+                try:
+                    msg = json.loads(line)
+                except json.JSONDecodeError:
+                    self.arduino_log.info(line)
+                    return
+                self.handle_message(msg, received_at)
+            elif line.startswith("[STATUS]"):
+                # Repete a cada 5 s: só 1 a cada LOG_SAMPLE_EVERY (por portão) vai para o log
+                self.arduino_log.info(line, extra={'sample': f"status:{self.id}"})
+            elif line.startswith("[DEBUG]"):
+                self.arduino_log.debug(line, extra={'sample': f"debug:{self.id}"})
+            elif line.startswith("[BOOT]"):
+                self.arduino_log.info(line)
+                self.negotiate_protocol(line)
+            elif line.startswith("[INFO]"):
+                self.arduino_log.info(line)
+                count = TEMPLATE_COUNT_RE.search(line)
+                if count:
+                    self.sensor_info['template_count'] = int(count.group(1))
+                    self.request_slots()
+            else:
+                self.arduino_log.info(line)
+        except Exception:
+            self.log.exception("Erro ao processar linha", extra={'line': line})
+
+    def handle_frame(self, opcode, payload, received_at):
+        """Processa um quadro binário (ver framing.py). `payload` é um memoryview do buffer de leitura."""
+        try:
+            if opcode == framing.EV_HELLO:
+                self.protocol.update(mode='binary', version=payload[0])
+                self.sensor_info['template_count'] = int.from_bytes(payload[1:3], 'little')
+                self.log.info("Protocolo binário ativo", extra={'version': payload[0]})
+            elif opcode == framing.EV_HEARTBEAT:
+                self.arduino_log.info("[STATUS] Ativo...", extra={'sample': f"status:{self.id}"})
+            elif opcode == framing.EV_TEXT:
+                self.handle_arduino_message(bytes(payload).decode('utf-8', errors='replace'), received_at)
+            else:
+                msg = framing.decode_event(opcode, payload)
+                if msg is None:
+                    self.log.warning("Quadro com opcode desconhecido", extra={'opcode': opcode})
+                    return
+                self.handle_message(msg, received_at)
+        except Exception:
+            self.log.exception("Erro ao processar quadro", extra={'opcode': opcode})
+
+    def negotiate_protocol(self, boot_line):
+        """
+        [BOOT]: o Arduino reiniciou e voltou ao JSON. Se ele anunciar `proto=binN`
+        e SERIAL_PROTOCOL=auto, pede o binário; o HELLO confirma (handle_frame).
+        """
+        self.protocol.update(mode='json', version=None)
+        self.commands.fail_all("Arduino reiniciou")
+        offer = PROTO_OFFER_RE.search(boot_line)
+        if not offer or SERIAL_PROTOCOL != 'auto':
+            return
+        version = min(int(offer.group(1)), framing.PROTO_VERSION)
+        try:
+            self.send_serial_command(f"PROTO:BIN:{version}")
+        except serial.SerialException as e:
+            self.log.warning("Não foi possível negociar o protocolo binário", extra={'error': str(e)})
+
+    def request_slots(self):
+        if not SLOTS_ON_BOOT:
+            return
+        # A resposta vai para o Django como qualquer status (guarda a leitura)
+        try:
+            self.dispatch_command("SLOTS")
+        except serial.SerialException as e:
+            self.log.warning("Não foi possível pedir o mapa de slots", extra={'error': str(e)})
+
+    def data_received(self, data):
+        """
+        Bytes recém-chegados na porta (callback do transporte, no event loop):
+        vão para o FrameDecoder, que separa linhas e quadros.
+        """
+        received_at = time.time()
+        decoder = self.decoder
+        decoder.feed(data)
+        for kind, value, payload in decoder.events():
+            start = time.perf_counter()
+            if kind == framing.FRAME:
+                self.handle_frame(value, payload, received_at)
+            else:
+                self.handle_arduino_message(value, received_at)
+            serial_line_seconds.observe(time.perf_counter() - start, self.id)
+
+    # --- Escrita (PC -> Arduino) ---
+
+    def send_serial_command(self, command):
+        """
+        Escreve um comando (ex: "ENROLL:5") para o Arduino: em quadro binário se
+        o protocolo foi negociado, senão em texto. Levanta erro se a porta não
+        estiver pronta.
+        """
+        if not self.is_open:
+            raise serial.SerialException("Porta serial não está pronta")
+        command = command.upper().strip()
+        name = command.partition(':')[0]
+        if self.protocol['mode'] == 'binary' and name in framing.COMMANDS:
+            self.transport.write(framing.encode_command(command))
+        else:
+            self.transport.write(f"{command}\n".encode('utf-8'))
+        self.log.info("Comando enviado ao Arduino", extra={'command': command, 'protocol': self.protocol['mode']})
+        return command
+
+    def dispatch_command(self, command, command_id=None):
+        """
+        Registra o comando no tracker e o escreve na serial. Um command_id já
+        conhecido (retry) não é reescrito. Retorna (TrackedCommand, criado).
+
+        Registro e escrita acontecem sem um `await` no meio: a ordem no
+        tracker é a ordem em que o Arduino executa.
+        """
+        tracked, created = self.commands.register(command.upper().strip(), command_id)
+        if created:
+            try:
+                self.send_serial_command(tracked.command)
+            except Exception as e:
+                self.commands.fail(tracked, f"Erro serial: {e}")
+                raise
+        return tracked, created
+
+    def stats(self):
+        return {
+            "port": self.port,
+            "baud": self.baud,
+            "serial_open": self.is_open,
+            "reconnects": self.reconnects,
+            "sensor": self.sensor_info,
+            "commands": self.commands.stats(),
+            "serial": dict(self.protocol, **(self.decoder.stats() if self.decoder else {})),
+        }
 
-# --- Servidor Web (Flask) para Receber Comandos do Django ---
 
-@app.route("/command", methods=["POST"])
-def handle_django_command():
+def find_gate(gate_id=None):
+    """Portão pelo ID; sem ID, o único portão (se houver só um)."""
+    if gate_id is None:
+        return next(iter(gates.values())) if len(gates) == 1 else None
+    return gates.get(str(gate_id))
+
+
+def gate_error(gate_id):
+    """Resposta de erro para um `gate` ausente ou desconhecido."""
+    if gate_id is None:
+        return web.json_response({"error": "gate obrigatório", "gates": list(gates)}, status=400)
+    return web.json_response({"error": "Portão desconhecido", "gate": gate_id, "gates": list(gates)}, status=404)
+
+# --- Servidor HTTP (aiohttp) para Receber Comandos do Django ---
+
+routes = web.RouteTableDef()
+
+
+@routes.post("/command")
+async def handle_django_command(request):
     """
     Endpoint: Ouve por comandos vindos do Django (ex: do painel Admin).
+    JSON: { "command": "ENROLL:5", "gate": "portaria", "command_id": "django-12", "wait": 30 }
+
+    `gate` escolhe o portão (opcional se o bridge tiver um só).
+    `command_id` é opcional (o bridge gera um) e torna o envio idempotente.
+    Com `wait`, segura a resposta até o status final ou até `wait` s:
+    200 se terminou, 202 se ainda está em andamento (consulte
+    GET /command/<command_id>). Sem `wait`, responde 202 na hora. A espera
+    não prende nada: outros comandos e a leitura das portas seguem no loop.
     """
-    global ser
-    data = request.get_json()
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        data = {}
     command = data.get('command')
-    
+
     if not command:
-        return jsonify({"error": "Comando ausente"}), 400
-        
-    if not ser or not ser.is_open:
-        return jsonify({"error": "Porta serial não está pronta"}), 500
+        return web.json_response({"error": "Comando ausente"}, status=400)
+
+    try:
+        wait = min(float(data.get('wait') or 0), COMMAND_MAX_WAIT)
+    except (TypeError, ValueError):
+        return web.json_response({"error": "wait deve ser um número (segundos)"}, status=400)
+
+    gate = find_gate(data.get('gate'))
+    if gate is None:
+        return gate_error(data.get('gate'))
+
+    if not gate.is_open:
+        return web.json_response({"error": "Porta serial não está pronta", "gate": gate.id}, status=500)
 
     try:
-        # Envia o comando para o Arduino (ex: "ENROLL:5\n")
-        ser.write(f"{command.upper().strip()}\n".encode('utf-8'))
-        
-        print(f"---------------------------------------------------------------------")
-        print(f">>> [Bridge] Comando recebido do Django: {command.upper()}")
-        print(f"---------------------------------------------------------------------")
-        
-        return jsonify({"status": "command_sent", "command": command}), 200
+        # Envia o comando para o Arduino do portão (ex: "ENROLL:5\n")
+        tracked, created = gate.dispatch_command(command, data.get('command_id'))
     except Exception as e:
-        print(f"[Bridge] Erro ao escrever na serial: {e}")
-        return jsonify({"error": f"Erro serial: {e}"}), 500
+        gate.log.error("Erro ao escrever na serial", extra={'error': str(e)})
+        return web.json_response({"error": f"Erro serial: {e}", "gate": gate.id}, status=500)
+
+    finished = await gate.commands.wait(tracked, wait) if wait > 0 else tracked.finished
+    body = dict(tracked.to_dict(), gate=gate.id, status="command_sent", duplicate=not created)
+    return web.json_response(body, status=200 if finished else 202)
+
 
-@app.route("/health", methods=["GET"])
-def health_check():
+@routes.get("/command/{command_id}")
+async def command_status(request):
+    """Estado de um comando (sent, running, success, failed, timeout), sem bloquear. `?gate=` opcional."""
+    command_id = request.match_info['command_id']
+    gate_id = request.query.get('gate')
+    candidates = [gates[gate_id]] if gate_id in gates else [] if gate_id else gates.values()
+    for gate in candidates:
+        tracked = gate.commands.get(command_id)
+        if tracked is not None:
+            return web.json_response(dict(tracked.to_dict(), gate=gate.id))
+    return web.json_response({"error": "Comando desconhecido", "command_id": command_id}, status=404)
+
+
+@routes.get("/health")
+async def health_check(request):
     """Endpoint para o Django verificar se o bridge está vivo."""
-    return jsonify({
+    return web.json_response({
         "status": "ok",
-        "serial_port": SERIAL_PORT,
-        "serial_open": ser.is_open if ser else False
-    }), 200
+        "serial_open": bool(gates) and all(gate.is_open for gate in gates.values()),
+        "gates": {gate.id: gate.stats() for gate in gates.values()},
+        "dispatch": dispatcher.stats(),
+        "status_dispatch": status_dispatcher.stats(),
+        "http": http_timings.stats(),
+        "spool": spool.stats() if spool else None,
+        "logging": logging_stats(),
+    })
+
+
+@routes.get("/slots")
+async def slots(request):
+    """Último mapa de slots lido do sensor de um portão (`?gate=`; mande SLOTS para atualizar)."""
+    gate = find_gate(request.query.get('gate'))
+    if gate is None:
+        return gate_error(request.query.get('gate'))
+    info = gate.sensor_info
+    if info['slots_bitmap'] is None:
+        return web.json_response({"error": "Sensor ainda não enviou o mapa de slots", "gate": gate.id}, status=404)
+    raw = int.from_bytes(bytes.fromhex(info['slots_bitmap']), 'little')
+    return web.json_response(dict(info, gate=gate.id, ids=[i for i in range(raw.bit_length()) if raw >> i & 1]))
+
+
+@routes.get("/metrics")
+async def metrics(request):
+    """Histogramas de latência do bridge no formato texto do Prometheus."""
+    return web.Response(text=metrics_registry.render(), headers={'Content-Type': 'text/plain; version=0.0.4'})
+
+
+def build_app():
+    app = web.Application()
+    app.add_routes(routes)
+    return app
 
 # --- Função Principal ---
 
+async def shutdown(runner, replay_task):
+    """
+    Desliga em ordem: para de aceitar comandos, fecha as portas (nenhum
+    evento novo), espera as filas por até SHUTDOWN_TIMEOUT s e guarda no
+    spool os matches que não saíram; por fim fecha o HTTP e o spool.
+    """
+    log.info("Desligando")
+    await runner.cleanup()
+    await asyncio.gather(*(gate.stop() for gate in gates.values()))
+    leftover = await dispatcher.stop(SHUTDOWN_TIMEOUT)
+    for payload in leftover:
+        spool.append(payload)
+    if leftover:
+        log.warning("Matches pendentes guardados no spool", extra={'count': len(leftover)})
+    lost = await status_dispatcher.stop(SHUTDOWN_TIMEOUT)
+    if lost:
+        log.warning("Status do sensor não repassados ao Django", extra={'count': len(lost)})
+    replay_task.cancel()
+    await asyncio.gather(replay_task, return_exceptions=True)
+    await http_client.close()
+    spool.close()
+    log.info("Conexões seriais fechadas")
+
+
+async def run(config):
+    """Sobe tudo no event loop e espera SIGINT/SIGTERM."""
+    global spool
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, AttributeError, ValueError):
+            # Windows: Ctrl+C chega como KeyboardInterrupt e cancela run() (o finally desliga)
+            pass
+
+    spool = Spool(SPOOL_PATH, fsync_interval=SPOOL_FSYNC_INTERVAL)
+    log.info("Spool aberto", extra={'path': SPOOL_PATH, 'pending': spool.pending_count()})
+    await http_client.start()
+    replay_task = asyncio.create_task(replay_spool_loop(), name='spool-replay')
+    spool_wakeup.set()
+
+    log.info("Iniciando workers de envio", extra={
+        'workers': DISPATCH_WORKERS, 'queue_size': DISPATCH_QUEUE_SIZE, 'overflow': DISPATCH_OVERFLOW,
+    })
+    dispatcher.start()
+    status_dispatcher.start()
+
+    # Um portão sem Arduino não derruba os outros: fica tentando reabrir e /health mostra serial_open=false
+    for gate_id, port, baud in config:
+        gate = gates[gate_id] = Gate(gate_id, port, baud)
+        gate.start()
+
+    # '0.0.0.0' permite que o contêiner Docker (Django) acesse o bridge
+    runner = web.AppRunner(build_app(), access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, '0.0.0.0', BRIDGE_PORT).start()
+        log.info("Bridge pronto; servidor HTTP (para o Django) no ar", extra={
+            'url': f"http://0.0.0.0:{BRIDGE_PORT}", 'gates': list(gates),
+        })
+        await stop.wait()
+    finally:
+        await shutdown(runner, replay_task)
+
+
 def main():
-    """Inicia a conexão serial e o servidor Flask."""
-    global ser
+    """Lê a configuração dos portões e roda o bridge até SIGINT/SIGTERM."""
+    setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_SAMPLE_EVERY)
     if not LOG_ACCESS_URL:
-        print("ERRO FATAL: LOG_ACCESS_URL não definida no .env")
+        log.critical("LOG_ACCESS_URL não definida no .env")
         return
 
     try:
-        ser = serial.Serial(SERIAL_PORT, SERIAL_BAUD, timeout=1)
-        print(f"[Bridge] Conectado na porta {SERIAL_PORT} @ {SERIAL_BAUD} baud.")
-    except serial.SerialException as e:
-        print(f"ERRO FATAL: Não foi possível abrir a porta {SERIAL_PORT}. {e}")
+        config = parse_gates(SERIAL_PORTS)
+    except ValueError as e:
+        log.critical(str(e))
         return
 
-    print("[Bridge] Iniciando thread de leitura do Arduino...")
-    read_thread = threading.Thread(target=read_from_port, args=(ser,), daemon=True)
-    read_thread.start()
-
-    print(f"[Bridge] Iniciando servidor Flask (para o Django) em http://0.0.0.0:{BRIDGE_PORT}")
-    print(">>> O Bridge está pronto e operando. <<<")
-    
-    # Inicia o servidor Flask na thread principal
-    # '0.0.0.0' permite que o contêiner Docker (Django) acesse o bridge
     try:
-        app.run(host='0.0.0.0', port=BRIDGE_PORT, debug=False)
+        asyncio.run(run(config))
     except KeyboardInterrupt:
-        print("\n[Bridge] Desligando (Ctrl+C pressionado)...")
-    finally:
-        if ser and ser.is_open:
-            ser.close()
-        print("[Bridge] Conexão serial fechada.")
+        pass
+    log.info("Bridge encerrado")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
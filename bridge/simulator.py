@@ -0,0 +1,561 @@
+"""
+Simulador do Arduino (UFCGuard.ino + DY-50) para testar o bridge sem hardware.
+
+Emite as mesmas linhas que o firmware ([BOOT], [STATUS], match_found,
+match_failed, status de cadastro/remoção) numa taxa configurável, contínua,
+em rajadas ou com chegadas de Poisson, e responde aos comandos
+ENROLL:<id>, DELETE:<id>, DELETE_ALL e SLOTS. Como o firmware, anuncia o
+protocolo binário no [BOOT] e passa a falar em quadros (framing.py) depois
+do PROTO:BIN; `--protocol json` imita um firmware antigo.
+
+Três formas de uso:
+
+- `FakeSerial`: porta serial falsa; `fake.connect` faz o papel do
+  serial_asyncio.create_serial_connection em `serial_bridge.Gate(...,
+  connect=fake.connect)`, para testes.
+- `--pty`: cria um par pty e imprime o caminho do lado "porta serial";
+  rode o bridge com SERIAL_PORT=<caminho> (Linux/macOS). Para vários
+  portões, um simulador por pty e SERIAL_PORTS=a=<pty1>,b=<pty2>.
+- `--bench`: roda o bridge no mesmo processo, alimentado por um FakeSerial
+  por portão (`--gates`), e mede vazão, custo de parse por linha e
+  latência serial -> Django.
+
+    python simulator.py --pty --rate 5 --templates 1-50
+    python simulator.py --bench --rate 500 --count 5000 --url http://localhost:8000/api/log_access/
+    python simulator.py --bench --rate 2000 --count 20000 --no-django
+    python simulator.py --bench --rate 2000 --count 20000 --no-django --protocol json
+    python simulator.py --bench --rate 500 --count 5000 --no-django --gates 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+
+import framing
+
+MAX_SENSOR_ID = 200
+
+
+class FakeSensor:
+    """
+    Estado do sensor (templates gravados) e as linhas que o firmware imprime.
+    Não faz I/O: devolve listas de linhas (sem o '\\n').
+    """
+
+    def __init__(self, templates=(), match_ratio=0.9, enroll_fail_ratio=0.0, seed=None, binary=True):
+        self.templates = set(templates)
+        # binary: firmware com suporte a quadros; self.binary: negociado com o bridge
+        self.binary_capable = binary
+        self.binary = False
+        self.match_ratio = match_ratio
+        self.enroll_fail_ratio = enroll_fail_ratio
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        # Igual ao commandInProgress do firmware: sem leituras durante um comando
+        self.busy = threading.Event()
+
+    def boot_lines(self):
+        self.binary = False
+        proto = f" proto=bin{framing.PROTO_VERSION}" if self.binary_capable else ""
+        return [
+            f"[BOOT] UFCGuard DY50 inicializando...{proto}",
+            "[OK] Sensor biométrico pronto.",
+            f"[INFO] Sensor contem {len(self.templates)} templates.",
+        ]
+
+    def status_line(self):
+        return "[STATUS] Ativo..."
+
+    def scan(self):
+        """Uma leitura de dedo: match_found (de um template gravado) ou match_failed."""
+        with self._lock:
+            if self.templates and self.random.random() < self.match_ratio:
+                sensor_id = self.random.choice(tuple(self.templates))
+                confidence = self.random.randint(50, 250)
+                return f'{{"event":"match_found", "sensor_id":{sensor_id}, "confidence":{confidence}}}'
+        return '{"event":"match_failed"}'
+
+    def handle_command(self, command):
+        """Processa uma linha de comando do bridge e devolve as respostas."""
+        command = command.strip()
+        if command.startswith("PROTO:BIN:"):
+            if not self.binary_capable:
+                return []
+            self.binary = True
+            with self._lock:
+                count = len(self.templates)
+            return [framing.encode_frame(framing.EV_HELLO, bytes((framing.PROTO_VERSION,)) + count.to_bytes(2, 'little'))]
+        if command.startswith("ENROLL:"):
+            sensor_id = _parse_id(command[7:])
+            if not sensor_id:
+                return []
+            lines = [
+                f'{{"status":"enroll_starting", "id":{sensor_id}}}',
+                '{"status":"enroll_prompt_1"}',
+                '{"status":"enroll_prompt_2"}',
+            ]
+            if self.random.random() < self.enroll_fail_ratio:
+                lines.append('{"status":"enroll_failed", "msg":"Erro Combinar"}')
+            else:
+                with self._lock:
+                    self.templates.add(sensor_id)
+                lines.append(f'{{"status":"enroll_success", "id":{sensor_id}}}')
+            return lines
+        if command.startswith("DELETE_ALL"):
+            with self._lock:
+                self.templates.clear()
+            return ['{"status":"delete_all_success"}']
+        if command.startswith("DELETE:"):
+            sensor_id = _parse_id(command[7:])
+            if not sensor_id:
+                return []
+            with self._lock:
+                found = sensor_id in self.templates
+                self.templates.discard(sensor_id)
+            status = 'delete_success' if found else 'delete_failed'
+            return [f'{{"status":"{status}", "id":{sensor_id}}}']
+        if command.startswith("SLOTS"):
+            # ReadIndexTable, página 0: 32 bytes, byte k / bit b = template k*8+b
+            with self._lock:
+                raw = sum(1 << sensor_id for sensor_id in self.templates if 0 <= sensor_id < 256)
+                count = len(self.templates)
+            bitmap = raw.to_bytes(32, 'little').hex().upper()
+            return [f'{{"status":"slots", "count":{count}, "bitmap":"{bitmap}"}}']
+        return []
+
+
+    def encode(self, line):
+        """Bytes que o firmware mandaria para esta linha no protocolo atual."""
+        if isinstance(line, bytes):
+            return line
+        if not self.binary:
+            return line.encode('utf-8') + b'\r\n'
+        if line.startswith('{'):
+            return framing.encode_event(json.loads(line))
+        if line.startswith("[STATUS]"):
+            return framing.encode_frame(framing.EV_HEARTBEAT)
+        return framing.encode_frame(framing.EV_TEXT, line.encode('utf-8'))
+
+
+def read_commands(decoder):
+    """Comandos completos no decoder (texto ou quadro) como texto 'ENROLL:5'."""
+    for kind, value, payload in decoder.events():
+        yield framing.decode_command(value, payload) if kind == framing.FRAME else value
+
+
+def _parse_id(value):
+    # Como o toInt() do Arduino: texto inválido vira 0 (comando ignorado)
+    try:
+        return int(value.strip())
+    except ValueError:
+        return 0
+
+
+def parse_templates(spec):
+    """'1-50,60,70-72' -> {1..50, 60, 70, 71, 72}."""
+    ids = set()
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        if '-' in part:
+            start, end = part.split('-', 1)
+            ids.update(range(int(start), int(end) + 1))
+        else:
+            ids.add(int(part))
+    return {i for i in ids if 1 <= i <= MAX_SENSOR_ID}
+
+
+def emit_events(sensor, write_line, stop, rate=5.0, burst=1, pattern='steady',
+                count=None, status_interval=5.0):
+    """
+    Gera leituras em `write_line(linha)` até `stop` ser setado ou `count`
+    leituras serem emitidas.
+
+    - steady: `burst` leituras seguidas a cada `burst / rate` segundos
+      (burst=1 é uma leitura a cada 1/rate s);
+    - poisson: intervalos exponenciais com média 1/rate.
+    Retorna o número de leituras emitidas.
+    """
+    emitted = 0
+    next_at = time.perf_counter()
+    last_status = time.monotonic()
+    while not stop.is_set() and (count is None or emitted < count):
+        if pattern == 'poisson':
+            next_at += sensor.random.expovariate(rate)
+        else:
+            next_at += burst / rate
+        delay = next_at - time.perf_counter()
+        if delay > 0 and stop.wait(delay):
+            break
+        if sensor.busy.is_set():
+            continue
+        for _ in range(1 if pattern == 'poisson' else burst):
+            write_line(sensor.scan())
+            emitted += 1
+            if count is not None and emitted >= count:
+                break
+        if status_interval and time.monotonic() - last_status > status_interval:
+            write_line(sensor.status_line())
+            last_status = time.monotonic()
+    return emitted
+
+
+class FakeSerial:
+    """
+    Porta serial falsa ligada a um FakeSensor: `read()` bloqueante (como
+    timeout=None), `in_waiting`, `write()` (comandos), `is_open` e `close()`.
+    `connect()` a entrega ao bridge como um transporte asyncio (FakeTransport).
+    """
+
+    def __init__(self, sensor, command_delay=0.0, baud=None, **emit_options):
+        self.sensor = sensor
+        self.command_delay = command_delay
+        # Com baud, cada escrita espera o tempo do fio (10 bits por byte), como a UART real
+        self.baud = baud
+        self.emit_options = emit_options
+        self.is_open = True
+        self.lines_written = 0
+        self.bytes_written = 0
+        self.emitted = 0
+        self.done = threading.Event()
+        self._buffer = bytearray()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._commands = framing.FrameDecoder()
+        self._thread = None
+
+    # --- Lado do "Arduino" ---
+
+    def write_line(self, line):
+        data = self.sensor.encode(line)
+        if self.baud:
+            time.sleep(len(data) * 10 / self.baud)
+        with self._cond:
+            self._buffer += data
+            self.lines_written += 1
+            self.bytes_written += len(data)
+            self._cond.notify_all()
+
+    def start(self):
+        """Imprime o boot e começa a emitir leituras numa thread."""
+        for line in self.sensor.boot_lines():
+            self.write_line(line)
+        if self.sensor.binary_capable:
+            # Como o Arduino, que só lê o primeiro dedo depois do setup(): dá ao bridge tempo de negociar
+            deadline = time.monotonic() + 1.0
+            while not self.sensor.binary and time.monotonic() < deadline:
+                time.sleep(0.005)
+        self._thread = threading.Thread(target=self._run, name='fake-sensor', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        self.emitted = emit_events(self.sensor, self.write_line, self._stop, **self.emit_options)
+        self.done.set()
+
+    # --- Interface do pyserial ---
+
+    @property
+    def in_waiting(self):
+        with self._cond:
+            return len(self._buffer)
+
+    def read(self, size=1):
+        with self._cond:
+            self._cond.wait_for(lambda: self._buffer or not self.is_open)
+            if not self.is_open:
+                raise OSError("porta fechada")
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def write(self, data):
+        if not self.is_open:
+            raise OSError("porta fechada")
+        self._commands.feed(data)
+        for command in read_commands(self._commands):
+            threading.Thread(target=self._run_command, args=(command,), daemon=True).start()
+        return len(data)
+
+    def _run_command(self, command):
+        self.sensor.busy.set()
+        try:
+            for line in self.sensor.handle_command(command):
+                if self.command_delay:
+                    time.sleep(self.command_delay)
+                self.write_line(line)
+        finally:
+            self.sensor.busy.clear()
+
+    def close(self):
+        self._stop.set()
+        with self._cond:
+            self.is_open = False
+            self._cond.notify_all()
+
+    async def connect(self, protocol_factory):
+        """Como serial_asyncio.create_serial_connection: devolve (transporte, protocolo)."""
+        if not self.is_open:
+            raise OSError("porta fechada")
+        protocol = protocol_factory()
+        transport = FakeTransport(self, protocol, asyncio.get_running_loop())
+        protocol.connection_made(transport)
+        transport.start()
+        return transport, protocol
+
+
+class FakeTransport(asyncio.Transport):
+    """
+    Transporte asyncio sobre um FakeSerial: uma thread faz o read() bloqueante
+    e entrega os bytes ao protocolo no event loop; write() vai direto para os
+    comandos do sensor. Fechar a porta (de qualquer lado) chama connection_lost.
+    """
+
+    def __init__(self, fake, protocol, loop):
+        super().__init__()
+        self.fake = fake
+        self.protocol = protocol
+        self.loop = loop
+        self._closing = False
+        self._thread = threading.Thread(target=self._read_loop, name='fake-transport', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _read_loop(self):
+        while True:
+            try:
+                data = self.fake.read(4096)
+            except OSError as e:
+                self.loop.call_soon_threadsafe(self.protocol.connection_lost, None if self._closing else e)
+                return
+            self.loop.call_soon_threadsafe(self.protocol.data_received, data)
+
+    def write(self, data):
+        self.fake.write(data)
+
+    def is_closing(self):
+        return self._closing or not self.fake.is_open
+
+    def close(self):
+        self._closing = True
+        self.fake.close()
+
+
+# --- Modo pty ---
+
+def run_pty(sensor, command_delay, **emit_options):
+    """Expõe o simulador num pty; o bridge abre o caminho impresso como porta serial."""
+    import tty
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    print(f"[Simulador] Porta serial em {os.ttyname(slave)} (use SERIAL_PORT={os.ttyname(slave)})")
+    write_lock = threading.Lock()
+
+    def write_line(line):
+        with write_lock:
+            os.write(master, sensor.encode(line))
+
+    def command_loop():
+        decoder = framing.FrameDecoder()
+        while True:
+            try:
+                decoder.feed(os.read(master, 1024))
+            except OSError:
+                return
+            for command in read_commands(decoder):
+                print(f"[Simulador] Comando recebido: {command}")
+                sensor.busy.set()
+                try:
+                    for line in sensor.handle_command(command):
+                        time.sleep(command_delay)
+                        write_line(line)
+                finally:
+                    sensor.busy.clear()
+
+    threading.Thread(target=command_loop, name='pty-commands', daemon=True).start()
+    for line in sensor.boot_lines():
+        write_line(line)
+    stop = threading.Event()
+    try:
+        emitted = emit_events(sensor, write_line, stop, **emit_options)
+        print(f"[Simulador] {emitted} leitura(s) emitida(s). Ctrl+C para sair.")
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stop.set()
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+# --- Modo benchmark ---
+
+def percentile(sorted_values, p):
+    """Percentil pelo método nearest-rank (lista já ordenada)."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def run_bench(sensors, url=None, no_django=False, verbose=False, drain_timeout=30.0, baud=None, **emit_options):
+    """
+    Alimenta o bridge (no mesmo processo, no mesmo event loop) com um
+    FakeSerial por sensor, cada um num portão (serial_bridge.Gate), e mede:
+    linhas/s lidas, bytes na serial por leitura, custo do FrameDecoder +
+    handle_arduino_message/handle_frame por mensagem e latência serial ->
+    resposta do Django (p50/p95/p99) por evento.
+    """
+    import serial_bridge
+    from bridge_logging import setup_logging, shutdown_logging
+
+    # Sem --verbose só avisos/erros do bridge aparecem
+    setup_logging('INFO' if verbose else 'WARNING', fmt='text')
+
+    if url:
+        serial_bridge.LOG_ACCESS_URL = url
+    elif not serial_bridge.LOG_ACCESS_URL or no_django:
+        serial_bridge.LOG_ACCESS_URL = 'http://simulador.invalid/api/log_access/'
+
+    latencies = []
+    dispatcher = serial_bridge.dispatcher
+    original_send = dispatcher.send_func
+
+    async def timed_send(payload, received_at):
+        ok = True if no_django else await original_send(payload, received_at)
+        latencies.append(time.time() - received_at)
+        return ok
+
+    dispatcher.send_func = timed_send
+
+    # Contabiliza o tempo gasto no event loop em cada linha
+    parse_time = [0.0, 0]
+
+    def timed(handler):
+        def wrapper(*args):
+            start = time.perf_counter()
+            handler(*args)
+            parse_time[0] += time.perf_counter() - start
+            parse_time[1] += 1
+        return wrapper
+
+    fakes = [FakeSerial(sensor, baud=baud, **emit_options) for sensor in sensors]
+
+    async def bench():
+        await serial_bridge.http_client.start()
+        dispatcher.start()
+        for i, fake in enumerate(fakes, 1):
+            gate = serial_bridge.gates[f"sim{i}"] = serial_bridge.Gate(f"sim{i}", 'simulador', baud, connect=fake.connect)
+            # Atributos da instância: data_received chama self.handle_*
+            gate.handle_arduino_message = timed(gate.handle_arduino_message)
+            gate.handle_frame = timed(gate.handle_frame)
+            gate.start()
+        while not all(gate.is_open for gate in serial_bridge.gates.values()):
+            await asyncio.sleep(0.001)
+
+        start = time.perf_counter()
+        # start() e done.wait() bloqueiam: ficam fora do loop, que segue lendo as portas
+        await asyncio.gather(*(asyncio.to_thread(fake.start) for fake in fakes))
+        await asyncio.gather(*(asyncio.to_thread(fake.done.wait) for fake in fakes))
+        emit_elapsed = time.perf_counter() - start
+        lines_written = sum(fake.lines_written for fake in fakes)
+        # Espera a leitura e os workers esvaziarem a fila
+        deadline = time.monotonic() + drain_timeout
+        while time.monotonic() < deadline:
+            if parse_time[1] >= lines_written and dispatcher.idle:
+                break
+            await asyncio.sleep(0.01)
+        total_elapsed = time.perf_counter() - start
+        # Antes de fechar: a porta fechada volta o portão para 'json'
+        protocol = ','.join(sorted({gate.protocol['mode'] for gate in serial_bridge.gates.values()}))
+        await asyncio.gather(*(gate.stop() for gate in serial_bridge.gates.values()))
+        await dispatcher.stop(0)
+        await serial_bridge.http_client.close()
+        return emit_elapsed, total_elapsed, protocol
+
+    emit_elapsed, total_elapsed, protocol = asyncio.run(bench())
+    shutdown_logging()
+
+    latencies.sort()
+    stats = dispatcher.stats()
+    emitted = sum(fake.emitted for fake in fakes)
+    print(f"[Simulador] {emitted} leitura(s) em {len(fakes)} portão(ões) em {emit_elapsed:.2f} s "
+          f"({emitted / emit_elapsed:.0f}/s emitidas); fim do processamento em {total_elapsed:.2f} s.")
+    lines_written = sum(fake.lines_written for fake in fakes)
+    bytes_written = sum(fake.bytes_written for fake in fakes)
+    bytes_per_read = bytes_written / max(lines_written, 1)
+    wire = f" = {bytes_per_read * 10 / baud * 1000:.1f} ms no fio a {baud} baud" if baud else ""
+    print(f"[Simulador] Serial ({protocol}): {bytes_written} bytes, "
+          f"{bytes_per_read:.1f} bytes/mensagem{wire}.")
+    if parse_time[1]:
+        print(f"[Simulador] Parse: {parse_time[1]} mensagem(ns), "
+              f"{parse_time[0] / parse_time[1] * 1e6:.1f} µs/mensagem no event loop.")
+    print(f"[Simulador] Fila: {stats['enqueued']} enfileirado(s), {stats['dropped']} descartado(s), "
+          f"{stats['sent']} enviado(s), {stats['failed']} falha(s).")
+    if latencies:
+        p50, p95, p99 = (percentile(latencies, p) * 1000 for p in (50, 95, 99))
+        target = "worker (sem Django)" if no_django else "resposta do Django"
+        print(f"[Simulador] Latência serial -> {target}: p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms.")
+    return {
+        'emitted': emitted,
+        'gates': len(fakes),
+        'lines': parse_time[1],
+        'protocol': protocol,
+        'bytes_per_message': bytes_per_read,
+        'parse_us_per_line': parse_time[0] / parse_time[1] * 1e6 if parse_time[1] else None,
+        'latencies': latencies,
+        'dispatch': stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulador do sensor biométrico (UFCGuard) para o bridge.")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--pty', action='store_true', help="Expõe o simulador num pseudo-terminal.")
+    mode.add_argument('--bench', action='store_true', help="Mede o bridge no mesmo processo.")
+    parser.add_argument('--rate', type=float, default=5.0, help="Leituras por segundo (média).")
+    parser.add_argument('--burst', type=int, default=1, help="Leituras por rajada (padrão steady).")
+    parser.add_argument('--pattern', choices=['steady', 'poisson'], default='steady')
+    parser.add_argument('--count', type=int, help="Para depois de N leituras.")
+    parser.add_argument('--templates', default='1-50', help="IDs gravados no sensor, ex: 1-50,60.")
+    parser.add_argument('--match-ratio', type=float, default=0.9, help="Fração de leituras com match.")
+    parser.add_argument('--enroll-fail-ratio', type=float, default=0.0)
+    parser.add_argument('--status-interval', type=float, default=5.0, help="Segundos entre [STATUS] (0 desliga).")
+    parser.add_argument('--command-delay', type=float, default=0.5,
+                        help="Pausa entre as respostas de um comando (o cadastro real leva segundos).")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--protocol', choices=['binary', 'json'], default='binary',
+                        help="json imita um firmware sem o protocolo binário.")
+    parser.add_argument('--baud', type=int, help="--bench: limita a serial falsa a esta taxa (ex: 9600).")
+    parser.add_argument('--gates', type=int, default=1,
+                        help="--bench: quantos portões (sensor + serial) ao mesmo tempo; --count é por portão.")
+    parser.add_argument('--url', help="LOG_ACCESS_URL do Django (modo --bench).")
+    parser.add_argument('--no-django', action='store_true', help="--bench sem POST: mede só o bridge.")
+    parser.add_argument('--verbose', action='store_true', help="Mostra o log INFO do bridge no --bench.")
+    args = parser.parse_args()
+
+    sensors = [
+        FakeSensor(parse_templates(args.templates), args.match_ratio, args.enroll_fail_ratio,
+                   None if args.seed is None else args.seed + i, binary=args.protocol == 'binary')
+        for i in range(max(args.gates, 1))
+    ]
+    emit_options = dict(rate=args.rate, burst=args.burst, pattern=args.pattern,
+                        count=args.count, status_interval=args.status_interval)
+    if args.pty:
+        run_pty(sensors[0], args.command_delay, **emit_options)
+        return
+    if args.count is None:
+        parser.error("--bench precisa de --count")
+    run_bench(sensors, url=args.url, no_django=args.no_django, verbose=args.verbose,
+              baud=args.baud, command_delay=args.command_delay, **emit_options)
+
+
+if __name__ == "__main__":
+    main()
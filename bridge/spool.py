@@ -0,0 +1,202 @@
+"""
+Spool local (append-only) para eventos que não puderam ser enviados ao Django.
+
+Formato: um arquivo de texto com uma linha JSON por evento
+    {"seq": 12, "payload": {...}}
+e um arquivo `.ack` com o último `seq` confirmado pelo servidor.
+
+- `append()` só escreve no buffer do arquivo; o fsync é feito em lote por uma
+  thread de fundo (a cada `fsync_interval` segundos), então quem grava nunca
+  espera o disco.
+- Uma linha incompleta no fim do arquivo (queda de energia no meio da escrita)
+  é descartada na abertura.
+- Quando tudo foi confirmado, o arquivo é truncado (os `seq` continuam
+  crescendo, pois o último fica salvo no `.ack`).
+- A posição (em bytes) do primeiro registro não confirmado fica em memória:
+  cada `read_pending()` começa dali em vez de reler o arquivo desde o início.
+- Um registro que o servidor recusa de vez (4xx) vai para `<arquivo>.rejected`
+  com `reject()` e pode então ser confirmado, sem travar os seguintes.
+"""
+import json
+import os
+import threading
+
+
+class Spool:
+
+    def __init__(self, path, fsync_interval=0.5):
+        self.path = path
+        self.ack_path = path + '.ack'
+        self.rejected_path = path + '.rejected'
+        self.rejected = 0
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._closed = threading.Event()
+        # Byte do primeiro registro com seq > acked, e onde termina cada registro já lido
+        self._offset = 0
+        self._ends = {}
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.acked = self._read_ack()
+        self.last_seq = self.acked
+        self._recover()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+        self._flusher = threading.Thread(target=self._flush_loop, name='spool-fsync', daemon=True)
+        self._flusher.start()
+
+    # --- Abertura / recuperação ---
+
+    def _read_ack(self):
+        try:
+            with open(self.ack_path, 'r', encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _recover(self):
+        """Lê o arquivo existente, descobre o último seq e remove cauda corrompida."""
+        if not os.path.exists(self.path):
+            return
+        good_size = 0
+        with open(self.path, 'rb') as f:
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(raw)
+                except ValueError:
+                    break
+                good_size += len(raw)
+                if record['seq'] <= self.acked:
+                    self._offset = good_size
+                self.last_seq = max(self.last_seq, record['seq'])
+        if good_size != os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(good_size)
+
+    # --- Escrita ---
+
+    def append(self, payload):
+        """Grava um evento no spool e retorna o seu número de sequência."""
+        with self._lock:
+            self.last_seq += 1
+            seq = self.last_seq
+            self._file.write(json.dumps({'seq': seq, 'payload': payload}, separators=(',', ':')) + '\n')
+            self._dirty = True
+        return seq
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.fsync_interval):
+            self.flush()
+
+    def flush(self):
+        """Força flush + fsync do que foi gravado desde a última vez."""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._dirty or self._file.closed:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._dirty = False
+
+    # --- Leitura / confirmação ---
+
+    def pending_count(self):
+        with self._lock:
+            return self.last_seq - self.acked
+
+    def read_pending(self, limit):
+        """Retorna até `limit` registros ainda não confirmados, em ordem de seq."""
+        records = []
+        with self._lock:
+            self._flush_locked()
+            self._ends = {}
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                position = self._offset
+                for raw in f:
+                    position += len(raw)
+                    record = json.loads(raw)
+                    if record['seq'] <= self.acked:
+                        self._offset = position
+                        continue
+                    records.append(record)
+                    self._ends[record['seq']] = position
+                    if len(records) >= limit:
+                        break
+        return records
+
+    def ack(self, seq):
+        """Marca como entregues todos os eventos até `seq` (inclusive)."""
+        with self._lock:
+            if seq <= self.acked:
+                return
+            tmp = self.ack_path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(str(seq))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.ack_path)
+            self.acked = seq
+            # Sem a posição (ack de um seq não lido), read_pending pula os confirmados
+            self._offset = self._ends.get(seq, self._offset)
+            if self.acked >= self.last_seq:
+                # Tudo entregue: compacta o arquivo
+                self._file.flush()
+                self._file.truncate(0)
+                os.fsync(self._file.fileno())
+                self._dirty = False
+                self._offset = 0
+                self._ends = {}
+
+    def reject(self, record, reason):
+        """Guarda em `.rejected` um registro que o servidor recusou (não será reenviado)."""
+        line = json.dumps(dict(record, reason=reason), separators=(',', ':')) + '\n'
+        with self._lock:
+            with open(self.rejected_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.rejected += 1
+
+    def replay(self, send_batch, batch_size=100):
+        """
+        Reenvia os eventos pendentes em lotes.
+
+        `send_batch(records)` deve retornar quantos registros do início do
+        lote foram aceitos pelo servidor. Para no primeiro lote incompleto.
+        Retorna o total reenviado.
+        """
+        total = 0
+        while True:
+            records = self.read_pending(batch_size)
+            if not records:
+                return total
+            accepted = send_batch(records)
+            if accepted:
+                self.ack(records[accepted - 1]['seq'])
+                total += accepted
+            if accepted < len(records):
+                return total
+
+    def stats(self):
+        with self._lock:
+            return {
+                'path': self.path,
+                'pending': self.last_seq - self.acked,
+                'last_seq': self.last_seq,
+                'acked': self.acked,
+                'rejected': self.rejected,
+            }
+
+    def close(self):
+        self._closed.set()
+        self.flush()
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,659 @@
+"""
+Testes do bridge (sem Arduino nem Django). Rode de dentro de bridge/:
+
+    python -m unittest tests
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import serial
+from aiohttp.test_utils import TestClient, TestServer
+
+import bridge_logging
+import framing
+from commands import CommandTracker
+import serial_bridge
+import simulator
+from spool import Spool
+
+
+def setUpModule():
+    # Os logs do bridge (reconexões, comandos) iriam para o stderr dos testes
+    logging.disable(logging.CRITICAL)
+
+
+def tearDownModule():
+    logging.disable(logging.NOTSET)
+
+
+class FakeDjango:
+    """
+    Servidor HTTP local no lugar do /api/log_access_batch/: guarda os eventos
+    recebidos e responde `status` (200 aceita o lote inteiro).
+    """
+
+    def __init__(self):
+        self.events = []
+        self.status = 200
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if fake.status == 200:
+                    fake.events.extend(body['events'])
+                self.send_response(fake.status)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api/log_access_batch/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def send_batch(self, records):
+        """Como o send_spooled_batch do bridge: todos os registros ou nenhum."""
+        data = json.dumps({'events': [r['payload'] for r in records]}).encode()
+        request = urllib.request.Request(self.url, data=data, headers={'Content-Type': 'application/json'})
+        try:
+            urllib.request.urlopen(request, timeout=5).close()
+        except urllib.error.URLError:
+            return 0
+        return len(records)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SpoolTest(unittest.TestCase):
+    """O spool sobrevive a uma queda no meio da escrita e reenvia em ordem, uma vez só."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'spool', 'events.log')
+        self.django = FakeDjango()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.addCleanup(self.django.close)
+
+    def crash(self, spool):
+        # Queda de energia: o que já foi gravado fica, mais meia linha no fim
+        spool.flush()
+        spool._closed.set()
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('{"seq": 99, "payl')
+
+    def test_replay_after_crash_drops_torn_tail(self):
+        spool = Spool(self.path, fsync_interval=60)
+        for i in range(5):
+            spool.append({'event_id': f"e{i}"})
+        self.crash(spool)
+
+        spool = Spool(self.path, fsync_interval=60)
+        self.addCleanup(spool.close)
+        self.assertEqual(spool.pending_count(), 5)
+        self.assertEqual(spool.replay(self.django.send_batch, batch_size=2), 5)
+        self.assertEqual([e['event_id'] for e in self.django.events], [f"e{i}" for i in range(5)])
+        # Tudo confirmado: o arquivo é truncado, mas os seq continuam crescendo
+        self.assertEqual(os.path.getsize(self.path), 0)
+        self.assertEqual(spool.append({'event_id': 'e5'}), 6)
+
+    def test_partial_replay_resumes_after_restart(self):
+        spool = Spool(self.path, fsync_interval=60)
+        for i in range(5):
+            spool.append({'event_id': f"e{i}"})
+        sent = []
+
+        def first_batch_only(records):
+            if sent:
+                return 0
+            sent.append(records)
+            return self.django.send_batch(records)
+
+        self.assertEqual(spool.replay(first_batch_only, batch_size=2), 2)
+        self.assertEqual(spool.read_pending(10)[0]['seq'], 3)
+        self.crash(spool)
+
+        # O .ack persistiu: depois de reabrir, só os 3 restantes voltam
+        spool = Spool(self.path, fsync_interval=60)
+        self.addCleanup(spool.close)
+        self.assertEqual([r['seq'] for r in spool.read_pending(10)], [3, 4, 5])
+        self.django.status = 503
+        self.assertEqual(spool.replay(self.django.send_batch), 0)
+        self.assertEqual(spool.pending_count(), 3)
+        self.django.status = 200
+        self.assertEqual(spool.replay(self.django.send_batch), 3)
+        self.assertEqual([e['event_id'] for e in self.django.events], [f"e{i}" for i in range(5)])
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test_read_pending_starts_after_acked_records(self):
+        spool = Spool(self.path, fsync_interval=60)
+        self.addCleanup(spool.close)
+        for i in range(4):
+            spool.append({'event_id': f"e{i}"})
+        spool.ack(spool.read_pending(2)[-1]['seq'])
+        # A leitura seguinte começa no byte do seq 3, sem reler os confirmados
+        with open(self.path, 'rb') as f:
+            f.seek(spool._offset)
+            self.assertEqual(json.loads(f.readline())['seq'], 3)
+        self.assertEqual([r['seq'] for r in spool.read_pending(10)], [3, 4])
+
+
+class SpoolReplayRejectionTest(unittest.IsolatedAsyncioTestCase):
+    """Um lote recusado (4xx) não trava o spool: é dividido e só o evento ruim fica de fora."""
+
+    async def asyncSetUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.spool = Spool(os.path.join(self.dir, 'events.log'), fsync_interval=60)
+        self.addCleanup(self.spool.close)
+        self.delivered = []
+        self.status = None
+        client = mock.Mock()
+        client.post = self.post
+        for name, value in (('spool', self.spool), ('http_client', client)):
+            patcher = mock.patch.object(serial_bridge, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def post(self, url, payload):
+        # Como o Django: o lote inteiro volta 400 se um evento for inválido
+        events = payload['events']
+        if self.status:
+            return self.status, '{}'
+        if any(event.get('bad') for event in events):
+            return 400, '{}'
+        self.delivered.extend(event['event_id'] for event in events)
+        return 200, '{}'
+
+    async def test_bad_event_is_set_aside_and_the_rest_delivered(self):
+        for i in range(5):
+            self.spool.append({'event_id': f"e{i}", 'bad': i == 2})
+        self.assertEqual(await serial_bridge.replay_spool(), 5)
+        self.assertEqual(self.delivered, ['e0', 'e1', 'e3', 'e4'])
+        self.assertEqual(self.spool.pending_count(), 0)
+        with open(self.spool.rejected_path, encoding='utf-8') as f:
+            rejected = [json.loads(line) for line in f]
+        self.assertEqual([(r['seq'], r['payload']['event_id'], r['reason']) for r in rejected], [(3, 'e2', 'HTTP 400')])
+        self.assertEqual(self.spool.stats()['rejected'], 1)
+
+    async def test_auth_failure_keeps_the_batch_for_later(self):
+        self.spool.append({'event_id': 'e0'})
+        self.status = 401
+        self.assertEqual(await serial_bridge.replay_spool(), 0)
+        self.assertEqual(self.spool.pending_count(), 1)
+        self.assertFalse(os.path.exists(self.spool.rejected_path))
+
+
+class FrameDecoderTest(unittest.TestCase):
+    """Quadros e linhas de texto misturados, quadros partidos e CRC errado."""
+
+    MATCH = {'event': 'match_found', 'sensor_id': 42, 'confidence': 187}
+
+    def decode(self, decoder, data):
+        decoder.feed(data)
+        return [framing.decode_event(value, payload) if kind == framing.FRAME else value
+                for kind, value, payload in decoder.events()]
+
+    def test_frame_split_across_reads(self):
+        decoder = framing.FrameDecoder()
+        frame = framing.encode_event(self.MATCH)
+        self.assertEqual(self.decode(decoder, frame[:1]), [])
+        self.assertEqual(self.decode(decoder, frame[1:4]), [])
+        self.assertEqual(self.decode(decoder, frame[4:]), [self.MATCH])
+        self.assertEqual(decoder.stats()['buffered'], 0)
+
+    def test_text_lines_mixed_with_frames(self):
+        decoder = framing.FrameDecoder()
+        data = (b'[BOOT] UFCGuard proto=bin1\r\n' + framing.encode_event(self.MATCH)
+                + b'[INFO] ok\n' + framing.encode_event({'event': 'match_failed'}))
+        self.assertEqual(self.decode(decoder, data),
+                         ['[BOOT] UFCGuard proto=bin1', self.MATCH, '[INFO] ok', {'event': 'match_failed'}])
+
+    def test_sof_byte_inside_a_text_line_is_text(self):
+        decoder = framing.FrameDecoder()
+        # "¥" em latin-1 é 0xA5: não pode descartar o começo da linha
+        events = self.decode(decoder, b'[DEBUG] nome \xa5 fim\n')
+        self.assertEqual(events, ['[DEBUG] nome \ufffd fim'])
+        self.assertEqual(decoder.stats()['dropped_bytes'], 0)
+
+    def test_crc_error_skips_frame_and_resyncs(self):
+        decoder = framing.FrameDecoder()
+        bad = bytearray(framing.encode_event(self.MATCH))
+        bad[-1] ^= 0xFF
+        data = bytes(bad) + framing.encode_event(self.MATCH) + bytes(bad) + b'\n[INFO] depois\n'
+        self.assertEqual(self.decode(decoder, data), [self.MATCH, '[INFO] depois'])
+        stats = decoder.stats()
+        self.assertEqual(stats['crc_errors'], 2)
+        # Os dois quadros ruins e o fim de linha que realinhou o decoder
+        self.assertEqual(stats['dropped_bytes'], 2 * len(bad) + 1)
+        self.assertEqual(stats['frames'], 1)
+
+
+async def until(condition, timeout=2.0):
+    """Espera (no event loop) até `condition()` ser verdadeira."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condição não satisfeita a tempo")
+        await asyncio.sleep(0.01)
+
+
+class FakeTransport:
+    """Transporte no lugar da porta serial: guarda o que o bridge escreve."""
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.written = bytearray()
+        self.closing = False
+
+    def write(self, data):
+        self.written += data
+
+    def is_closing(self):
+        return self.closing
+
+    def close(self):
+        self.drop(None)
+
+    def drop(self, exc):
+        # Cabo puxado (exc) ou close(): o protocolo fica sabendo pelo connection_lost
+        if not self.closing:
+            self.closing = True
+            self.protocol.connection_lost(exc)
+
+
+class FakePort:
+    """`connect` do Gate: cada abertura cria um FakeTransport; `fail` aberturas falham antes."""
+
+    def __init__(self, fail=0):
+        self.fail = fail
+        self.opened = []
+
+    async def __call__(self, protocol_factory):
+        if self.fail:
+            self.fail -= 1
+            raise serial.SerialException("porta ocupada")
+        protocol = protocol_factory()
+        transport = FakeTransport(protocol)
+        self.opened.append(transport)
+        return transport, protocol
+
+
+class MatchDispatcherTest(unittest.IsolatedAsyncioTestCase):
+    """O desligamento devolve também o payload que estava no meio do POST."""
+
+    async def test_stop_returns_in_flight_and_queued_payloads(self):
+        release = asyncio.Event()
+
+        async def send(payload, received_at):
+            await release.wait()
+            return True
+
+        dispatcher = serial_bridge.MatchDispatcher(send, workers=1, name='teste')
+        dispatcher.start()
+        for i in range(3):
+            dispatcher.submit({'event_id': f"e{i}"}, 0)
+        await until(lambda: dispatcher.in_flight)
+
+        leftover = await dispatcher.stop(timeout=0.05)
+        self.assertEqual([p['event_id'] for p in leftover], ['e0', 'e1', 'e2'])
+        self.assertTrue(dispatcher.idle)
+        self.assertEqual(dispatcher.current, {})
+        self.assertEqual(dispatcher.sent, 0)
+
+    async def test_stop_after_everything_was_sent_returns_nothing(self):
+        async def send(payload, received_at):
+            return True
+
+        dispatcher = serial_bridge.MatchDispatcher(send, workers=2, name='teste')
+        dispatcher.start()
+        for i in range(5):
+            dispatcher.submit({'event_id': f"e{i}"}, 0)
+        self.assertEqual(await dispatcher.stop(timeout=1), [])
+        self.assertEqual(dispatcher.sent, 5)
+
+
+class GateRuntimeTest(unittest.IsolatedAsyncioTestCase):
+    """Gate no event loop: abre a porta (com retry), negocia o binário e reconecta quando ela cai."""
+
+    async def asyncSetUp(self):
+        for name, value in (('SERIAL_RECONNECT_MIN', 0.01), ('SERIAL_RECONNECT_MAX', 0.02)):
+            patcher = mock.patch.object(serial_bridge, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.port = FakePort(fail=2)
+        self.gate = serial_bridge.Gate('portaria', 'FAKE', connect=self.port)
+        self.gate.start()
+        self.addAsyncCleanup(self.gate.stop)
+        await until(lambda: self.gate.is_open)
+
+    async def test_open_is_retried_until_the_port_appears(self):
+        self.assertEqual(len(self.port.opened), 1)
+        self.assertEqual(self.port.fail, 0)
+        self.assertEqual(self.gate.reconnects, 0)
+
+    async def test_binary_negotiation_and_reconnect_back_to_json(self):
+        transport = self.port.opened[0]
+        self.gate.data_received(b'[BOOT] UFCGuard proto=bin1\r\n')
+        self.assertEqual(bytes(transport.written), b'PROTO:BIN:1\n')
+        self.gate.data_received(framing.encode_frame(framing.EV_HELLO, bytes((1,)) + (7).to_bytes(2, 'little')))
+        self.assertEqual(self.gate.protocol['mode'], 'binary')
+        self.assertEqual(self.gate.sensor_info['template_count'], 7)
+
+        tracked, _ = self.gate.dispatch_command('DELETE:5')
+        self.assertEqual(bytes(transport.written[-6:]), framing.encode_command('DELETE:5'))
+
+        transport.drop(OSError("cabo USB desconectado"))
+        await until(lambda: len(self.port.opened) == 2 and self.gate.is_open)
+        self.assertEqual(self.gate.reconnects, 1)
+        self.assertEqual(self.gate.protocol['mode'], 'json')
+        self.assertEqual(tracked.state, 'failed')
+        # A nova conexão começa com um decoder limpo, em texto
+        self.gate.dispatch_command('SLOTS')
+        self.assertEqual(bytes(self.port.opened[1].written), b'SLOTS\n')
+
+    async def test_stop_does_not_reconnect(self):
+        await self.gate.stop()
+        self.assertFalse(self.gate.is_open)
+        self.assertEqual(len(self.port.opened), 1)
+        self.assertEqual(self.gate.reconnects, 0)
+
+
+@mock.patch.object(serial_bridge, 'SENSOR_STATUS_URL', None)
+class CommandRoutesTest(unittest.IsolatedAsyncioTestCase):
+    """Rotas aiohttp do bridge contra um portão com porta falsa."""
+
+    async def asyncSetUp(self):
+        self.port = FakePort()
+        self.gate = serial_bridge.Gate('portaria', 'FAKE', connect=self.port)
+        self.gate.start()
+        self.addAsyncCleanup(self.gate.stop)
+        await until(lambda: self.gate.is_open)
+        patcher = mock.patch.dict(serial_bridge.gates, {'portaria': self.gate}, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = TestClient(TestServer(serial_bridge.build_app()))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def test_command_waits_for_the_arduino_status(self):
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.05, self.gate.data_received, b'{"status":"delete_success", "id":5}\n')
+        response = await self.client.post('/command', json={'command': 'delete:5', 'command_id': 'django-1', 'wait': 2})
+        self.assertEqual(response.status, 200)
+        body = await response.json()
+        self.assertEqual((body['command_id'], body['state'], body['gate']), ('django-1', 'success', 'portaria'))
+        self.assertEqual(bytes(self.port.opened[0].written), b'DELETE:5\n')
+
+        # Retry do Django com o mesmo command_id: não escreve de novo
+        response = await self.client.post('/command', json={'command': 'DELETE:5', 'command_id': 'django-1'})
+        self.assertTrue((await response.json())['duplicate'])
+        self.assertEqual(bytes(self.port.opened[0].written), b'DELETE:5\n')
+
+        response = await self.client.get('/command/django-1')
+        self.assertEqual((await response.json())['state'], 'success')
+
+    async def test_command_without_wait_answers_202(self):
+        response = await self.client.post('/command', json={'command': 'ENROLL:3'})
+        self.assertEqual(response.status, 202)
+        self.assertEqual((await response.json())['state'], 'sent')
+
+    async def test_unknown_gate_and_missing_command(self):
+        response = await self.client.post('/command', json={'command': 'SLOTS', 'gate': 'garagem'})
+        self.assertEqual(response.status, 404)
+        response = await self.client.post('/command', data=b'nao e json')
+        self.assertEqual(response.status, 400)
+        response = await self.client.post('/command', json={'command': 'SLOTS', 'wait': 'logo'})
+        self.assertEqual(response.status, 400)
+        response = await self.client.post('/command', json={'command': 'SLOTS', 'wait': [1]})
+        self.assertEqual(response.status, 400)
+        self.assertEqual(bytes(self.port.opened[0].written), b'')
+        response = await self.client.get('/command/nao-existe')
+        self.assertEqual(response.status, 404)
+
+    async def test_health_and_slots(self):
+        response = await self.client.get('/slots')
+        self.assertEqual(response.status, 404)
+        bitmap = (1 << 2 | 1 << 9).to_bytes(32, 'little').hex().upper()
+        self.gate.data_received(framing.encode_event({'status': 'slots', 'count': 2, 'bitmap': bitmap}))
+        response = await self.client.get('/slots')
+        self.assertEqual((await response.json())['ids'], [2, 9])
+
+        response = await self.client.get('/health')
+        body = await response.json()
+        self.assertTrue(body['serial_open'])
+        self.assertEqual(list(body['gates']), ['portaria'])
+
+
+class FakeSensorTest(unittest.TestCase):
+    """O simulador responde aos comandos como o UFCGuard.ino."""
+
+    def test_enroll_delete_and_slots(self):
+        sensor = simulator.FakeSensor(templates={1}, seed=1)
+        lines = sensor.handle_command('ENROLL:9')
+        self.assertEqual(json.loads(lines[0]), {'status': 'enroll_starting', 'id': 9})
+        self.assertEqual(json.loads(lines[-1]), {'status': 'enroll_success', 'id': 9})
+        self.assertEqual(json.loads(sensor.handle_command('DELETE:1')[0])['status'], 'delete_success')
+        self.assertEqual(json.loads(sensor.handle_command('DELETE:1')[0])['status'], 'delete_failed')
+        slots = json.loads(sensor.handle_command('SLOTS')[0])
+        self.assertEqual(slots['count'], 1)
+        self.assertEqual(int.from_bytes(bytes.fromhex(slots['bitmap']), 'little'), 1 << 9)
+        self.assertEqual(sensor.handle_command('DELETE_ALL'), ['{"status":"delete_all_success"}'])
+        self.assertEqual(sensor.templates, set())
+
+    def test_binary_only_after_negotiation(self):
+        sensor = simulator.FakeSensor(templates={3})
+        self.assertIn('proto=bin1', sensor.boot_lines()[0])
+        self.assertEqual(sensor.encode('{"event":"match_failed"}'), b'{"event":"match_failed"}\r\n')
+        hello = sensor.handle_command('PROTO:BIN:1')[0]
+        self.assertEqual(hello, framing.encode_frame(framing.EV_HELLO, b'\x01\x01\x00'))
+        self.assertEqual(sensor.encode('{"event":"match_failed"}'), framing.encode_event({'event': 'match_failed'}))
+
+        old = simulator.FakeSensor(binary=False)
+        self.assertNotIn('proto=', old.boot_lines()[0])
+        self.assertEqual(old.handle_command('PROTO:BIN:1'), [])
+
+    def test_emit_events_burst_count(self):
+        sensor = simulator.FakeSensor(templates={4, 5}, match_ratio=1.0, seed=2)
+        lines = []
+        emitted = simulator.emit_events(sensor, lines.append, threading.Event(), rate=10000, burst=4,
+                                        count=10, status_interval=0)
+        self.assertEqual(emitted, 10)
+        self.assertLessEqual({json.loads(line)['sensor_id'] for line in lines}, {4, 5})
+
+    def test_parse_templates_and_percentile(self):
+        self.assertEqual(simulator.parse_templates('1-3,7,0,500'), {1, 2, 3, 7})
+        self.assertEqual(simulator.percentile([1, 2, 3, 4], 50), 2)
+        self.assertEqual(simulator.percentile([1, 2, 3, 4], 99), 4)
+        self.assertIsNone(simulator.percentile([], 50))
+
+
+class SimulatorBridgeTest(unittest.IsolatedAsyncioTestCase):
+    """Gate do bridge ligado a um FakeSerial: boot, negociação, leituras e um cadastro de ponta a ponta."""
+
+    async def asyncSetUp(self):
+        self.dispatcher = mock.Mock()
+        for name, value in (('LOG_ACCESS_URL', 'http://django/api/log_access/'), ('SENSOR_STATUS_URL', None),
+                            ('dispatcher', self.dispatcher)):
+            patcher = mock.patch.object(serial_bridge, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        sensor = simulator.FakeSensor(templates={4, 5}, match_ratio=1.0, seed=3)
+        self.fake = simulator.FakeSerial(sensor, rate=1000, count=3, status_interval=0)
+        self.gate = serial_bridge.Gate('portaria', 'FAKE', connect=self.fake.connect)
+        self.gate.start()
+        self.addAsyncCleanup(self.gate.stop)
+        await until(lambda: self.gate.is_open)
+        # start() espera (bloqueando) a negociação do binário: fora do event loop
+        await asyncio.to_thread(self.fake.start)
+
+    async def test_matches_reach_the_dispatcher_in_binary(self):
+        await until(lambda: self.dispatcher.submit.call_count == 3)
+        self.assertEqual(self.gate.protocol['mode'], 'binary')
+        self.assertEqual(self.gate.sensor_info['template_count'], 2)
+        payloads = [c.args[0] for c in self.dispatcher.submit.call_args_list]
+        self.assertTrue(all(p['gate'] == 'portaria' and p['sensor_id'] in (4, 5) for p in payloads))
+        self.assertEqual(len({p['event_id'] for p in payloads}), 3)
+
+    async def test_enroll_round_trip(self):
+        await until(lambda: self.fake.done.is_set())
+        tracked, _ = self.gate.dispatch_command('ENROLL:9')
+        self.assertTrue(await self.gate.commands.wait(tracked, 2))
+        self.assertEqual((tracked.state, tracked.etapa), ('success', 'enroll_success'))
+        self.assertIn(9, self.fake.sensor.templates)
+
+
+class BridgeLoggingTest(unittest.TestCase):
+    """Log em JSON por uma fila: amostragem das linhas repetitivas e descarte com a fila cheia."""
+
+    def setUp(self):
+        logging.disable(logging.NOTSET)
+        self.addCleanup(logging.disable, logging.CRITICAL)
+        root = logging.getLogger()
+        self.addCleanup(setattr, root, 'handlers', list(root.handlers))
+        self.addCleanup(root.setLevel, root.level)
+        self.addCleanup(bridge_logging.shutdown_logging)
+
+    def record(self, msg='linha', **extra):
+        record = logging.LogRecord('bridge.arduino', logging.INFO, __file__, 1, msg, (), None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_json_lines_with_extra_fields_and_sampling(self):
+        stream = io.StringIO()
+        bridge_logging.setup_logging('INFO', 'json', sample_every=3, stream=stream)
+        logger = logging.getLogger('bridge.teste')
+        for i in range(7):
+            logger.info("[STATUS] Ativo...", extra={'sample': 'status:portaria', 'i': i})
+        logger.info("Comando enviado", extra={'command': 'DELETE:5'})
+        logger.debug("abaixo do nível")
+        bridge_logging.shutdown_logging()
+
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        status = [line for line in lines if line['msg'] == "[STATUS] Ativo..."]
+        self.assertEqual([line['i'] for line in status], [0, 3, 6])
+        self.assertTrue(all(line['sampled_1_in'] == 3 and 'sample' not in line for line in status))
+        self.assertEqual(lines[-1]['command'], 'DELETE:5')
+        self.assertEqual((lines[-1]['level'], lines[-1]['logger']), ('INFO', 'bridge.teste'))
+
+    def test_sampling_is_per_key(self):
+        sampler = bridge_logging.SamplingFilter(2)
+        kept = [sampler.filter(self.record(sample=key)) for key in ('a', 'b', 'a', 'b', 'a')]
+        self.assertEqual(kept, [True, True, False, False, True])
+        self.assertTrue(sampler.filter(self.record()))
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = bridge_logging.DroppingQueueHandler(queue.Queue(maxsize=2))
+        for i in range(5):
+            handler.handle(self.record(f"linha {i}"))
+        self.assertEqual(handler.queue.qsize(), 2)
+        self.assertEqual(handler.dropped, 3)
+
+    def test_exception_is_formatted_before_queueing(self):
+        handler = bridge_logging.DroppingQueueHandler(queue.Queue())
+        try:
+            raise ValueError("falhou")
+        except ValueError:
+            record = logging.LogRecord('bridge', logging.ERROR, __file__, 1, "erro %s", ('x',), sys.exc_info())
+        handler.handle(record)
+        queued = handler.queue.get_nowait()
+        self.assertEqual((queued.msg, queued.exc_info), ("erro x", None))
+        self.assertIn("ValueError: falhou", bridge_logging.JsonFormatter().format(queued))
+
+
+class CommandTrackerTest(unittest.IsolatedAsyncioTestCase):
+    """Status do Arduino casados com os comandos na ordem de envio; sem resposta, timeout."""
+
+    async def test_status_lines_match_oldest_command_of_the_same_action(self):
+        tracker = CommandTracker()
+        first, _ = tracker.register('DELETE:5', 'c1')
+        second, _ = tracker.register('DELETE:5', 'c2')
+        enroll, _ = tracker.register('ENROLL:7', 'c3')
+
+        self.assertIs(tracker.match({'status': 'enroll_starting', 'id': 7}), enroll)
+        self.assertEqual(enroll.state, 'running')
+        self.assertIs(tracker.match({'status': 'delete_success', 'id': 5}), first)
+        self.assertIs(tracker.match({'status': 'delete_failed', 'id': 5, 'msg': 'Erro'}), second)
+        self.assertEqual((first.state, second.state, second.msg), ('success', 'failed', 'Erro'))
+        self.assertIs(tracker.match({'status': 'enroll_success', 'id': 7}), enroll)
+
+        # Nada mais em andamento: a linha não é de nenhum comando
+        self.assertIsNone(tracker.match({'status': 'delete_success', 'id': 5}))
+        self.assertIsNone(tracker.match({'status': 'desconhecido'}))
+        self.assertEqual(tracker.stats()['unmatched'], 1)
+
+    async def test_sensor_id_skips_commands_for_other_slots(self):
+        tracker = CommandTracker()
+        other, _ = tracker.register('DELETE:3')
+        target, _ = tracker.register('DELETE:8')
+        self.assertIs(tracker.match({'status': 'delete_success', 'id': 8}), target)
+        self.assertEqual(other.state, 'sent')
+        # Linha sem id (ex: prompt) fica com o mais antigo
+        self.assertIs(tracker.match({'status': 'delete_failed'}), other)
+
+    async def test_same_command_id_is_not_registered_twice(self):
+        tracker = CommandTracker()
+        tracked, created = tracker.register('SLOTS', 'django-1')
+        again, created_again = tracker.register('SLOTS', 'django-1')
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertIs(again, tracked)
+        self.assertIs(tracker.get('django-1'), tracked)
+
+    async def test_commands_without_answer_expire(self):
+        tracker = CommandTracker(timeout=90)
+        stale, _ = tracker.register('ENROLL:1')
+        fresh, _ = tracker.register('ENROLL:2')
+        stale.sent_at -= 91
+        # A resposta que chega depois do timeout vai para o comando ainda em andamento
+        self.assertIs(tracker.match({'status': 'enroll_prompt_1'}), fresh)
+        self.assertEqual((stale.state, stale.msg), ('timeout', "Sem resposta do Arduino"))
+        self.assertTrue(stale.done.is_set())
+
+    async def test_wait_returns_when_finished_or_on_timeout(self):
+        tracker = CommandTracker(timeout=0.05)
+        tracked, _ = tracker.register('DELETE:4')
+        asyncio.get_running_loop().call_later(0.01, tracker.match, {'status': 'delete_success', 'id': 4})
+        self.assertTrue(await tracker.wait(tracked, 1))
+        self.assertEqual(tracked.state, 'success')
+
+        pending, _ = tracker.register('DELETE:6')
+        self.assertFalse(await tracker.wait(pending, 0.01))
+        self.assertEqual(pending.state, 'sent')
+        # Passado o timeout do tracker, a espera seguinte marca o comando como timeout
+        self.assertTrue(await tracker.wait(pending, 0.06))
+        self.assertEqual(pending.state, 'timeout')
+
+    async def test_fail_all_and_trim_keep_in_progress_commands(self):
+        tracker = CommandTracker(keep=2)
+        running, _ = tracker.register('ENROLL:1')
+        deletes = []
+        for i in range(3):
+            deletes.append(tracker.register(f'DELETE:{i + 10}')[0])
+            tracker.match({'status': 'delete_success', 'id': i + 10})
+        # Os finalizados mais antigos saem; o cadastro em andamento fica
+        self.assertEqual([tracker.get(c.command_id) for c in deletes], [None, None, deletes[2]])
+        self.assertIs(tracker.get(running.command_id), running)
+        tracker.fail_all("Arduino reiniciou")
+        self.assertEqual((running.state, running.msg), ('failed', "Arduino reiniciou"))
+
+
+if __name__ == '__main__':
+    unittest.main()